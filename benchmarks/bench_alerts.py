@@ -0,0 +1,105 @@
+"""
+Benchmark checking the alert thresholds for many devices: the rule table and health matrix
+(one vectorized pass) against calling send_alert for each device.
+
+Usage: python -m benchmarks.bench_alerts [num_devices]
+"""
+
+import sys
+import time
+import random
+from collections import defaultdict
+
+from nvme_mon.alert_manager import AlertManager, device_history
+
+THRESHOLDS = {
+    "num_err_log_entries": 0,
+    "unsafe_shutdowns": 0,
+    "percentage_used": 50,
+    "media_errors": 0,
+    "health_score": 90,
+    "mean_temperature": 70,
+}
+SETTINGS = {"alert_interval": "1w", "rate_limit": 20, "digest": True}
+RUNS = 20
+
+
+class CountingSender:
+    """Stands in for EmailSender and AlertDispatcher, counting the emails instead of sending them"""
+
+    def __init__(self):
+        self.sent = 0
+        self.depth = 0
+
+    def set_rate_limit(self, rate_limit):
+        pass
+
+    def submit(self, subject, body):
+        self.sent += 1
+
+
+def health_infos(num_devices):
+    """Mostly healthy devices. About 1% are beyond one threshold."""
+    random.seed(0)
+    infos = {}
+    for i in range(num_devices):
+        info = {
+            "power_on_hours": random.randint(100, 20000),
+            "unsafe_shutdowns": 0,
+            "media_errors": 0,
+            "num_err_log_entries": 0,
+            "percentage_used": random.randint(0, 40),
+            "health_score": random.randint(95, 100),
+            "mean_temperature": random.randint(30, 60),
+        }
+        if random.random() < 0.01:
+            info[random.choice(list(THRESHOLDS))] = 100 if random.random() < 0.5 else 1
+        infos[f"nvme-{i:06d}"] = info
+    return infos
+
+
+def manager():
+    alert_manager = AlertManager(None)
+    alert_manager.sender = alert_manager.dispatcher = CountingSender()
+    alert_manager.set_config(THRESHOLDS, SETTINGS)
+    return alert_manager
+
+
+def run(check, alert_manager):
+    """Seconds per check of all devices, starting each time from an empty alert history"""
+    total = 0
+    for _ in range(RUNS):
+        alert_manager._history = defaultdict(device_history)
+        alert_manager.digest = []
+        start = time.perf_counter()
+        check()
+        total += time.perf_counter() - start
+    return total / RUNS
+
+
+def main():
+    num_devices = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    infos = health_infos(num_devices)
+
+    per_device = manager()
+    per_device_sec = run(lambda: [per_device.send_alert(name, info) for name, info in infos.items()], per_device)
+
+    table = manager()
+    start = time.perf_counter()
+    for name, info in infos.items():
+        table.update_health(name, info)
+    load_sec = time.perf_counter() - start
+    if table.rule_table is None:
+        print("NumPy is not installed, check_all falls back to send_alert per device")
+    table_sec = run(table.check_all, table)
+
+    alerted = sum(len(lines) for _, lines in table.digest)
+    assert table.digest == per_device.digest, "the two paths alerted differently"
+    print(f"{num_devices} devices, {len(table.digest)} alerted on {alerted} fields")
+    print(f"send_alert per device:   {per_device_sec * 1000:8.2f} ms per check")
+    print(f"rule table, check_all:   {table_sec * 1000:8.2f} ms per check ({per_device_sec / table_sec:.1f}x)")
+    print(f"update_health, all rows: {load_sec * 1000:8.2f} ms (once; afterwards only for devices with new records)")
+
+
+if __name__ == "__main__":
+    main()
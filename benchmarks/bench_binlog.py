@@ -0,0 +1,49 @@
+"""
+Benchmark scanning the binary log format against the JSONL log with the fast-path decoder.
+
+Usage: python -m benchmarks.bench_binlog [num_lines]
+"""
+
+import os
+import sys
+import time
+import tempfile
+
+from nvme_mon.binlog import BinLogFollower, convert
+from nvme_mon.log_follower import LogFollower
+from benchmarks.generate_log import write_health_log
+
+NUM_DEVICES = 4
+
+
+def scan(follower):
+    count = 0
+    for _ in follower.read_new_records():
+        count += 1
+    return count
+
+
+def run(follower):
+    start = time.perf_counter()
+    count = scan(follower)
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    num_lines = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        json_path = os.path.join(tmp_dir, "nvme_health.json")
+        bin_path = os.path.join(tmp_dir, "nvme_health.bin")
+        write_health_log(json_path, NUM_DEVICES, num_lines)
+        convert(json_path, bin_path)
+        json_mb = os.path.getsize(json_path) / (1 << 20)
+        bin_mb = os.path.getsize(bin_path) / (1 << 20)
+        print(f"{num_lines} records, JSONL {json_mb:.1f} MB, binary {bin_mb:.1f} MB ({json_mb / bin_mb:.1f}x smaller)")
+        jsonl = run(LogFollower(json_path))
+        binary = run(BinLogFollower(bin_path))
+        print(f"JSONL, fast-path decoder: {jsonl:12,.0f} records/sec")
+        print(f"binary, mmap:             {binary:12,.0f} records/sec ({binary / jsonl:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Benchmark the fast-path log record decoder against the original json.loads/strptime loop.
+
+Usage: python -m benchmarks.bench_decoder [num_lines]
+"""
+
+import os
+import sys
+import json
+import time
+import tempfile
+from datetime import datetime
+
+from nvme_mon.log_follower import LogFollower
+from nvme_mon.record_decoder import DATE_FORMAT, decode_record
+from benchmarks.generate_log import write_health_log
+
+NUM_DEVICES = 4
+
+
+def baseline(path):
+    """The per-line work done by the original parse_log_file"""
+    count = 0
+    with open(path, "r") as f:
+        for line in f:
+            record = json.loads(line)
+            datetime.strptime(record["timestamp"], DATE_FORMAT)
+            datetime.strptime(record["timestamp"], DATE_FORMAT)
+            datetime.strptime(record["timestamp"], DATE_FORMAT)
+            count += 1
+    return count
+
+
+def fast_path(path):
+    count = 0
+    for line in LogFollower(path).read_new_lines():
+        decode_record(line)
+        count += 1
+    return count
+
+
+def run(func, path):
+    start = time.perf_counter()
+    count = func(path)
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    num_lines = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "nvme_health.json")
+        write_health_log(path, NUM_DEVICES, num_lines)
+        size_mb = os.path.getsize(path) / (1 << 20)
+        print(f"{num_lines} lines, {size_mb:.1f} MB")
+        base = run(baseline, path)
+        fast = run(fast_path, path)
+        print(f"json.loads + strptime: {base:12,.0f} lines/sec")
+        print(f"fast-path decoder:     {fast:12,.0f} lines/sec ({fast / base:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
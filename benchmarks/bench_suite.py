@@ -0,0 +1,172 @@
+"""
+Benchmark suite for the client's hot paths, on synthetic logs of several sizes (see
+benchmarks.generate_log), with the results written as JSON so runs on different commits can be
+compared.
+
+For each log size:
+    parse_log_file  NvmeMon.parse_log_file, a full parse of the log into the device state
+    get_temp_info   NvmeMon.get_temp_info for each device
+    send_alert      AlertManager.send_alert for each device, the emails counted by a stub sender
+    print_histogram rich_ui.print_histogram of each device's full histogram, to /dev/null
+    print_disk_info rich_ui.print_disk_info of each device's health info, to /dev/null
+
+Each result gives the time per call, the best of several runs. The generated logs are written
+to a temporary directory, or kept in --data-dir to be reused by later runs.
+
+Usage: python -m benchmarks.bench_suite [--sizes 10000 100000 ...] [--output results.json]
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import subprocess
+from collections import defaultdict
+from datetime import datetime
+
+import yaml
+
+from nvme_mon import rich_ui
+from nvme_mon.app import CONFIG_FILE_NAME, NvmeMon
+from nvme_mon.alert_manager import device_history
+from nvme_mon.paths import resource_path
+from benchmarks.bench_alerts import manager
+from benchmarks.generate_log import write_health_log
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+NUM_DEVICES = 8
+# Runs per benchmark. Full parses get fewer runs as the log grows, down to one at RUN_LINES.
+RUNS = 20
+RUN_LINES = 1_000_000
+
+
+class BenchMon(NvmeMon):
+    """NvmeMon on a given log, parsed only when the benchmark asks, without a snapshot or an alert loop"""
+
+    def load_log_state(self):
+        pass
+
+    def save_snapshot(self):
+        pass
+
+    def run_alert_loop(self):
+        pass
+
+
+def write_config(path, log_file):
+    """The bundled config, reading log_file alone"""
+    with open(resource_path(CONFIG_FILE_NAME)) as f:
+        config = yaml.safe_load(f)
+    config["LOG_FILE_NAME"] = log_file
+    config["INCLUDE_ROTATED_LOGS"] = False
+    config.pop("LIVE_SOCKET", None)
+    with open(path, "w") as f:
+        yaml.safe_dump(config, f)
+
+
+def best_time(func, runs):
+    """Best wall time of func over runs calls, in seconds"""
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_size(num_lines, data_dir):
+    log_file = os.path.join(data_dir, f"nvme_health_{num_lines}_{NUM_DEVICES}.json")
+    if not os.path.exists(log_file):
+        print(f"Generating {log_file}", file=sys.stderr)
+        write_health_log(log_file + ".tmp", NUM_DEVICES, num_lines)
+        os.replace(log_file + ".tmp", log_file)
+    config_file = os.path.join(data_dir, "config.yaml")
+    write_config(config_file, log_file)
+
+    mon = BenchMon(headless=True, config_file=config_file)
+    results = []
+
+    def result(name, seconds, calls, runs=RUNS):
+        print(f"{num_lines:>10} lines  {name:<16} {seconds / calls * 1e6:14.1f} us per call", file=sys.stderr)
+        results.append({
+            "name": name,
+            "lines": num_lines,
+            "devices": NUM_DEVICES,
+            "runs": runs,
+            "calls": calls,
+            "sec_per_call": seconds / calls,
+        })
+
+    parse_runs = max(1, min(RUNS, RUN_LINES // num_lines))
+    result("parse_log_file", best_time(mon.parse_log_file, parse_runs), 1, parse_runs)
+    devices = list(mon.devices)
+
+    result("get_temp_info", best_time(lambda: [mon.get_temp_info(device) for device in devices], RUNS), len(devices))
+
+    alert_manager = manager()
+    health_infos = [(os.path.basename(device), mon.devices[device]["health_info"]) for device in devices]
+
+    def send_alerts():
+        # From an empty alert history, so every breach is alerted on
+        alert_manager._history = defaultdict(device_history)
+        alert_manager.digest = []
+        for device_name, health_info in health_infos:
+            alert_manager.send_alert(device_name, health_info)
+    result("send_alert", best_time(send_alerts, RUNS), len(devices))
+
+    histograms = [mon.devices[device]["histogram_index"].rows() for device in devices]
+    result("print_histogram", best_time(
+        lambda: [rich_ui.print_histogram(dict(rows), results_scope="all") for rows in histograms], RUNS), len(devices))
+    result("print_disk_info", best_time(
+        lambda: [rich_ui.print_disk_info(mon.devices[device]["health_info"]) for device in devices], RUNS), len(devices))
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the nvme_mon client's hot paths")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="log sizes, in lines")
+    parser.add_argument("--data-dir", help="directory to keep the generated logs in (default: a temporary directory)")
+    parser.add_argument("--output", help="file to write the JSON results to (default: stdout)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    output = {
+        "commit": git_commit(),
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": [],
+    }
+    # The rendering benchmarks measure building and rendering the panels, not the terminal
+    with open(os.devnull, "w") as devnull, tempfile.TemporaryDirectory() as tmp_dir:
+        rich_ui.console.file = devnull
+        data_dir = args.data_dir or tmp_dir
+        os.makedirs(data_dir, exist_ok=True)
+        for num_lines in args.sizes:
+            output["results"].extend(bench_size(num_lines, data_dir))
+        rich_ui.console.file = sys.stdout
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(output, f, indent=2)
+    else:
+        json.dump(output, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Deterministic generator of realistic NVME health logs, for the benchmarks.
+
+Each line is built by the collector's own extract_health from synthetic id-ctrl and smart-log
+data, so it has exactly the fields the collector writes. Devices are sampled together every
+interval seconds, as the collector does for devices at a steady temperature. Each device has
+its own idle temperature, a daily cycle, noise and occasional load bursts, a power-on hour
+count and wear level that grow with time, and rare unsafe shutdowns and error log entries.
+The same arguments always give the same file.
+
+Usage: python -m benchmarks.generate_log PATH --devices N --days M
+"""
+
+import json
+import math
+import random
+import argparse
+from datetime import datetime, timedelta
+
+from nvme_monitor import MAX_INTERVAL_SEC, extract_health
+
+START = datetime(2025, 1, 1)
+MODELS = [
+    ("Samsung SSD 990 PRO 2TB", "4B2QJXD7"),
+    ("Samsung SSD 980 PRO 1TB", "5B2QGXA7"),
+    ("WD_BLACK SN850X 2000GB", "620311WD"),
+    ("CT2000P5PSSD8", "P7CR403"),
+    ("KINGSTON SNV2S1000G", "SBI02102"),
+]
+KELVIN = 273.15
+BURST_PROBABILITY = 0.002
+SHUTDOWN_PROBABILITY = 0.00002
+ERROR_PROBABILITY = 0.0001
+
+
+def make_devices(num_devices, rng):
+    devices = []
+    for i in range(num_devices):
+        model, firmware = MODELS[i % len(MODELS)]
+        serial = f"S{rng.randrange(16 ** 11):011X}"
+        devices.append({
+            "device": f"/dev/disk/by-id/nvme-{model.replace(' ', '_')}_{serial}",
+            "id_ctrl": {"mn": model, "sn": serial, "fr": firmware},
+            "idle_temp": rng.uniform(32, 48),
+            "daily_swing": rng.uniform(2, 8),
+            "phase": rng.uniform(0, 2 * math.pi),
+            "burst": 0, # samples of the current load burst left
+            "power_on_hours": rng.randint(100, 20000),
+            "percent_used": rng.uniform(0, 20),
+            "wear_per_day": rng.uniform(0.005, 0.05),
+            "unsafe_shutdowns": rng.randint(0, 20),
+            "media_errors": 0,
+            "num_err_log_entries": rng.randint(0, 5),
+        })
+    return devices
+
+
+def smart_log(device, elapsed_sec, rng):
+    """A smart-log for the device, elapsed_sec after the start of the log"""
+    day_fraction = (elapsed_sec % 86400) / 86400
+    temp = device["idle_temp"] + device["daily_swing"] * math.sin(2 * math.pi * day_fraction + device["phase"])
+    if device["burst"]:
+        device["burst"] -= 1
+        temp += 25
+    elif rng.random() < BURST_PROBABILITY:
+        device["burst"] = rng.randint(1, 12)
+    temp += rng.gauss(0, 1.5)
+    if rng.random() < SHUTDOWN_PROBABILITY:
+        device["unsafe_shutdowns"] += 1
+    if rng.random() < ERROR_PROBABILITY:
+        device["num_err_log_entries"] += 1
+        if rng.random() < 0.05:
+            device["media_errors"] += 1
+    return {
+        "critical_warning": 0,
+        "temperature": round(temp + KELVIN),
+        "temperature_sensor_1": round(temp + 2 + KELVIN),
+        "temperature_sensor_2": round(temp - 3 + KELVIN),
+        "power_on_hours": device["power_on_hours"] + elapsed_sec // 3600,
+        "unsafe_shutdowns": device["unsafe_shutdowns"],
+        "media_errors": device["media_errors"],
+        "num_err_log_entries": device["num_err_log_entries"],
+        "percent_used": int(device["percent_used"] + device["wear_per_day"] * elapsed_sec / 86400),
+    }
+
+
+def health_records(num_devices, num_lines, interval=MAX_INTERVAL_SEC, seed=0):
+    """Yield num_lines health records for num_devices devices, oldest first"""
+    rng = random.Random(seed)
+    devices = make_devices(num_devices, rng)
+    for i in range(num_lines):
+        device = devices[i % num_devices]
+        elapsed_sec = interval * (i // num_devices)
+        yield extract_health(device["device"], device["id_ctrl"], smart_log(device, elapsed_sec, rng),
+                             START + timedelta(seconds=elapsed_sec))
+
+
+def lines_for_days(num_devices, num_days, interval=MAX_INTERVAL_SEC):
+    return num_devices * (num_days * 86400 // interval)
+
+
+def write_health_log(path, num_devices, num_lines, interval=MAX_INTERVAL_SEC, seed=0):
+    with open(path, "w") as f:
+        for entry in health_records(num_devices, num_lines, interval, seed):
+            f.write(json.dumps(entry) + "\n")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Write a synthetic NVME health log (JSON lines)")
+    parser.add_argument("path", help="log file to write")
+    parser.add_argument("--devices", type=int, default=4, help="number of devices")
+    parser.add_argument("--days", type=int, default=30, help="days of history")
+    parser.add_argument("--lines", type=int, help="number of lines to write, instead of --days")
+    parser.add_argument("--interval", type=int, default=MAX_INTERVAL_SEC, help="seconds between samples of a device")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    num_lines = args.lines or lines_for_days(args.devices, args.days, args.interval)
+    write_health_log(args.path, args.devices, num_lines, args.interval, args.seed)
+    print(f"Wrote {num_lines} lines for {args.devices} devices to {args.path}")
+
+
+if __name__ == "__main__":
+    main()
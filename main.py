@@ -1,6 +1,7 @@
 from nvme_mon.app import main
 import os
 import logging
+import multiprocessing
 
 level = logging.WARNING
 if os.getenv("LOG_LEVEL", "").lower() == "debug":
@@ -18,5 +19,7 @@ logging.basicConfig(
 log = logging.getLogger(__name__)
 
 if __name__ == "__main__":
+    # Needed for the log parsing worker processes in the PyInstaller build
+    multiprocessing.freeze_support()
     log.debug('calling app.main')
     main()
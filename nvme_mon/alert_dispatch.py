@@ -0,0 +1,144 @@
+"""
+Background delivery of alert emails.
+
+AlertManager hands each alert email to AlertDispatcher.submit, which writes it to a spool
+directory and returns at once. A worker thread sends the spooled emails in order, and when
+a send fails (or is rate limited) it retries with exponential backoff, from RETRY_BASE_SEC
+up to RETRY_MAX_SEC. An email's spool file is removed only once it has been sent, so
+emails that couldn't be delivered are sent after a restart. Checks never wait on the mail
+server.
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from collections import deque
+
+from throttled import exceptions
+
+from nvme_mon.paths import app_data_path
+
+log = logging.getLogger(__name__)
+
+SPOOL_DIRNAME = "alert_spool"
+RETRY_BASE_SEC = 30
+RETRY_MAX_SEC = 60 * 60
+# The oldest emails are dropped beyond this, if the mail server is unreachable for a long time
+MAX_SPOOLED = 1000
+
+
+class AlertDispatcher:
+
+    def __init__(self, sender, spool_dir=None):
+        self.sender = sender
+        self.spool_dir = spool_dir or app_data_path(SPOOL_DIRNAME)
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self.queue = deque()
+        self.cond = threading.Condition()
+        self.seq = 0
+        # If set, a byte is written to it after each send attempt, to wake up the display (see nvme_mon.events)
+        self.wakeup_fd = None
+        for name in sorted(os.listdir(self.spool_dir)):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.spool_dir, name)
+            try:
+                with open(path, "r") as f:
+                    message = json.load(f)
+            except (OSError, ValueError) as e:
+                log.warning(f"Dropping unreadable spooled alert {path}: {e}")
+                os.remove(path)
+                continue
+            message["path"] = path
+            self.queue.append(message)
+        if self.queue:
+            log.info(f"{len(self.queue)} spooled alert emails to send")
+        threading.Thread(target=self._run, name="alert-dispatch", daemon=True).start()
+
+    @property
+    def depth(self):
+        """Number of emails waiting to be sent"""
+        return len(self.queue)
+
+    def _save(self, message):
+        data = {k: v for k, v in message.items() if k != "path"}
+        tmp_path = message["path"] + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, message["path"])
+
+    def submit(self, subject, body):
+        """Queue an email for sending. Only writes the spool file, never talks to the mail server."""
+        self.seq += 1
+        message = {
+            "subject": subject,
+            "body": body,
+            "attempts": 0,
+            "next_attempt": 0,
+            "path": os.path.join(self.spool_dir, f"{time.time_ns()}-{self.seq:06d}.json"),
+        }
+        try:
+            self._save(message)
+        except OSError as e:
+            # Still sent, it just won't survive a restart
+            log.error(f"Failed to spool alert email {subject!r}: {e}")
+        with self.cond:
+            self.queue.append(message)
+            while len(self.queue) > MAX_SPOOLED:
+                dropped = self.queue.popleft()
+                log.error(f"Too many undelivered alert emails, dropping {dropped['subject']!r}")
+                self._remove(dropped)
+            self.cond.notify()
+        log.debug(f"Queued alert email {subject!r}, {self.depth} waiting")
+
+    def _remove(self, message):
+        try:
+            os.remove(message["path"])
+        except FileNotFoundError:
+            pass
+
+    def notify(self):
+        """Wake up the display, if it asked for it (see wakeup_fd)"""
+        wakeup_fd = self.wakeup_fd
+        if wakeup_fd is not None:
+            try:
+                os.write(wakeup_fd, b"\0")
+            except OSError:
+                # Full (the display hasn't caught up) or closed
+                pass
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.queue or self.queue[0]["next_attempt"] > time.time():
+                    timeout = self.queue[0]["next_attempt"] - time.time() if self.queue else None
+                    self.cond.wait(timeout)
+                message = self.queue[0]
+            try:
+                self.sender.send_email(subject=message["subject"], body=message["body"])
+            except Exception as e:
+                message["attempts"] += 1
+                delay = min(RETRY_BASE_SEC * 2 ** (message["attempts"] - 1), RETRY_MAX_SEC)
+                message["next_attempt"] = time.time() + delay
+                if isinstance(e, exceptions.LimitedError):
+                    log.warning(f"Alert email rate limited, retrying in {delay}s ({self.depth} waiting)")
+                else:
+                    log.info(f"Error sending email: {e}. Retrying in {delay}s ({self.depth} waiting)")
+                with self.cond:
+                    still_queued = bool(self.queue) and self.queue[0] is message
+                if still_queued:
+                    try:
+                        self._save(message)
+                    except OSError as e:
+                        log.error(f"Failed to update spooled alert {message['path']}: {e}")
+                self.notify()
+                continue
+            with self.cond:
+                if self.queue and self.queue[0] is message:
+                    self.queue.popleft()
+            self._remove(message)
+            self.notify()
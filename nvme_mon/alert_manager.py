@@ -1,13 +1,14 @@
 from datetime import datetime, timedelta
 from pytimeparse import parse
-from pathlib import Path
-from os import path
 from collections import defaultdict
+import os
 import json
 import logging
-from throttled import exceptions
+import threading
 
 from nvme_mon.email_sender import EmailSender
+from nvme_mon.alert_dispatch import AlertDispatcher
+from nvme_mon.rule_table import RuleTable, HealthMatrix, np
 from nvme_mon.paths import app_data_path
 
 log = logging.getLogger(__name__)
@@ -15,6 +16,7 @@ log = logging.getLogger(__name__)
 LAST_ALERT_FILENAME = ".last_alert"
 
 history_record = lambda: {"last_value": None, "timestamp": None}
+device_history = lambda: defaultdict(history_record)
 
 compare_func = {
     "num_err_log_entries": lambda val, threshold: val > threshold,
@@ -24,62 +26,217 @@ compare_func = {
     "health_score": lambda val, threshold: val < threshold,
     "mean_temperature": lambda val, threshold: val > threshold
 }
+# The fields in compare_func that alert below their threshold, for the rule table
+alert_below = {"health_score"}
 
 class AlertManager:
+    """
+    The alert history (last alerted value and time per device and field) is loaded from
+    LAST_ALERT_FILENAME once, kept in memory, and written back by flush_history, so the
+    alerts for all devices cost at most one write per check cycle.
+
+    With the digest alert setting, the alerts from all devices in a check cycle are sent as
+    one email by end_cycle, instead of one email per device.
+
+    Trend rule breaches share the history, keyed by rule name.
+
+    For many devices, give each device's latest health info to update_health as it changes and
+    call check_all: with NumPy the thresholds are compiled into a rule table and checked for all
+    devices in one pass (see nvme_mon.rule_table).
+    """
 
     def __init__(self, config_file):
         self.config_file = config_file
         self.thresholds = {}
+        self.settings = None
+        self.alert_interval = None
+        self.sender = None
+        self.dispatcher = None
+        self.wakeup_fd = None
         self.config = {}
+        self._history = None
+        self.history_dirty = False
+        self.digest = [] # (device_name, lines) waiting for end_cycle
+        self.health_infos = {} # device_name -> latest health info, from update_health
+        self.health_matrix = HealthMatrix() if np is not None else None
+        self.rule_table = None
+        if np is None:
+            log.warning("NumPy is not installed, checking alert thresholds one device at a time")
+        else:
+            log.info("Checking alert thresholds for all devices with a vectorized rule table")
 
     def set_config(self, thresholds, settings):
+        """
+        Apply the alert config. Cheap to call for every check: nothing is done unless the config
+        has been reloaded (see nvme_mon.config), and the email sender is updated in place.
+        """
+        if thresholds is self.thresholds and settings is self.settings:
+            return
         self.thresholds = thresholds
         self.settings = settings
-        self.sender = EmailSender(settings.get('rate_limit', 20))
+        self.alert_interval = timedelta(seconds=parse(settings["alert_interval"]))
+        if self.health_matrix is not None:
+            self.rule_table = RuleTable({k: v for k, v in thresholds.items() if k in compare_func}, alert_below)
+        rate_limit = settings.get('rate_limit', 20)
+        if self.sender is None:
+            self.sender = EmailSender(rate_limit)
+            self.dispatcher = AlertDispatcher(self.sender)
+            self.dispatcher.wakeup_fd = self.wakeup_fd
+        else:
+            self.sender.set_rate_limit(rate_limit)
+
+    @property
+    def history(self):
+        if self._history is None:
+            self._history = defaultdict(device_history)
+            try:
+                with open(app_data_path(LAST_ALERT_FILENAME), "r") as f:
+                    for device_name, fields in json.load(f).items():
+                        self._history[device_name].update(fields)
+            except FileNotFoundError:
+                pass
+            except ValueError as e:
+                log.warning(f"Ignoring unreadable alert history {app_data_path(LAST_ALERT_FILENAME)}: {e}")
+        return self._history
+
+    def flush_history(self):
+        """Write the alert history back, if it changed, replacing the file atomically."""
+        if not self.history_dirty:
+            return
+        history_file = app_data_path(LAST_ALERT_FILENAME)
+        tmp_file = history_file.with_name(history_file.name + ".tmp")
+        try:
+            with open(tmp_file, "w") as f:
+                json.dump(self._history, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_file, history_file)
+            self.history_dirty = False
+        except OSError as e:
+            log.error(f"Failed to save the alert history to {history_file}: {e}")
+
+    def send_alert(self, device_name, health_info, trend_breaches=()):
+        """
+        Alert on the health info values beyond their thresholds, and on the trend rules the device
+        breaks, given as (rule name, message, value) (see nvme_mon.trend_rules).
+        """
+        # Fields without a threshold (commented out in the config) aren't alerted on
+        breached = [k for k, v in health_info.items()
+                    if k in compare_func and k in self.thresholds and v is not None and compare_func[k](v, self.thresholds[k])]
+        self.alert_fields(device_name, health_info, breached, trend_breaches)
+
+    def update_health(self, device_name, health_info):
+        """Record a device's latest health info, for check_all."""
+        self.health_infos[device_name] = health_info
+        if self.health_matrix is not None:
+            self.health_matrix.set(device_name, health_info)
 
-    def send_alert(self, device_name, health_info):
+    def check_all(self, trend_breaches=None):
+        """
+        Alert on every device given to update_health. trend_breaches maps device names to their
+        trend rule breaches, for the devices that have any.
+        """
+        trend_breaches = trend_breaches or {}
+        if self.rule_table is None:
+            for device_name, health_info in self.health_infos.items():
+                self.send_alert(device_name, health_info, trend_breaches.get(device_name, ()))
+            return
+        breached = defaultdict(list)
+        for device_name, field in self.health_matrix.breaches(self.rule_table):
+            breached[device_name].append(field)
+        for device_name in [*breached, *(name for name in trend_breaches if name not in breached)]:
+            self.alert_fields(device_name, self.health_infos[device_name], breached.get(device_name, ()),
+                              trend_breaches.get(device_name, ()))
+
+    def alert_fields(self, device_name, health_info, breached, trend_breaches):
+        """Alert on the breached fields and trend rules that are due, given the alert history."""
         current_time = datetime.now()
-        interval = self.settings["alert_interval"]
-        alert_interval = timedelta(seconds=parse(interval))
+        alert_interval = self.alert_interval
         lines =[]
-        try:
-            with open(app_data_path(LAST_ALERT_FILENAME), "r") as f:
-                history = defaultdict(lambda: defaultdict(history_record), json.load(f))
-        except FileNotFoundError:
-                history = defaultdict(lambda: defaultdict(history_record))
-        history_orig = history.copy()
-        for k,v in health_info.items():
-            if k in compare_func and compare_func[k](v, self.thresholds[k]):
-                log.debug(f'Considering alert for {k}')
-                last_alert = history[device_name][k]["timestamp"]
-                if last_alert is not None:
-                    last_alert_time = datetime.strptime(last_alert, "%Y-%m-%d %H:%M:%S")
-                else:
-                    last_alert_time = None
-                # Include the alert if it's the first one for this field, or if the last alert was sent more than the
-                # configured interval ago, or if the current value further exceeds the threshold than it did in the last alert.
-                if last_alert_time is None or (datetime.now() - last_alert_time).total_seconds() > alert_interval.total_seconds() \
-                        or (k in history[device_name] and compare_func[k](v, history[device_name][k]["last_value"])):
-                    lines.append(f"{k} = {v}. Configured threshold is {self.thresholds[k]}.")
-                    history[device_name][k]["last_value"] = v
-                    history[device_name][k]["timestamp"] = current_time.strftime("%Y-%m-%d %H:%M:%S")
-        if lines:
-            lines.insert(0, f"The following SMART data values are beyond their configured threshold:\n")
-            lines.append(f"\nDevice: {device_name}")
-            log.debug('Calling send_email')
-            with open(app_data_path(LAST_ALERT_FILENAME), "w") as f:
-                try:
-                    self.sender.send_email(subject=f"SMART Data Alert for Device {device_name}", body="\n".join(lines))
-                    json.dump(history, f)
-                except exceptions.LimitedError:
-                    log.warning("An attempt to send an email was rate limited")
-                    json.dump(history, f)
-                except Exception as e:
-                    log.info(f"Error sending email: {e}")
-                    json.dump(history, f)
-
-    def send_test_email(self):
-        self.sender.send_email(
-            subject=f"SMART Data Alert Test",
-            body="This is a test email from the NVME monitoring application",
-            timeout=5)
\ No newline at end of file
+        history = self.history
+        for k in breached:
+            v = health_info[k]
+            log.debug(f'Considering alert for {k}')
+            last_alert = history[device_name][k]["timestamp"]
+            if last_alert is not None:
+                last_alert_time = datetime.strptime(last_alert, "%Y-%m-%d %H:%M:%S")
+            else:
+                last_alert_time = None
+            # Include the alert if it's the first one for this field, or if the last alert was sent more than the
+            # configured interval ago, or if the current value further exceeds the threshold than it did in the last alert.
+            if last_alert_time is None or (datetime.now() - last_alert_time).total_seconds() > alert_interval.total_seconds() \
+                    or (k in history[device_name] and compare_func[k](v, history[device_name][k]["last_value"])):
+                lines.append(f"{k} = {v}. Configured threshold is {self.thresholds[k]}.")
+                history[device_name][k]["last_value"] = v
+                history[device_name][k]["timestamp"] = current_time.strftime("%Y-%m-%d %H:%M:%S")
+        for name, message, value in trend_breaches:
+            # A breach that persists is alerted on again once the alert interval has passed
+            last_alert = history[device_name][name]["timestamp"]
+            if last_alert is None or (current_time - datetime.strptime(last_alert, "%Y-%m-%d %H:%M:%S")) > alert_interval:
+                lines.append(f"{name}: {message}")
+                history[device_name][name]["last_value"] = value
+                history[device_name][name]["timestamp"] = current_time.strftime("%Y-%m-%d %H:%M:%S")
+        if not lines:
+            return
+        # Recorded whether or not the email goes out, so a failing server isn't retried every cycle
+        self.history_dirty = True
+        if self.settings.get("digest", False):
+            self.digest.append((device_name, lines))
+            return
+        lines.insert(0, "The following SMART data values are beyond their configured threshold:\n")
+        lines.append(f"\nDevice: {device_name}")
+        self.send(f"SMART Data Alert for Device {device_name}", "\n".join(lines))
+
+    def send(self, subject, body):
+        """Queue an alert email. It is sent in the background, with retries (see nvme_mon.alert_dispatch)."""
+        self.dispatcher.submit(subject, body)
+
+    def set_wakeup_fd(self, fd):
+        """Have the dispatcher write to fd after each send attempt, so the display can show the new queue depth"""
+        self.wakeup_fd = fd
+        if self.dispatcher is not None:
+            self.dispatcher.wakeup_fd = fd
+
+    @property
+    def queue_depth(self):
+        """Number of alert emails waiting to be sent"""
+        return self.dispatcher.depth if self.dispatcher is not None else 0
+
+    def send_digest(self):
+        """Send the alerts gathered in digest mode, all devices in one email."""
+        if not self.digest:
+            return
+        if len(self.digest) == 1:
+            subject = f"SMART Data Alert for Device {self.digest[0][0]}"
+        else:
+            subject = f"SMART Data Alert for {len(self.digest)} Devices"
+        body = ["The following SMART data values are beyond their configured threshold:"]
+        for device_name, lines in self.digest:
+            body.append(f"\nDevice: {device_name}")
+            body.extend(f"    {line}" for line in lines)
+        self.digest = []
+        self.send(subject, "\n".join(body))
+
+    def end_cycle(self):
+        """Called after the devices have been checked: sends the digest and saves the history."""
+        self.send_digest()
+        self.flush_history()
+
+    def send_test_email(self, done):
+        """
+        Send a test email on a thread of its own, so the caller doesn't wait on the mail server or
+        on an alert email being sent. done(error) is called from that thread when the send
+        finishes, with None if it succeeded, and then the display is woken up (see set_wakeup_fd).
+        """
+        def send():
+            try:
+                self.sender.send_email(
+                    subject="SMART Data Alert Test",
+                    body="This is a test email from the NVME monitoring application",
+                    timeout=5)
+            except Exception as e:
+                done(e)
+            else:
+                done(None)
+            self.dispatcher.notify()
+        threading.Thread(target=send, name="test-email", daemon=True).start()
\ No newline at end of file
@@ -1,22 +1,33 @@
 #!/usr/bin/env python3
-import os, sys, tty, termios, select
+import os, sys, select, signal
 from os import path
 from pathlib import Path
-from collections import namedtuple, defaultdict
-from datetime import datetime
-from operator import attrgetter
-from statistics import mean, median
-import json
-from itertools import cycle
+from collections import defaultdict
+from datetime import datetime, timedelta
 import time
-import fcntl
 import yaml
 import logging
+from pytimeparse import parse
 from nvme_mon.paths import is_frozen
 
 from nvme_mon.alert_manager import AlertManager
-from nvme_mon.rich_ui import YELLOW_THRESHOLD, RED_THRESHOLD, \
-    print_general_info, print_disk_info, print_histogram, render_prompt_text, render_styled_text
+from nvme_mon.config import ConfigFile
+from nvme_mon.trend_rules import TrendRules
+from nvme_mon.email_sender import env_flag
+from nvme_mon.log_follower import LogFollower
+from nvme_mon.binlog import BinLogFollower, is_binlog
+from nvme_mon.live import LiveFeed, RECONNECT_INTERVAL_SEC
+from nvme_mon.events import EventLoop
+from nvme_mon.snapshot import load_snapshot, save_snapshot
+from nvme_mon.record_decoder import epoch_to_datetime, datetime_to_epoch
+from nvme_mon.temp_stats import histogram_median
+from nvme_mon.rollups import DAY
+from nvme_mon.compact import compact_log, load_rollups, rollup_file_name
+from nvme_mon.histogram_index import HistogramIndex
+from nvme_mon.ingest import device_record, ingest_record, find_rotated_logs, parse_log_generations, \
+    generation_starts, merge_in_time_order
+from nvme_mon.rich_ui import YELLOW_THRESHOLD, RED_THRESHOLD, PanelCache, live_screen, \
+    general_info_panel, disk_info_panel, histogram_panel, prompt_text, status_text, render_styled_text
 from nvme_mon.paths import resource_path
 
 from dotenv import load_dotenv
@@ -26,65 +37,14 @@ log = logging.getLogger(__name__)
 DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
 
 REFRESH_INTERVAL_SEC = 300
+# Minimum time between startup snapshot saves. Changes since the last save are saved on exit.
+SNAPSHOT_INTERVAL_SEC = 600
 
 CONFIG_FILE_NAME = 'config.yaml'
 
-Record = namedtuple('LogRecord', ['datetime', 'temp'])
-
-def histo_record():
-    return {"count": 0, "last_date": datetime(1970, 1, 1)}
-
-def device_record():
-    return {"histogram": defaultdict(histo_record), "temp_info": {}, "health_info": {}}
-
 def clear_screen():
      print("\033[H\033[2J")
 
-def getkey(timeout=5):
-    fd = sys.stdin.fileno()
-
-    old_term = termios.tcgetattr(fd)
-    old_flags = fcntl.fcntl(fd, fcntl.F_GETFL)
-
-    tty.setcbreak(fd)
-    fcntl.fcntl(fd, fcntl.F_SETFL, old_flags | os.O_NONBLOCK)
-
-    try:
-        deadline = time.monotonic() + timeout
-        while time.monotonic() < deadline:
-            try:
-                b = os.read(fd, 3)
-                if b:
-                    b = b.decode(errors="ignore")
-                    if len(b) == 3:
-                        k = ord(b[2])
-                    else:
-                        k = ord(b)
-
-                    key_mapping = {
-                        127: 'backspace',
-                        10: 'return',
-                        32: 'space',
-                        9: 'tab',
-                        27: 'esc',
-                        65: 'up',
-                        66: 'down',
-                        67: 'right',
-                        68: 'left'
-                    }
-
-                    return key_mapping.get(k, chr(k))
-            except BlockingIOError as e:
-                pass
-
-            time.sleep(0.01)  # avoid busy spin
-        return None  # timeout
-
-    finally:
-        termios.tcsetattr(fd, termios.TCSADRAIN, old_term)
-        fcntl.fcntl(fd, fcntl.F_SETFL, old_flags)
-
-
 class NvmeInfo:
     def __init__(self):
         self._start_date = datetime.today()
@@ -105,7 +65,9 @@ class NvmeInfo:
 
     @start_date.setter
     def start_date(self, start_date):
-        self._start_date = datetime.strptime(start_date, DATE_FORMAT)
+        if isinstance(start_date, str):
+            start_date = datetime.strptime(start_date, DATE_FORMAT)
+        self._start_date = start_date
 
     @property
     def num_days(self):
@@ -115,15 +77,15 @@ class NvmeInfo:
 class NvmeMon:
     global CURRENT_SORT_KEY_IDX
     global SORT_KEYS
+    DEVICE_PROMPT = "Control keys: tab: next device, s: histogram sort, r: histogram results, w: time window, t: date-time format, e: send test email, q: quit"
+
     def __init__(self, headless=True, config_file=None):
         self.config_file = config_file
         self.infos = []
-        self.last_sample_time = defaultdict(lambda: None)
-        self.sample_intervals = defaultdict(list)
         self.SORT_KEYS = [
-            {"name": "Temperature", "value" :None}, #sort by temp
-            {"name": "Last Occurrence", "value": lambda x: x[1]['last_date']}, #sort by last high temp date
-            {"name": "Count", "value": lambda x: x[1]['count']} #sort by count
+            {"name": "Temperature", "field": None}, #sort by temp
+            {"name": "Last Occurrence", "field": "last_date"}, #sort by last high temp date
+            {"name": "Count", "field": "count"} #sort by count
         ]
         self.dt_display = 'date'
         self.CURRENT_SORT_KEY_IDX = 0
@@ -134,134 +96,386 @@ class NvmeMon:
             "red",
         ]
         self.results_scope_idx = 0
+        # Rows of the histogram for each results scope, as (min temp, limit)
+        self.results_scope_rows = {
+            "top_5": (None, 5),
+            "all": (None, None),
+            "yellow": (YELLOW_THRESHOLD, None),
+            "red": (RED_THRESHOLD, None),
+        }
+        # Time windows for the histogram and summary info, as (name, length in seconds)
+        self.windows = [
+            ("All history", None),
+            ("Last 24h", DAY),
+            ("Last 7d", 7 * DAY),
+            ("Last 30d", 30 * DAY),
+        ]
+        self.window_idx = 0
+        self.views = {} # (device, window_idx) -> windowed device record, until the next refresh
+        # Interactive view state (see nvme_mon.rich_ui)
+        self.screen = None
+        self.events = None
+        self.panels = PanelCache()
+        self.message = None # (text, style) shown until the next key press
+        self.test_email_pending = False
+        self.last_refresh = datetime.now()
+        self.snapshot_dirty = False # The device state has changed since the last snapshot
+        self.snapshot_saved = time.monotonic()
         self.alert_manager = AlertManager(config_file)
+        self.config = ConfigFile(config_file or resource_path(CONFIG_FILE_NAME))
         config = self.get_config()
-        self.alerts_enabled = config['alert_settings']["alerts_enabled"]
+        self.include_rotated_logs = config.get("INCLUDE_ROTATED_LOGS", True)
+        # Updated as records are ingested, so must be set up before the log is read
+        self.trend_rules = TrendRules(config['alert_thresholds'].get('trends'))
+        self.open_log(config)
+        try:
+            if headless: # headless modeget_config
+                self.run_alert_loop()
+            else: # interactive mode
+                self.display_info()
+        finally:
+            if self.snapshot_dirty:
+                self.save_snapshot()
+
+    def open_log(self, config):
+        """Open the health log and load the device state from it"""
         self.log_file = config["LOG_FILE_NAME"]
+        # Records pushed by the collector as they are collected, ahead of the log file (see nvme_mon.live)
+        self.live = LiveFeed(config["LIVE_SOCKET"]) if config.get("LIVE_SOCKET") else None
+        self.live_connections = 0 # The live feed's connection the log was last caught up for
         if not os.path.exists(self.log_file):
             render_styled_text(f"The specified NVME health data log file {self.log_file} does not exist. Exiting...", "bold red")
             sys.exit(0)
 
+        # The collector writes either JSON lines or the binary format (see nvme_mon.binlog)
+        self.follower = BinLogFollower(self.log_file) if is_binlog(self.log_file) else LogFollower(self.log_file)
+        self.load_log_state()
+
+    def load_log_state(self):
+        """
+        Restore the parsed log state from the startup snapshot if it still matches the log
+        file, then parse only the records appended after it. Falls back to a full parse.
+        """
+        snapshot = load_snapshot(self.log_file)
+        if snapshot is not None:
+            inode, offset, state = snapshot
+            if self.follower.resume(inode, offset):
+                log.debug(f'Restored log snapshot covering {offset} bytes')
+                self.restore_state(state)
+                self.refresh_log()
+                return
         self.parse_log_file()
-        if headless: # headless modeget_config
-            self.run_alert_loop()
-        else: # interactive mode
-            self.display_info()
 
     def parse_log_file(self):
         self.devices = defaultdict(device_record)
-        self.temp_records = defaultdict(list)
-        with open(self.log_file, 'r') as f:
-            for line in f:
-                record = json.loads(line)
-                device = record["device"]
-                histo_entry = self.devices[device]["histogram"][record["mean_temperature"]]
-                histo_entry["count"] += 1
-                histo_entry["last_date"] = max(datetime.strptime(record["timestamp"], DATE_FORMAT), histo_entry["last_date"])
-                self.temp_records[device].append(Record(record["timestamp"], record["mean_temperature"]))
-                if self.last_sample_time[device] is not None:
-                    delta = (datetime.strptime(record["timestamp"], DATE_FORMAT) - self.last_sample_time[device]).seconds
-                    self.sample_intervals[device].append(delta)
-                self.last_sample_time[device] = datetime.strptime(record["timestamp"], DATE_FORMAT)
-                self.devices[device]["health_info"] = self.get_health_info(record)
-            for device in self.devices.keys():
-                self.devices[device]["temp_info"] = self.get_temp_info(device, self.temp_records[device])
-
-    def get_temp_info(self, device, temp_records):
-        start_date = sorted(temp_records, key=attrgetter('datetime'))[0]
-        min_temp = min(map(lambda t: int(t.temp), temp_records))
-        mean_temp = mean(map(lambda t: int(t.temp), temp_records))
-        median_temp = median(map(lambda t: int(t.temp), temp_records))
-        max_temp = max(map(lambda t: int(t.temp), temp_records))
-        max_temp_dates = [datetime.strptime(t.datetime, DATE_FORMAT) for t in temp_records if int(t.temp) == max_temp]
-        max_temp_date = sorted(max_temp_dates)[-1]
-        median_sample_delta = median(self.sample_intervals[device]) if self.sample_intervals[device] else 0
-        current_sample_delta = median(self.sample_intervals[device][-2:]) if self.sample_intervals[device] else 0
+        generations = []
+        if self.include_rotated_logs:
+            rotated = find_rotated_logs(self.log_file)
+            if rotated:
+                log.debug(f'Parsing rotated logs {rotated}')
+                generations = parse_log_generations(rotated)
+        # The rollups and the rotated logs interleave, depending on when compaction and logrotate ran
+        self.compacted_through, runs = load_rollups(rollup_file_name(self.log_file), generation_starts(generations))
+        if self.compacted_through:
+            log.debug(f'Loaded rollups through {self.compacted_through}')
+        merge_in_time_order(self.devices, runs + generations)
+        self.follower.rewind()
+        self.refresh_log(force_snapshot=True)
+        for device in self.devices:
+            self.device_updated(device)
+
+    def snapshot_state(self):
+        return {"devices": self.devices, "compacted_through": self.compacted_through}
+
+    def restore_state(self, state):
+        self.devices = state["devices"]
+        self.compacted_through = state["compacted_through"]
+        for device in self.devices:
+            self.alert_manager.update_health(os.path.basename(device), self.devices[device]["health_info"])
+
+    def save_snapshot(self):
+        if self.follower.inode is not None:
+            save_snapshot(self.log_file, self.follower.inode, self.follower.offset, self.snapshot_state())
+        self.snapshot_dirty = False
+        self.snapshot_saved = time.monotonic()
+
+    def ingest(self, record, dedupe=False):
+        """
+        Ingest one record, unless it is already included. With dedupe, records that aren't newer than
+        the last one ingested for the device are skipped. Returns True if the record was ingested.
+        """
+        if self.compacted_through and record["ts"] < self.compacted_through:
+            # Already included from the rollup file
+            return False
+        if dedupe and record["device"] in self.devices:
+            last_ts = self.devices[record["device"]]["stats"].last_ts
+            if last_ts is not None and record["ts"] <= last_ts:
+                return False
+        ingest_record(self.devices, record)
+        self.trend_rules.update(self.devices[record["device"]]["trends"], record)
+        return True
+
+    def refresh_log(self, force_snapshot=False):
+        """
+        Ingest the records appended to the log since the last call, updating the per-device
+        state in place. If anything changed, a new startup snapshot is saved, at most every
+        SNAPSHOT_INTERVAL_SEC unless force_snapshot.
+        Returns the set of devices that received new records.
+        """
+        updated = set()
+        rotations = self.follower.rotations
+        offset = self.follower.offset
+        for record in self.follower.read_new_records():
+            # Records may already have arrived on the live feed. After the log is rewritten by a
+            # compaction, the records already ingested from the old file are read again.
+            if self.ingest(record, dedupe=self.live is not None or self.follower.rotations != rotations):
+                updated.add(record["device"])
+        for device in updated:
+            self.device_updated(device)
+        if updated or self.follower.offset != offset:
+            self.snapshot_dirty = True
+        if force_snapshot or (self.snapshot_dirty and time.monotonic() - self.snapshot_saved >= SNAPSHOT_INTERVAL_SEC):
+            self.save_snapshot()
+        return updated
+
+    def device_updated(self, device):
+        """Refresh the state derived from a device's records, after new ones were ingested."""
+        self.devices[device]["temp_info"] = self.get_temp_info(device)
+        for window_idx in range(len(self.windows)):
+            self.views.pop((device, window_idx), None)
+        self.alert_manager.update_health(os.path.basename(device), self.devices[device]["health_info"])
+
+    def poll_live(self):
+        """Ingest the records pushed by the collector since the last call. Returns the set of updated devices."""
+        if self.live is None or not self.live.connect():
+            return set()
+        updated = set()
+        if self.live_connections != self.live.connections:
+            # Newly (re)connected. Records published while we weren't subscribed are only in the
+            # file, and would be skipped as older than the live ones, so read the file first.
+            self.live_connections = self.live.connections
+            updated = self.refresh_log()
+        fresh = {record["device"] for record in self.live.read_records() if self.ingest(record, dedupe=True)}
+        for device in fresh:
+            self.device_updated(device)
+        return updated | fresh
+
+    def wait_live(self, timeout):
+        """Wait up to timeout seconds for live records, ingesting them. Returns the set of updated devices."""
+        if self.live is None or not self.live.connect():
+            time.sleep(timeout if self.live is None else min(timeout, RECONNECT_INTERVAL_SEC))
+            return set()
+        select.select([self.live], [], [], timeout)
+        return self.poll_live()
+
+    def get_temp_info(self, device, record=None):
+        record = record or self.devices[device]
+        stats = record["stats"]
+        median_temp = histogram_median(record["histogram"])
 
         info = NvmeInfo()
         info.device_name = device
-        info.start_date = start_date.datetime
-        info.min = min_temp
-        info.max = max_temp
-        info.max_temp_date = max_temp_date
-        info.mean = int(mean_temp)
-        info.median = int(median_temp)
-        info.median_sample_interval = int(median_sample_delta)
-        info.current_sample_interval = int(current_sample_delta)
+        if stats.first_ts is not None:
+            info.start_date = epoch_to_datetime(stats.first_ts)
+        info.min = stats.min
+        info.max = stats.max
+        info.max_temp_date = epoch_to_datetime(stats.max_ts) if stats.max_ts is not None else ""
+        info.mean = int(stats.mean) if stats.count else 0
+        info.median = int(median_temp) if median_temp is not None else 0
+        info.median_sample_interval = int(stats.median_interval)
+        info.current_sample_interval = int(stats.current_interval)
 
         return info
 
-    def get_health_info(self, record):
-        return {
-            "power_on_hours": record.get("power_on_hours"),
-            "unsafe_shutdowns": record.get("unsafe_shutdowns"),
-            "media_errors": record.get("media_errors"),
-            "num_err_log_entries": record.get("num_err_log_entries"),
-            "percentage_used": record.get("percentage_used"),
-            "health_score": record.get("health_score"),
-            "mean_temperature": record.get("mean_temperature")
+    def query_window(self, device, start, end=None):
+        """
+        Return a device record (histogram, stats, temp_info and health_info) covering only the
+        records between the start and end datetimes. end=None means up to the latest record.
+        Built from the hourly and daily rollups, so the cost doesn't depend on the log size.
+        """
+        bucket = self.devices[device]["rollups"].query(
+            datetime_to_epoch(start), datetime_to_epoch(end) if end is not None else None)
+        histogram = {
+            temp: {"count": count, "last_date": epoch_to_datetime(last_ts)}
+            for temp, (count, last_ts) in bucket.histogram.items()
         }
-    
+        record = {
+            "histogram": histogram,
+            "histogram_index": HistogramIndex(histogram),
+            "stats": bucket.stats,
+            "health_info": bucket.health_info,
+        }
+        record["temp_info"] = self.get_temp_info(device, record)
+        return record
+
+    def get_device_view(self, device):
+        """
+        The device record for the currently selected time window. Windowed records are kept
+        until the device gets new records or the next refresh, so redraws in between reuse them.
+        """
+        _, length = self.windows[self.window_idx]
+        if length is None:
+            return device
+        key = (device["temp_info"].device_name, self.window_idx)
+        view = self.views.get(key)
+        if view is None:
+            start = datetime.now() - timedelta(seconds=length)
+            view = self.views[key] = self.query_window(key[0], start)
+        return view
+
     def get_config(self):
-        if self.config_file:
-            config_file = self.config_file
-        else:
-            config_file = resource_path(CONFIG_FILE_NAME)
-        with open(config_file, 'r') as f:
-            configs = yaml.safe_load(f)
-            return configs 
+        """The parsed config, re-read only when the file has changed"""
+        return self.config.get()
+
+    @property
+    def alerts_enabled(self):
+        return self.get_config()['alert_settings']["alerts_enabled"]
 
     
     def get_devices(self):
-        for _, device in cycle(self.devices.items()):
-            yield device
-            
+        # Iterate over a fresh view on each pass, so devices that first appear in a refresh are included
+        while self.devices:
+            for device in list(self.devices.values()):
+                yield device
+
+
     def run_alert_loop(self):
         log.debug('Running alert loop')
         while True:
-            for device in self.devices.values():
-                self.check_alerts(device)
-            time.sleep(REFRESH_INTERVAL_SEC)
+            self.refresh_log()
+            self.check_all_alerts()
+            self.alert_manager.end_cycle()
+            # Check devices as their live records arrive, and reread the log file every REFRESH_INTERVAL_SEC
+            deadline = time.monotonic() + REFRESH_INTERVAL_SEC
+            while (remaining := deadline - time.monotonic()) > 0:
+                for device in self.wait_live(remaining):
+                    self.check_alerts(self.devices[device])
+                self.alert_manager.end_cycle()
     
+    def apply_alert_config(self):
+        config = self.get_config()
+        self.alert_manager.set_config(config['alert_thresholds'], config['alert_settings'])
+        if self.trend_rules.set_config(config['alert_thresholds'].get('trends')):
+            for _device in self.devices.values():
+                self.trend_rules.prune(_device["trends"])
+
+    def check_all_alerts(self):
+        """Check every device, all thresholds in one pass (see nvme_mon.rule_table)"""
+        self.apply_alert_config()
+        trend_breaches = {}
+        if self.trend_rules.rules:
+            for device, record in self.devices.items():
+                if breaches := self.trend_rules.breaches(record["trends"]):
+                    trend_breaches[os.path.basename(device)] = breaches
+        self.alert_manager.check_all(trend_breaches)
+
     def check_alerts(self, device):
-        thresholds = self.get_config()['alert_thresholds']
-        settings = self.get_config()['alert_settings']
-        self.alert_manager.set_config(thresholds, settings)
+        self.apply_alert_config()
         health_info = device["health_info"]
         log.debug('Calling alert_manager.send_alert')
-        self.alert_manager.send_alert(os.path.basename(device['temp_info'].device_name), health_info)
+        self.alert_manager.send_alert(os.path.basename(device['temp_info'].device_name), health_info,
+                                      self.trend_rules.breaches(device["trends"]))
     
     def email_settings_ok(self):
         return not self.alerts_enabled or (
             os.environ.get("EMAIL_ADDRESS", None) \
-            and os.environ.get("EMAIL_PASSWORD", None) \
+            and (os.environ.get("EMAIL_PASSWORD", None) or not env_flag("SMTP_LOGIN")) \
             and os.environ.get("RECIPIENT", None) \
             and os.environ.get("SMTP_SERVER", None) \
             and os.environ.get("SMTP_PORT", None))
     
     def send_test_email(self):
-        self.alert_manager.send_test_email()
+        """Send a test email in the background. The result is shown in the status lines when it's done."""
+        if self.test_email_pending:
+            self.message = ("A test email is already being sent", "yellow")
+            return
+        try:
+            config = self.get_config()
+            self.alert_manager.set_config(config['alert_thresholds'], config['alert_settings'])
+        except Exception as e:
+            self.message = (f"Test email failed. Message: {e}", "bold red")
+            return
+        self.test_email_pending = True
+        self.message = ("Sending test email...", "yellow")
+        self.alert_manager.send_test_email(self.test_email_sent)
+
+    def test_email_sent(self, error):
+        """Called from the sending thread"""
+        self.test_email_pending = False
+        if error is None:
+            self.message = ("Test email sent", "green")
+        else:
+            self.message = (f"Test email failed. Message: {error}", "bold red")
            
 
+    def watch_paths(self):
+        """The log files whose changes trigger a refresh of the display"""
+        return [self.log_file]
+
+    def event_loop(self):
+        return EventLoop(REFRESH_INTERVAL_SEC, self.watch_paths(), self.live)
+
     def display_info(self):
-        current_device = None
-        for device in self.get_devices():
-            # clear_screen()
-            if current_device is not None and device != current_device:
-                continue
-            current_device = None
+        with live_screen() as self.screen, self.event_loop() as self.events:
+            self.alert_manager.set_wakeup_fd(self.events.wakeup_fd)
+            try:
+                for device in self.get_devices():
+                    self.show_device(device)
+            finally:
+                self.alert_manager.set_wakeup_fd(None)
+
+    def wait_keys(self):
+        """
+        Wait for something to happen. Refreshes the data on log changes and on the refresh timer,
+        and ingests live records. Returns the keys pressed, if any.
+        """
+        keys = []
+        for kind, value in self.events.wait():
+            if kind == "key":
+                keys.append(value)
+            elif kind == "refresh":
+                self.refresh()
+            elif kind == "live":
+                self.poll_live()
+            # On "alerts" there's nothing to do but redraw, with the new queue depth
+        return keys
+
+    def status_lines(self):
+        """(text, style) for the lines shown under the panels"""
+        lines = []
+        if not self.email_settings_ok():
+            lines.append(("EMail alerts are enabled, but one or more of the required environment variables is not set", "bold red"))
+        queue_depth = self.alert_manager.queue_depth
+        if queue_depth:
+            lines.append((f"{queue_depth} alert email{'' if queue_depth == 1 else 's'} waiting to be sent", "yellow"))
+        if self.message is not None:
+            lines.append(self.message)
+        return tuple(lines)
+
+    def status_panels(self, prompt):
+        """The prompt and status lines, from the panel cache"""
+        status = self.status_lines()
+        return [
+            self.panels.get("prompt", prompt, prompt_text, prompt),
+            self.panels.get("status", status, status_text, status),
+        ]
 
-            temp_info = device["temp_info"]
+    def show_device(self, device, exit_keys=("tab",)):
+        """Show a device, refreshing it, until one of exit_keys is pressed. Returns the key."""
+        while True:
+            view = self.get_device_view(device)
+            window_name = self.windows[self.window_idx][0]
+            temp_info = view["temp_info"]
 
             data = {
                 "Device": os.path.basename(temp_info.device_name),
-                "Log Data":  f"{temp_info.num_days} day{'' if temp_info.num_days == 1 else 's'}, beginning {temp_info.start_date.date()}"
+                "Log Data":  f"{temp_info.num_days} day{'' if temp_info.num_days == 1 else 's'}, beginning {temp_info.start_date.date()} ({window_name})"
             }
-            print_general_info(data)
+            general = self.panels.get("general", tuple(data.items()), general_info_panel, data)
 
             health_info = device["health_info"]
             data = health_info
-            print_disk_info(data, box=True, title="Disk Health Info")
+            health = self.panels.get("health", tuple(data.items()), disk_info_panel, data, box=True, title="Disk Health Info")
 
             data = {
                 "Min temp": temp_info.min,
@@ -271,78 +485,83 @@ class NvmeMon:
                 "Median temp": temp_info.median,
                 "Sample interval (current/median)": f"{temp_info.current_sample_interval}/{temp_info.median_sample_interval} sec"
             }
-            print_disk_info(data, box=True, title="Summary Temperature Info (Based on average of all sensor readings)")
-
-            histo = device["histogram"]
-            histo = dict(sorted(histo.items(), key=self.SORT_KEYS[self.CURRENT_SORT_KEY_IDX]["value"], reverse=True))
-            if self.results_scope[self.results_scope_idx] == "top_5":
-                histo = dict(list(histo.items())[:5])
-            elif self.results_scope[self.results_scope_idx] == "yellow":
-                histo = {k: v for k, v in histo.items() if k >= YELLOW_THRESHOLD}
-            elif self.results_scope[self.results_scope_idx] == "red":
-                histo = {k: v for k, v in histo.items() if k >= RED_THRESHOLD}
-            print_histogram(
+            summary = self.panels.get("summary", tuple(data.items()), disk_info_panel, data, box=True,
+                                      title="Summary Temperature Info (Based on average of all sensor readings)")
+
+            min_temp, limit = self.results_scope_rows[self.results_scope[self.results_scope_idx]]
+            histo = dict(view["histogram_index"].rows(self.SORT_KEYS[self.CURRENT_SORT_KEY_IDX]["field"], min_temp, limit))
+            inputs = (tuple((k, v["count"], v["last_date"]) for k, v in histo.items()), self.dt_display,
+                      self.CURRENT_SORT_KEY_IDX, self.results_scope_idx, window_name, self.last_refresh)
+            histogram = self.panels.get("histogram", inputs, histogram_panel,
                 histo,
                 dt_display=self.dt_display,
                 max_width=120,
                 sort_key=self.SORT_KEYS[self.CURRENT_SORT_KEY_IDX]["name"],
                 results_scope=self.results_scope[self.results_scope_idx],
                 box=True,
-                spacing=1, title=f"Temperature Histogram")
-
-            render_prompt_text("Control keys: tab: next device, s: histogram sort, r: histogram results, t: date-time format, e: send test email, q: quit")
-            if not self.email_settings_ok():
-                render_styled_text("EMail alerts are enabled, but one or more of the required environment variables is not set", "bold red")
-            
-            key = getkey(REFRESH_INTERVAL_SEC)
-            if key is None:
-                if self.alerts_enabled:
-                    for _device in self.devices.values():
-                        self.check_alerts(_device)
-                current_device = device
-                continue
-            if key == 'q':
-                sys.exit(0)
-            elif key == 's':
-                self.CURRENT_SORT_KEY_IDX = (self.CURRENT_SORT_KEY_IDX + 1) % len(self.SORT_KEYS)
-                current_device = device
-                continue
-            elif key == 'r':
-                self.results_scope_idx = (self.results_scope_idx + 1) % len(self.results_scope)
-                current_device = device
-                continue
-            elif key == 't':
-                self.dt_display = 'datetime' if self.dt_display == 'date' else 'date'
-                current_device = device
-                continue
-            elif key == 'e':
-                try:
-                    thresholds = self.get_config()['alert_thresholds']
-                    settings = self.get_config()['alert_settings']
-                    self.alert_manager.set_config(thresholds, settings)
+                spacing=1, title=f"Temperature Histogram ({window_name})",
+                updated=self.last_refresh)
+
+            self.panels.show(self.screen, [general, health, summary, histogram, *self.status_panels(self.DEVICE_PROMPT)])
+
+            for key in self.wait_keys():
+                self.message = None
+                if key in exit_keys:
+                    return key
+                elif key == 'q':
+                    sys.exit(0)
+                elif key == 's':
+                    self.CURRENT_SORT_KEY_IDX = (self.CURRENT_SORT_KEY_IDX + 1) % len(self.SORT_KEYS)
+                elif key == 'r':
+                    self.results_scope_idx = (self.results_scope_idx + 1) % len(self.results_scope)
+                elif key == 'w':
+                    self.window_idx = (self.window_idx + 1) % len(self.windows)
+                elif key == 't':
+                    self.dt_display = 'datetime' if self.dt_display == 'date' else 'date'
+                elif key == 'e':
                     self.send_test_email()
-                    print("Test email sent")
-                except Exception as e:
-                    render_styled_text(f"Test email failed. Message: {e}", "bold red")
-                time.sleep(5)
-                current_device = device
-                continue
-            elif key == 'tab':
-                continue
-            elif key == 'q':
-                sys.exit(0)
-            else:
-                current_device = device
+
+    def refresh(self):
+        """Read new records, and check alerts if they are enabled"""
+        self.refresh_log()
+        # The time windows end now
+        self.views.clear()
+        self.last_refresh = datetime.now()
+        if self.events is not None:
+            self.events.refreshed()
+        if self.alerts_enabled:
+            self.check_all_alerts()
+            self.alert_manager.end_cycle()
+
+def compact(config_file=None):
+    config_file = config_file or resource_path(CONFIG_FILE_NAME)
+    with open(config_file, 'r') as f:
+        config = yaml.safe_load(f)
+    retention = config.get("retention", {})
+    raw_max_age = timedelta(seconds=parse(retention.get("raw_max_age", "30d")))
+    hourly_max_age = timedelta(seconds=parse(retention.get("hourly_max_age", "180d")))
+    count = compact_log(config["LOG_FILE_NAME"], raw_max_age, hourly_max_age)
+    print(f"Compacted {count} records from {config['LOG_FILE_NAME']}")
 
 def main():
     log.debug("argv = %r", sys.argv)
     headless = False
     config_file = None
+    if len(sys.argv) > 1 and sys.argv[1] == "compact":
+        compact(sys.argv[2] if len(sys.argv) > 2 else None)
+        return
+    if len(sys.argv) > 2 and sys.argv[1] in ("fleet", "headless-fleet"):
+        # Imported here, since fleet mode builds on NvmeMon
+        from nvme_mon.fleet import FleetMon
+        FleetMon(sys.argv[2], headless=sys.argv[1] == "headless-fleet", config_file=sys.argv[3] if len(sys.argv) > 3 else None)
+        return
     if len(sys.argv) > 1 and sys.argv[1] == "headless":
         log.info("Running nvme monitor in headless mode")
         headless = True
     if len(sys.argv) > 2:
         config_file = sys.argv[2]
+    # Exit through SystemExit on SIGTERM (systemctl stop), so the startup snapshot is saved
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
     NvmeMon(headless=headless, config_file=config_file)
     log.info('exitng main')
 
@@ -0,0 +1,296 @@
+"""
+Compact binary format for the NVME health log.
+
+The file starts with a 32-byte header (magic, format version, record size), followed by
+fixed-width 32-byte records, so a file of any length can be split into records without
+scanning for delimiters and a partially written record at the end is simply left for the
+next read. Each record starts with a type byte:
+
+    REC_SAMPLE  one health sample: device id, timestamp (naive epoch seconds, see
+                nvme_mon.record_decoder) and the fields in HEALTH_FIELDS
+    REC_DEVICE  defines a device id. The name follows in the rest of the record and, if it is
+                longer than DEVICE_NAME_INLINE bytes, in the raw bytes of the next records.
+
+A device is defined once, before its first sample, and ids are assigned in order from 0.
+Only the fields the app uses are stored, so a sample is 32 bytes instead of the ~450 bytes
+of a JSON line. Integer fields that are null in the JSON are stored as the NULL_* values.
+
+The collector (nvme_monitor.py) writes this format with its own copy of the encoder, since
+it doesn't import the nvme_mon package. Keep the two in sync.
+
+Convert an existing JSONL log with:
+
+    python -m nvme_mon.binlog convert /var/log/nvme_health.json /var/log/nvme_health.bin
+"""
+
+import os
+import sys
+import mmap
+import logging
+import argparse
+
+from struct import Struct
+
+from nvme_mon.log_follower import LogFollower
+from nvme_mon.record_decoder import decode_record
+
+log = logging.getLogger(__name__)
+
+MAGIC = b"NVMEHLTH"
+FORMAT_VERSION = 1
+RECORD_SIZE = 32
+
+# magic, format version, record size
+HEADER = Struct("<8sHH20x")
+# type, device id, ts, power_on_hours, unsafe_shutdowns, media_errors, num_err_log_entries,
+# percentage_used, health_score, mean_temperature
+SAMPLE = Struct("<BxHIIIIIHBxh2x")
+# type, name length, device id, first DEVICE_NAME_INLINE bytes of the name
+DEVICE = Struct("<BBH28s")
+DEVICE_NAME_INLINE = 28
+
+REC_SAMPLE = 0
+REC_DEVICE = 1
+
+NULL_U32 = 0xFFFFFFFF
+NULL_U16 = 0xFFFF
+NULL_U8 = 0xFF
+NULL_I16 = -0x8000
+
+
+def is_binlog_file(f):
+    """True if the buffered binary file f (at its start) holds a binary health log. Doesn't move f."""
+    return f.peek(len(MAGIC))[:len(MAGIC)] == MAGIC
+
+
+def is_binlog(path):
+    try:
+        with open(path, "rb") as f:
+            return is_binlog_file(f)
+    except FileNotFoundError:
+        return False
+
+
+def encode_header():
+    return HEADER.pack(MAGIC, FORMAT_VERSION, RECORD_SIZE)
+
+
+def check_header(data, path):
+    magic, version, record_size = HEADER.unpack_from(data)
+    if magic != MAGIC or version != FORMAT_VERSION or record_size != RECORD_SIZE:
+        raise ValueError(f"{path} is not a version {FORMAT_VERSION} binary health log")
+
+
+def _u32(value):
+    return NULL_U32 if value is None else min(int(value), NULL_U32 - 1)
+
+
+class BinLogEncoder:
+    """Encodes decoded records (see decode_record), defining each device before its first sample."""
+
+    def __init__(self, devices=None):
+        self.devices = dict(devices or {}) # name -> id
+
+    def encode_device(self, name):
+        device_id = self.devices[name] = len(self.devices)
+        data = name.encode()
+        if len(data) > 255:
+            raise ValueError(f"Device name too long for the binary log: {name}")
+        inline, rest = data[:DEVICE_NAME_INLINE], data[DEVICE_NAME_INLINE:]
+        padding = -len(rest) % RECORD_SIZE
+        return DEVICE.pack(REC_DEVICE, len(data), device_id, inline) + rest + bytes(padding)
+
+    def encode(self, record):
+        name = record["device"]
+        device_id = self.devices.get(name)
+        prefix = b""
+        if device_id is None:
+            prefix = self.encode_device(name)
+            device_id = self.devices[name]
+        pct, score, temp = record["percentage_used"], record["health_score"], record["mean_temperature"]
+        return prefix + SAMPLE.pack(
+            REC_SAMPLE, device_id, record["ts"],
+            _u32(record["power_on_hours"]), _u32(record["unsafe_shutdowns"]),
+            _u32(record["media_errors"]), _u32(record["num_err_log_entries"]),
+            NULL_U16 if pct is None else min(pct, NULL_U16 - 1),
+            NULL_U8 if score is None else score,
+            NULL_I16 if temp is None else temp,
+        )
+
+
+class BinLogDecoder:
+    """
+    Decodes records from a buffer holding a binary log (an mmap, or bytes for compressed files),
+    keeping the device ids defined so far.
+    """
+
+    def __init__(self):
+        self.devices = {} # id -> name
+        self.scanned_to = HEADER.size
+
+    def _define(self, buf, offset):
+        """Read the device definition at offset. Returns the offset after it, or None if it is incomplete."""
+        _, length, device_id, inline = DEVICE.unpack_from(buf, offset)
+        end = offset + RECORD_SIZE + -(-max(0, length - DEVICE_NAME_INLINE) // RECORD_SIZE) * RECORD_SIZE
+        if end > len(buf):
+            return None
+        name = bytes(inline) + bytes(buf[offset + RECORD_SIZE:offset + RECORD_SIZE + length - len(inline)])
+        self.devices[device_id] = name[:length].decode()
+        return end
+
+    def scan_devices(self, buf, end):
+        """Pick up the device definitions before end, to start decoding there (e.g. when resuming)."""
+        offset = self.scanned_to
+        # The type bytes of all the records, without decoding them
+        types = buf[offset:end:RECORD_SIZE]
+        i = types.find(REC_DEVICE)
+        while i >= 0:
+            next_offset = self._define(buf, offset + i * RECORD_SIZE)
+            if next_offset is None:
+                break
+            i = types.find(REC_DEVICE, (next_offset - offset) // RECORD_SIZE)
+        self.scanned_to = max(self.scanned_to, end)
+
+    def decode(self, buf, start, end=None):
+        """
+        Yield (offset after the record, record) for the complete records in buf[start:end].
+        record is a dict like decode_record returns, without the timestamp string, or None
+        for a device definition.
+        """
+        if start > self.scanned_to:
+            self.scan_devices(buf, start)
+        end = len(buf) if end is None else end
+        end -= (end - start) % RECORD_SIZE
+        view = memoryview(buf)[start:end]
+        try:
+            offset = start
+            skip_to = start
+            for kind, device_id, ts, poh, unsafe, media, err_log, pct, score, temp in SAMPLE.iter_unpack(view):
+                offset += RECORD_SIZE
+                if offset <= skip_to:
+                    continue # Rest of a long device name
+                if kind == REC_SAMPLE:
+                    yield offset, {
+                        "power_on_hours": None if poh == NULL_U32 else poh,
+                        "unsafe_shutdowns": None if unsafe == NULL_U32 else unsafe,
+                        "media_errors": None if media == NULL_U32 else media,
+                        "num_err_log_entries": None if err_log == NULL_U32 else err_log,
+                        "percentage_used": None if pct == NULL_U16 else pct,
+                        "health_score": None if score == NULL_U8 else score,
+                        "mean_temperature": None if temp == NULL_I16 else temp,
+                        "device": self.devices[device_id],
+                        "ts": ts,
+                    }
+                elif kind == REC_DEVICE:
+                    skip_to = self._define(buf, offset - RECORD_SIZE)
+                    if skip_to is None:
+                        return # The rest of the name hasn't been written yet
+                    self.scanned_to = max(self.scanned_to, skip_to)
+                    yield skip_to, None
+                else:
+                    raise ValueError(f"Unknown record type {kind} at offset {offset - RECORD_SIZE}")
+        finally:
+            view.release()
+
+    def decode_all(self, data, path):
+        """Yield the sample records from the contents of a whole binary log."""
+        check_header(data, path)
+        for _, record in self.decode(data, HEADER.size):
+            if record is not None:
+                yield record
+
+
+class BinLogFollower(LogFollower):
+    """
+    LogFollower for a binary log. The file is memory mapped on each read, and the records
+    appended since the last read are unpacked straight from the mapping.
+    """
+
+    def _open(self):
+        if not super()._open():
+            return False
+        self.decoder = BinLogDecoder()
+        return True
+
+    def _read_lines(self):
+        raise TypeError(f"{self.path} is a binary log, read it with read_new_records")
+
+    def _read_records(self):
+        size = os.fstat(self._file.fileno()).st_size
+        start = max(self.offset, HEADER.size)
+        if size < start + RECORD_SIZE:
+            return
+        if self.offset == 0:
+            # Reading the file from the start, after it was truncated
+            self.decoder = BinLogDecoder()
+        with mmap.mmap(self._file.fileno(), size, access=mmap.ACCESS_READ) as buf:
+            check_header(buf, self.path)
+            records = self.decoder.decode(buf, start)
+            try:
+                for offset, record in records:
+                    self.offset = offset
+                    if record is not None:
+                        yield record
+            finally:
+                # Release the decoder's view of buf before it is unmapped
+                records.close()
+
+
+def iter_raw_records(f, path):
+    """
+    Yield (record, raw bytes) for everything in the binary log open in f: the header and
+    device definitions with record None, then the samples. Leaves f positioned after the
+    last complete record.
+    """
+    size = os.fstat(f.fileno()).st_size
+    with mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as buf:
+        check_header(buf, path)
+        yield None, buf[:HEADER.size]
+        prev = HEADER.size
+        records = BinLogDecoder().decode(buf, HEADER.size)
+        try:
+            for offset, record in records:
+                yield record, buf[prev:offset]
+                prev = offset
+        finally:
+            records.close()
+    f.seek(prev)
+
+
+def convert(src, dst):
+    """Convert a JSONL health log to a binary log. Returns the number of records written."""
+    encoder = BinLogEncoder()
+    count = 0
+    tmp = dst + ".tmp"
+    with open(src, "rb") as f, open(tmp, "wb") as out:
+        out.write(encode_header())
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                record = decode_record(line)
+            except (ValueError, KeyError):
+                log.warning(f"Skipping undecodable line in {src}: {line[:80]!r}")
+                continue
+            out.write(encoder.encode(record))
+            count += 1
+    os.replace(tmp, dst)
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m nvme_mon.binlog", description="Binary NVME health log tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    convert_parser = subparsers.add_parser("convert", help="convert a JSONL health log to the binary format")
+    convert_parser.add_argument("src", help="JSONL log written by nvme_monitor.py")
+    convert_parser.add_argument("dst", help="binary log to create")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    count = convert(args.src, args.dst)
+    src_size, dst_size = os.path.getsize(args.src), os.path.getsize(args.dst)
+    log.info(f"Wrote {count} records to {args.dst}: {dst_size} bytes, {src_size / max(dst_size, 1):.1f}x smaller")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
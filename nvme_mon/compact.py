@@ -0,0 +1,220 @@
+"""
+Retention compaction of the raw health log into rollups.
+
+Raw records older than the configured age are rolled up into per-device hourly buckets (see
+nvme_mon.rollups), and hourly buckets older than a second age are merged into daily buckets.
+The buckets are kept in a JSONL rollup file next to the log, and the raw log is rewritten with
+only the recent records. The client reads the rollup file and the raw tail together, so the
+histogram and summary info are the same as before compaction.
+
+The rollup file starts with a header line recording the time the raw log has been compacted
+through. Raw records older than that are already in the rollups and are skipped, so a
+compaction that is interrupted between the two file writes doesn't count anything twice.
+
+The raw log is replaced while the collector keeps appending to it. The last copy of new records
+and the rename are done holding an exclusive flock on the old log, which the collector takes
+before each write (see RecordWriter in nvme_monitor.py), so its writes go either to the old file
+before the copy or to the new one. Anything found in the old file after the rename (from a
+collector that doesn't take the lock) is appended to the new log as well.
+
+Times in the rollup file are naive epoch seconds (see nvme_mon.record_decoder).
+"""
+
+import os
+import json
+import fcntl
+import logging
+from bisect import bisect_right
+from collections import defaultdict
+from datetime import datetime
+
+from nvme_mon.binlog import is_binlog_file, iter_raw_records
+from nvme_mon.ingest import device_record, get_health_info
+from nvme_mon.record_decoder import decode_record, datetime_to_epoch, epoch_to_datetime
+from nvme_mon.rollups import Bucket, HOUR, DAY
+
+log = logging.getLogger(__name__)
+
+ROLLUP_FILE_VERSION = 1
+ROLLUP_SUFFIX = ".rollups"
+
+
+def rollup_file_name(log_file):
+    return log_file + ROLLUP_SUFFIX
+
+
+def read_rollup_file(path):
+    """Return (compacted_through, [(device, period, Bucket)]) from a rollup file, oldest buckets first."""
+    try:
+        f = open(path, "r")
+    except FileNotFoundError:
+        return None, []
+    with f:
+        header = json.loads(f.readline() or "{}")
+        if header.get("version") != ROLLUP_FILE_VERSION:
+            raise ValueError(f"Unsupported rollup file version in {path}: {header.get('version')}")
+        buckets = []
+        for line in f:
+            entry = json.loads(line)
+            buckets.append((entry["device"], entry["period"], Bucket.from_dict(entry)))
+    buckets.sort(key=lambda b: b[2].start)
+    return header["compacted_through"], buckets
+
+
+def write_rollup_file(path, compacted_through, buckets):
+    lines = [json.dumps({"version": ROLLUP_FILE_VERSION, "compacted_through": compacted_through})]
+    for device, period, bucket in sorted(buckets, key=lambda b: (b[0], b[2].start)):
+        lines.append(json.dumps({"device": device, "period": period, **bucket.to_dict()}))
+    _atomic_write(path, ("\n".join(lines) + "\n").encode())
+
+
+def load_rollups(path, split_at=None):
+    """
+    Read a rollup file into device states that can be merged with merge_in_time_order.
+    split_at maps devices to sorted times (the starts of the rotated log generations, see
+    nvme_mon.ingest.generation_starts). A device's buckets are split into runs at those times,
+    so that no run spans a generation. Returns (compacted_through, [devices]), one devices
+    dict per run.
+    """
+    runs = [defaultdict(device_record)]
+    compacted_through, buckets = read_rollup_file(path)
+    for device, period, bucket in buckets:
+        run = bisect_right(split_at.get(device, ()), bucket.start) if split_at else 0
+        while len(runs) <= run:
+            runs.append(defaultdict(device_record))
+        record = runs[run][device]
+        for temp, (count, last_ts) in bucket.histogram.items():
+            histo_entry = record["histogram"][temp]
+            histo_entry["count"] += count
+            histo_entry["last_date"] = max(histo_entry["last_date"], epoch_to_datetime(last_ts))
+        record["histogram_index"].dirty = True
+        record["stats"].merge(bucket.stats)
+        record["health_info"] = bucket.health_info
+        record["rollups"].add_bucket(bucket, period)
+    return compacted_through, runs
+
+
+def _atomic_write(path, data, like=None):
+    """Write data to a temp file next to path, fsync it and rename it over path."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    _replace(tmp_path, path, like)
+
+
+def _replace(tmp_path, path, like=None):
+    if like is not None:
+        # Keep the ownership and permissions of the file being replaced
+        os.chmod(tmp_path, like.st_mode)
+        try:
+            os.chown(tmp_path, like.st_uid, like.st_gid)
+        except PermissionError:
+            pass
+    os.replace(tmp_path, path)
+
+
+def _json_records(src, log_file):
+    """
+    Yield (record, line) for the complete lines of a JSONL log, with record None for lines
+    that can't be decoded. Leaves src positioned after the last complete line.
+    """
+    for line in src:
+        if not line.endswith(b"\n"):
+            # Still being written, copied later
+            src.seek(-len(line), os.SEEK_CUR)
+            break
+        try:
+            yield decode_record(line), line
+        except (ValueError, KeyError):
+            log.warning(f"Keeping undecodable line in {log_file}: {line[:80]!r}")
+            yield None, line
+
+
+def compact_log(log_file, raw_max_age, hourly_max_age, now=None):
+    """
+    Move raw records older than raw_max_age (a timedelta) from log_file into hourly rollups,
+    and merge hourly rollups older than hourly_max_age into daily rollups.
+    Returns the number of raw records compacted.
+    """
+    now = datetime_to_epoch(now or datetime.now())
+    raw_cutoff = now - int(raw_max_age.total_seconds())
+    raw_cutoff -= raw_cutoff % HOUR
+    hourly_cutoff = now - int(hourly_max_age.total_seconds())
+    hourly_cutoff -= hourly_cutoff % DAY
+
+    rollup_file = rollup_file_name(log_file)
+    compacted_through, existing = read_rollup_file(rollup_file)
+    compacted_through = compacted_through or 0
+
+    # Roll up the old raw records, and copy the recent ones to the new raw log
+    hours = defaultdict(dict) # device -> {hour start: Bucket}
+    compacted = 0
+    tmp_path = log_file + ".tmp"
+    with open(log_file, "rb") as src, open(tmp_path, "wb") as dst:
+        st = os.fstat(src.fileno())
+        records = iter_raw_records(src, log_file) if is_binlog_file(src) else _json_records(src, log_file)
+        for record, raw in records:
+            if record is None:
+                # Binary log header and device definitions are kept, so device ids don't change
+                dst.write(raw)
+                continue
+            ts = record["ts"]
+            if ts < compacted_through:
+                continue # Already in the rollups, left behind by an interrupted compaction
+            if ts < raw_cutoff:
+                start = ts - ts % HOUR
+                bucket = hours[record["device"]].get(start)
+                if bucket is None:
+                    bucket = hours[record["device"]][start] = Bucket(start)
+                bucket.add(ts, record["mean_temperature"], get_health_info(record))
+                compacted += 1
+            else:
+                dst.write(raw)
+
+        if compacted:
+            buckets = {(device, period, bucket.start): bucket for device, period, bucket in existing}
+            for device, device_hours in hours.items():
+                for start, bucket in sorted(device_hours.items()):
+                    key = (device, "hour", start)
+                    if key in buckets:
+                        buckets[key].merge(bucket)
+                    else:
+                        buckets[key] = bucket
+            # Merge old hourly buckets into days
+            for (device, period, start) in sorted(buckets):
+                if period == "hour" and start < hourly_cutoff:
+                    bucket = buckets.pop((device, period, start))
+                    day_key = (device, "day", start - start % DAY)
+                    if day_key in buckets:
+                        buckets[day_key].merge(bucket)
+                    else:
+                        bucket.start = day_key[2]
+                        buckets[day_key] = bucket
+            write_rollup_file(rollup_file, max(compacted_through, raw_cutoff),
+                              [(device, period, bucket) for (device, period, _), bucket in buckets.items()])
+
+        if not compacted:
+            os.remove(tmp_path)
+            log.info(f"Nothing in {log_file} is older than {epoch_to_datetime(raw_cutoff)}")
+            return 0
+
+        # Hold off the collector while the last records are copied and the new log takes the old one's place
+        fcntl.flock(src.fileno(), fcntl.LOCK_EX)
+        # Pick up anything the collector appended while we were reading
+        while chunk := src.read(1 << 20):
+            dst.write(chunk)
+        dst.flush()
+        os.fsync(dst.fileno())
+        _replace(tmp_path, log_file, like=st)
+        # Written to the old file after the copy by a collector that doesn't take the lock
+        tail = src.read()
+        if tail:
+            fd = os.open(log_file, os.O_WRONLY | os.O_APPEND)
+            try:
+                os.write(fd, tail)
+            finally:
+                os.close(fd)
+    log.info(f"Compacted {compacted} records older than {epoch_to_datetime(raw_cutoff)} into {rollup_file}")
+    return compacted
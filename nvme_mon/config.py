@@ -0,0 +1,48 @@
+"""
+The app's config.yaml, parsed once and re-read only when the file changes.
+
+get() stats the file and returns the cached config unless its inode, mtime or size differ
+from the last load, so callers can ask for the config as often as they like and still pick
+up edits (including an editor replacing the file) on the next call. The returned dict is
+the same object until the file changes, so callers can tell a reload by identity.
+"""
+
+import os
+import logging
+
+import yaml
+
+log = logging.getLogger(__name__)
+
+
+class ConfigFile:
+
+    def __init__(self, path):
+        self.path = path
+        self._config = None
+        self._stat_key = None
+
+    def get(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            if self._config is None:
+                raise
+            log.warning(f"{self.path} is missing, keeping the last config read")
+            return self._config
+        stat_key = (st.st_ino, st.st_mtime_ns, st.st_size)
+        if stat_key != self._stat_key:
+            try:
+                with open(self.path, 'r') as f:
+                    config = yaml.safe_load(f)
+            except (OSError, yaml.YAMLError) as e:
+                if self._config is None:
+                    raise
+                log.error(f"Failed to reload {self.path}, keeping the last config read: {e}")
+                self._stat_key = stat_key # Don't retry until it changes again
+                return self._config
+            if self._config is not None:
+                log.info(f"Reloaded {self.path}")
+            self._config = config
+            self._stat_key = stat_key
+        return self._config
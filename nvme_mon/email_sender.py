@@ -3,43 +3,115 @@ from email.mime.text import MIMEText
 import os
 import ssl
 import logging
+import threading
 from throttled import Throttled, rate_limiter, exceptions
 
 log = logging.getLogger(__name__)
 
+
+def env_flag(name, default=True):
+    value = os.environ.get(name)
+    if value is None or value.strip() == "":
+        return default
+    return value.strip().lower() not in ("0", "false", "no", "off")
+
+
 class EmailSender:
+    """
+    Sends email through one SMTP connection that is kept open between messages. Before each
+    message the connection is checked with NOOP, and it is reopened if the server dropped it
+    (servers close idle connections after a few minutes) or the SMTP settings changed.
+
+    The settings come from the environment (see .env.example). SMTP_STARTTLS and SMTP_LOGIN
+    default to true; set them to false to send to a local sink such as
+    "python -m aiosmtpd -n -l localhost:1025".
+
+    Alerts are sent from the dispatch thread (see nvme_mon.alert_dispatch) and test emails from
+    the UI, so sends are serialized with a lock.
+    """
 
     def __init__(self, rate_limit):
-        self.throttled = Throttled(key="send_email", quota=rate_limiter.per_hour(rate_limit))
+        self.rate_limit = None
+        self.set_rate_limit(rate_limit)
+        self.server = None
+        self.server_settings = None
+        self.lock = threading.Lock()
+
+    def set_rate_limit(self, rate_limit):
+        """Maximum number of emails per hour"""
+        if rate_limit != self.rate_limit:
+            self.rate_limit = rate_limit
+            self.throttled = Throttled(key="send_email", quota=rate_limiter.per_hour(rate_limit))
+
+    def smtp_settings(self):
+        return {
+            "server": os.environ.get('SMTP_SERVER'),
+            "port": os.environ.get('SMTP_PORT'),
+            "email_address": os.environ.get('EMAIL_ADDRESS'),
+            "password": os.environ.get('EMAIL_PASSWORD'),
+            "starttls": env_flag('SMTP_STARTTLS'),
+            "login": env_flag('SMTP_LOGIN'),
+        }
+
+    def connect(self, settings, timeout):
+        log.debug(f"Connecting to {settings['server']}:{settings['port']}")
+        server = smtplib.SMTP(settings["server"], settings["port"], timeout=timeout)
+        try:
+            server.ehlo()
+            if settings["starttls"]:
+                server.starttls(context=ssl.create_default_context())
+                server.ehlo()
+            if settings["login"]:
+                server.login(settings["email_address"], settings["password"])
+        except Exception:
+            server.close()
+            raise
+        return server
+
+    def connection(self, settings, timeout):
+        """The open connection if it is still usable, otherwise a new one"""
+        if self.server is not None and settings == self.server_settings:
+            try:
+                self.server.sock.settimeout(timeout)
+                if self.server.noop()[0] == 250:
+                    return self.server
+            except (smtplib.SMTPException, OSError) as e:
+                log.debug(f"SMTP connection is no longer usable: {e}")
+        self.close()
+        self.server = self.connect(settings, timeout)
+        self.server_settings = settings
+        return self.server
+
+    def close(self):
+        if self.server is not None:
+            try:
+                self.server.quit()
+            except (smtplib.SMTPException, OSError):
+                self.server.close()
+            self.server = None
 
     def send_email(self, subject, body, timeout=30):
         result = self.throttled.limit(key="send_email")
         if result.limited:
             raise exceptions.LimitedError
-        recipient_email=os.environ.get('RECIPIENT')
-        email_address =os.environ.get('EMAIL_ADDRESS')
-        smtp_server = os.environ.get('SMTP_SERVER')
-        smtp_port = os.environ.get('SMTP_PORT')
-        email_password = os.environ.get('EMAIL_PASSWORD')
-
-        log.debug(f"email {email_address}")
-        log.debug(f"password {"********" if email_password else "NOT SET"}")
+        settings = self.smtp_settings()
+        recipient_email = os.environ.get('RECIPIENT')
+
+        log.debug(f"email {settings['email_address']}")
+        log.debug(f"password {"********" if settings['password'] else "NOT SET"}")
         log.debug(f"recipient {recipient_email}")
-        log.debug(f"server {smtp_server}")
-        log.debug(f"port {smtp_port}")
+        log.debug(f"server {settings['server']}")
+        log.debug(f"port {settings['port']}")
 
         msg = MIMEText(body, 'plain')
-        msg['From'] = email_address
+        msg['From'] = settings["email_address"]
         msg['To'] = recipient_email
         msg['Subject'] = subject
 
-        try:
-            context = ssl.create_default_context()
-            with smtplib.SMTP(smtp_server, smtp_port, timeout=timeout) as server:
-                server.ehlo()
-                server.starttls(context=context)
-                server.ehlo()
-                server.login(email_address, email_password)
-                server.sendmail(email_address, recipient_email, msg.as_string())
-        except Exception as e:
-            raise e
\ No newline at end of file
+        with self.lock:
+            try:
+                self.connection(settings, timeout).sendmail(settings["email_address"], recipient_email, msg.as_string())
+            except (smtplib.SMTPServerDisconnected, ConnectionError):
+                # Dropped between the NOOP and the send. Retry once on a new connection.
+                self.close()
+                self.connection(settings, timeout).sendmail(settings["email_address"], recipient_email, msg.as_string())
@@ -0,0 +1,225 @@
+"""
+Event loop for the interactive views.
+
+EventLoop waits with a selector on everything the display reacts to: key presses on stdin, the
+live record feed (see nvme_mon.live), inotify events for the health logs, a pipe the alert
+dispatcher writes to when it finishes a send, and the refresh timer. The process sleeps until
+one of them is ready, so an idle display costs no CPU, and keys are handled as soon as they
+arrive. The terminal is put in cbreak, non-blocking mode once, when the loop is entered, and
+restored when it exits.
+
+Without inotify the logs are still read when the refresh timer expires.
+"""
+
+import os
+import sys
+import time
+import tty
+import fcntl
+import struct
+import ctypes
+import logging
+import termios
+import selectors
+
+from nvme_mon.live import RECONNECT_INTERVAL_SEC
+
+log = logging.getLogger(__name__)
+
+# inotify(7) constants
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+IN_MODIFY = 0x2
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+INOTIFY_EVENT = struct.Struct("iIII") # wd, mask, cookie, len, followed by the name
+
+KEY_NAMES = {
+    127: 'backspace',
+    10: 'return',
+    13: 'return',
+    32: 'space',
+    9: 'tab',
+    27: 'esc',
+}
+# The last byte of the arrow key sequences, ESC [ x or ESC O x
+ARROW_KEYS = {
+    ord('A'): 'up',
+    ord('B'): 'down',
+    ord('C'): 'right',
+    ord('D'): 'left',
+}
+
+
+def parse_keys(data):
+    """Key names for the bytes read from the terminal, which may hold several keys"""
+    keys = []
+    i = 0
+    while i < len(data):
+        b = data[i]
+        if b == 27 and data[i + 1:i + 2] in (b"[", b"O") and i + 2 < len(data):
+            keys.append(ARROW_KEYS.get(data[i + 2], 'esc'))
+            i += 3
+            continue
+        keys.append(KEY_NAMES.get(b, chr(b)))
+        i += 1
+    return keys
+
+
+class FileWatch:
+    """Reports appends to a set of files, and their replacement (e.g. by logrotate), using inotify."""
+
+    def __init__(self, paths):
+        self.fd = None
+        self.libc = None
+        self.dirs = {} # wd -> {name: path}
+        try:
+            libc = ctypes.CDLL(None, use_errno=True)
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd < 0:
+                raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+            self.fd, self.libc = fd, libc
+            for path in paths:
+                directory, name = os.path.split(os.path.abspath(path))
+                self.dirs.setdefault(self._add(directory, IN_CREATE | IN_MOVED_TO), {})[name] = path
+                self._add(path, IN_MODIFY)
+        except (OSError, AttributeError) as e:
+            log.warning(f"Not watching the logs for changes, reading them every refresh interval: {e}")
+            self.close()
+
+    def _add(self, path, mask):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {path}")
+        return wd
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def fileno(self):
+        return self.fd
+
+    def changed(self):
+        """Return True if a watched file changed since the last call. Never blocks."""
+        if self.fd is None:
+            return False
+        changed = False
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+            if not data:
+                break
+            pos = 0
+            while pos < len(data):
+                wd, mask, _, length = INOTIFY_EVENT.unpack_from(data, pos)
+                name = data[pos + INOTIFY_EVENT.size:pos + INOTIFY_EVENT.size + length].rstrip(b"\0")
+                pos += INOTIFY_EVENT.size + length
+                if mask & IN_MODIFY:
+                    changed = True
+                elif wd in self.dirs and (path := self.dirs[wd].get(os.fsdecode(name))) is not None:
+                    # A new file took the log's name. Watch it instead of the old one.
+                    try:
+                        self._add(path, IN_MODIFY)
+                    except OSError as e:
+                        log.debug(f"Unable to watch {path}: {e}")
+                    changed = True
+        return changed
+
+
+class EventLoop:
+    """
+    Used as a context manager around the interactive view. wait() blocks until something
+    happens, and returns what did as a list of (kind, value):
+        ("key", name)    for each key pressed
+        ("refresh", None) when a watched log changed, or refresh_interval passed since the last refresh
+        ("live", None)    when the live feed has records to read
+        ("alerts", None)  when an alert email (or the test email) was sent, or failed to send
+    """
+
+    def __init__(self, refresh_interval, watch_paths=(), live=None):
+        self.refresh_interval = refresh_interval
+        self.watch_paths = watch_paths
+        self.live = live
+        self.live_sock = None
+        self.next_refresh = time.monotonic() + refresh_interval
+        self.selector = None
+        self.watch = None
+        self.wakeup_read = self.wakeup_fd = None
+        self.stdin_fd = sys.stdin.fileno()
+        self.old_term = None
+        self.old_flags = None
+
+    def __enter__(self):
+        self.old_term = termios.tcgetattr(self.stdin_fd)
+        self.old_flags = fcntl.fcntl(self.stdin_fd, fcntl.F_GETFL)
+        tty.setcbreak(self.stdin_fd)
+        fcntl.fcntl(self.stdin_fd, fcntl.F_SETFL, self.old_flags | os.O_NONBLOCK)
+
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.stdin_fd, selectors.EVENT_READ, "key")
+        self.watch = FileWatch(self.watch_paths)
+        if self.watch.fileno() is not None:
+            self.selector.register(self.watch, selectors.EVENT_READ, "refresh")
+        # Written to by the alert dispatcher and test email threads (see AlertManager.set_wakeup_fd)
+        self.wakeup_read, self.wakeup_fd = os.pipe2(os.O_NONBLOCK | os.O_CLOEXEC)
+        self.selector.register(self.wakeup_read, selectors.EVENT_READ, "alerts")
+        return self
+
+    def __exit__(self, *exc_info):
+        self.selector.close()
+        self.watch.close()
+        os.close(self.wakeup_read)
+        os.close(self.wakeup_fd)
+        termios.tcsetattr(self.stdin_fd, termios.TCSADRAIN, self.old_term)
+        fcntl.fcntl(self.stdin_fd, fcntl.F_SETFL, self.old_flags)
+
+    def refreshed(self):
+        """Restart the refresh timer"""
+        self.next_refresh = time.monotonic() + self.refresh_interval
+
+    def _register_live(self):
+        """Keep the selector registration in step with the live feed's socket, which changes on reconnect"""
+        sock = self.live.sock if self.live.connect() else None
+        if sock is not self.live_sock:
+            if self.live_sock is not None:
+                self.selector.unregister(self.live_sock)
+            if sock is not None:
+                self.selector.register(sock, selectors.EVENT_READ, "live")
+            self.live_sock = sock
+
+    def wait(self):
+        while True:
+            timeout = max(0, self.next_refresh - time.monotonic())
+            if self.live is not None:
+                self._register_live()
+                if self.live_sock is None:
+                    # Try to connect again
+                    timeout = min(timeout, RECONNECT_INTERVAL_SEC)
+            events = []
+            for key, _ in self.selector.select(timeout):
+                kind = key.data
+                if kind == "key":
+                    try:
+                        data = os.read(self.stdin_fd, 1024)
+                    except BlockingIOError:
+                        data = b""
+                    events.extend(("key", name) for name in parse_keys(data))
+                elif kind == "refresh":
+                    if self.watch.changed():
+                        events.append(("refresh", None))
+                elif kind == "alerts":
+                    try:
+                        os.read(self.wakeup_read, 1024)
+                    except BlockingIOError:
+                        pass
+                    events.append(("alerts", None))
+                else:
+                    events.append((kind, None))
+            if time.monotonic() >= self.next_refresh and ("refresh", None) not in events:
+                events.append(("refresh", None))
+            if events:
+                return events
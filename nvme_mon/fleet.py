@@ -0,0 +1,276 @@
+"""
+Fleet mode: one client over the health logs of many hosts.
+
+The logs copied from each host to a central box are given as a directory or a glob, e.g.
+"/srv/nvme_fleet/*/nvme_health.json". Each file is one host's current log. The host name is the
+file name without its extension or, for a glob whose files all have the same name, the name of
+the directory the file is in. Device keys get the host appended ("/dev/disk/by-id/nvme-...@host"),
+so the same by-id path on two hosts stays two devices, and devices are shown and alerted on
+as "nvme-...@host".
+
+At startup the hosts are loaded in parallel worker processes, one task per host, each parsing the
+host's rollups, rotated generations and current log. The logs are then followed from where each
+worker stopped. Hosts whose logs appear later are loaded on the next refresh.
+
+The summary ranks every device by health score, max temperature or error growth over the last
+day. A device's row is recomputed only when it gets new records, from its hourly rollups, so a
+refresh costs time in proportion to the new records, not the size of the fleet. Selecting a
+device opens the usual device view.
+"""
+
+import os
+import re
+import sys
+import glob
+import logging
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+from nvme_mon.app import NvmeMon
+from nvme_mon.binlog import BinLogFollower, is_binlog
+from nvme_mon.compact import ROLLUP_SUFFIX, load_rollups, rollup_file_name
+from nvme_mon.ingest import device_record, find_rotated_logs, generation_starts, ingest_record, merge_in_time_order, \
+    parse_log_generation
+from nvme_mon.log_follower import LogFollower
+from nvme_mon.record_decoder import epoch_to_datetime
+from nvme_mon.rollups import DAY, HOUR
+from nvme_mon.trend_rules import TrendRules
+from nvme_mon.rich_ui import fleet_summary_panel, live_screen, render_styled_text
+
+log = logging.getLogger(__name__)
+
+# The suffix of a rotated generation (see nvme_mon.ingest.ROTATED_SUFFIX_RE), at the end of a path
+ROTATED_TAIL_RE = re.compile(r"(?:\.\d+|-\d{8,10})(?:\.(?:gz|bz2|xz))?$")
+ERROR_FIELDS = ("media_errors", "num_err_log_entries")
+PAGE_SIZE = 20
+NONE_LAST = float("inf")
+
+
+def find_host_logs(logs):
+    """Return {host: log path} for a directory or glob of per-host logs."""
+    is_dir = os.path.isdir(logs)
+    paths = glob.glob(os.path.join(glob.escape(logs), "*") if is_dir else logs)
+    paths = sorted(path for path in paths if os.path.isfile(path) and not path.endswith((ROLLUP_SUFFIX, ".tmp")))
+    # Rotated generations are read with their current log
+    current = set(paths)
+    paths = [path for path in paths
+             if (match := ROTATED_TAIL_RE.search(path)) is None or path[:match.start()] not in current]
+    if not is_dir and len({os.path.basename(path) for path in paths}) == 1:
+        names = [os.path.basename(os.path.dirname(os.path.abspath(path))) for path in paths]
+    else:
+        names = [os.path.splitext(os.path.basename(path))[0] for path in paths]
+    hosts = {}
+    for name, path in zip(names, paths):
+        if name in hosts:
+            log.warning(f"Host name {name} of {path} is already used by {hosts[name]}, naming it {path}")
+            name = path
+        hosts[name] = path
+    return hosts
+
+
+def make_follower(path):
+    return BinLogFollower(path) if is_binlog(path) else LogFollower(path)
+
+
+def load_host(host, path, include_rotated, trends):
+    """
+    Parse one host's rollups, rotated generations and current log. Runs in a worker process.
+    Returns (devices, compacted_through, inode, offset), with the device keys namespaced by host.
+    """
+    trend_rules = TrendRules(trends)
+    devices = defaultdict(device_record)
+    generations = []
+    if include_rotated:
+        for rotated in find_rotated_logs(path):
+            try:
+                generations.append(parse_log_generation(rotated))
+            except Exception as e:
+                log.warning(f"Skipping rotated log {rotated}: {e}")
+    compacted_through, runs = load_rollups(rollup_file_name(path), generation_starts(generations))
+    merge_in_time_order(devices, runs + generations)
+    follower = make_follower(path)
+    for record in follower.read_new_records():
+        if compacted_through and record["ts"] < compacted_through:
+            continue
+        ingest_record(devices, record)
+        trend_rules.update(devices[record["device"]]["trends"], record)
+    follower.close()
+    return {f"{device}@{host}": state for device, state in devices.items()}, compacted_through, follower.inode, follower.offset
+
+
+def error_count(health_info):
+    return sum(health_info.get(field) or 0 for field in ERROR_FIELDS)
+
+
+class FleetMon(NvmeMon):
+    DEVICE_PROMPT = "Control keys: tab: next device, esc: fleet summary, s: histogram sort, r: histogram results, w: time window, t: date-time format, e: send test email, q: quit"
+    FLEET_PROMPT = "Control keys: up/down: select, left/right: page, enter: device details, s: rank by, q: quit"
+    # Worst first, ties broken by the other measures
+    RANK_KEYS = [
+        ("Health score", lambda row: (NONE_LAST if row["health_score"] is None else row["health_score"],
+                                      -row["error_growth"], -(row["max_temp"] or 0))),
+        ("Max temp (24h)", lambda row: (NONE_LAST if row["max_temp"] is None else -row["max_temp"],
+                                        -row["error_growth"])),
+        ("Error growth (24h)", lambda row: (-row["error_growth"],
+                                            NONE_LAST if row["health_score"] is None else row["health_score"])),
+    ]
+
+    def __init__(self, logs, headless=True, config_file=None):
+        self.logs = logs
+        self.hosts = {} # host -> {"path", "follower", "compacted_through"}
+        self.summary = {} # device -> summary row
+        self.rank_idx = 0
+        self.selected = 0
+        super().__init__(headless=headless, config_file=config_file)
+
+    def open_log(self, config):
+        self.live = None
+        self.compacted_through = None
+        self.devices = defaultdict(device_record)
+        host_logs = find_host_logs(self.logs)
+        if not host_logs:
+            render_styled_text(f"No host logs found in {self.logs}. Exiting...", "bold red")
+            sys.exit(0)
+        max_workers = min(len(host_logs), os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            futures = {
+                host: pool.submit(load_host, host, path, self.include_rotated_logs, self.trend_rules.config)
+                for host, path in host_logs.items()
+            }
+            for host, future in futures.items():
+                try:
+                    self.add_host(host, host_logs[host], *future.result())
+                except Exception as e:
+                    log.warning(f"Skipping host {host} ({host_logs[host]}): {e}")
+        log.info(f"Loaded {len(self.devices)} devices from {len(self.hosts)} hosts")
+
+    def add_host(self, host, path, devices, compacted_through, inode, offset):
+        follower = make_follower(path)
+        # If the log was replaced since it was parsed, it is read again from the start, and the
+        # records already ingested are skipped by dedupe
+        follower.resume(inode, offset)
+        self.hosts[host] = {"path": path, "follower": follower, "compacted_through": compacted_through}
+        self.devices.update(devices)
+        for device in devices:
+            self.device_updated(device)
+
+    def save_snapshot(self):
+        # The startup snapshot only covers a single log
+        pass
+
+    def refresh_log(self, force_snapshot=False):
+        """
+        Ingest the records appended to each host's log since the last call, after loading the
+        hosts whose logs have appeared. Returns the set of devices that received new records.
+        """
+        for host, path in find_host_logs(self.logs).items():
+            if host not in self.hosts:
+                try:
+                    self.add_host(host, path, *load_host(host, path, self.include_rotated_logs, self.trend_rules.config))
+                    log.info(f"Loaded new host {host} from {path}")
+                except Exception as e:
+                    log.warning(f"Skipping host {host} ({path}): {e}")
+        updated = set()
+        for host, state in self.hosts.items():
+            compacted_through = state["compacted_through"]
+            for record in state["follower"].read_new_records():
+                if compacted_through and record["ts"] < compacted_through:
+                    continue
+                record["device"] = f"{record['device']}@{host}"
+                if self.ingest(record, dedupe=True):
+                    updated.add(record["device"])
+        for device in updated:
+            self.device_updated(device)
+        return updated
+
+    def device_updated(self, device):
+        super().device_updated(device)
+        self.summary[device] = self.summary_row(device)
+
+    def summary_row(self, device):
+        """A device's health, its max temperature and the growth of its error counts over the last day"""
+        record = self.devices[device]
+        path, host = device.rsplit("@", 1)
+        health_info = record["health_info"]
+        last_ts = record["stats"].last_ts
+        max_temp = None
+        baseline = None
+        if last_ts is not None:
+            # Hour resolution: the baseline is the last health info of the hour before the window
+            hourly = record["rollups"].hourly
+            window_start = last_ts - DAY
+            window_start -= window_start % HOUR
+            for start in range(window_start - HOUR, last_ts + 1, HOUR):
+                bucket = hourly.get(start)
+                if bucket is None:
+                    continue
+                if start < window_start or baseline is None:
+                    baseline = bucket.health_info
+                if start >= window_start and bucket.stats.max is not None and (max_temp is None or bucket.stats.max > max_temp):
+                    max_temp = bucket.stats.max
+        return {
+            "device": device,
+            "host": host,
+            "name": os.path.basename(path),
+            "health_score": health_info.get("health_score"),
+            "temp": health_info.get("mean_temperature"),
+            "max_temp": max_temp,
+            "error_growth": max(0, error_count(health_info) - error_count(baseline)) if baseline else 0,
+            "last_seen": epoch_to_datetime(last_ts) if last_ts is not None else None,
+        }
+
+    def watch_paths(self):
+        return [state["path"] for state in self.hosts.values()]
+
+    def display_info(self):
+        with live_screen() as self.screen, self.event_loop() as self.events:
+            self.alert_manager.set_wakeup_fd(self.events.wakeup_fd)
+            try:
+                self.show_summary()
+            finally:
+                self.alert_manager.set_wakeup_fd(None)
+
+    def show_summary(self):
+        while True:
+            rank_name, rank_key = self.RANK_KEYS[self.rank_idx]
+            rows = sorted(self.summary.values(), key=rank_key)
+            self.selected = max(0, min(self.selected, len(rows) - 1))
+            page_start = self.selected - self.selected % PAGE_SIZE
+            page = rows[page_start:page_start + PAGE_SIZE]
+            inputs = (tuple(tuple(row.values()) for row in page), page_start, self.selected, rank_name,
+                      len(self.hosts), len(rows), self.last_refresh)
+            summary = self.panels.get("fleet", inputs, fleet_summary_panel,
+                page,
+                first_rank=page_start + 1,
+                selected=self.selected + 1,
+                rank_key=rank_name,
+                num_hosts=len(self.hosts),
+                num_devices=len(rows),
+                updated=self.last_refresh)
+            self.panels.show(self.screen, [summary, *self.status_panels(self.FLEET_PROMPT)])
+
+            for key in self.wait_keys():
+                self.message = None
+                if key == 'q':
+                    sys.exit(0)
+                elif key == 'up':
+                    self.selected -= 1
+                elif key == 'down':
+                    self.selected += 1
+                elif key == 'left':
+                    self.selected -= PAGE_SIZE
+                elif key == 'right':
+                    self.selected += PAGE_SIZE
+                elif key == 's':
+                    self.rank_idx = (self.rank_idx + 1) % len(self.RANK_KEYS)
+                    self.selected = 0
+                elif key == 'return' and rows:
+                    self.selected = max(0, min(self.selected, len(rows) - 1))
+                    self.drill_down(rows)
+                    # The ranking may have changed meanwhile
+                    break
+
+    def drill_down(self, rows):
+        """Show the selected device, and the next ones in rank order on tab, until esc"""
+        while self.show_device(self.devices[rows[self.selected]["device"]], exit_keys=("tab", "esc")) == "tab":
+            self.selected = (self.selected + 1) % len(rows)
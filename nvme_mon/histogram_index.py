@@ -0,0 +1,94 @@
+"""
+Orderings of a device's temperature histogram ({temp: {"count", "last_date"}}), kept up to date
+as records are ingested, so the histogram view can show its rows in any sort order without
+sorting the histogram on each redraw.
+
+The index holds the temperatures in ascending order (a range query on it gives the rows at or
+above a threshold), the temperatures by descending count, and the temperatures by last
+occurrence. Each record changes one histogram entry: its count goes up by one, which moves it
+ahead of the few entries it passes in the count order, and its last date usually becomes the
+newest, which moves it to the end of the last occurrence order. Changes that don't fit that
+pattern (records older than the newest one, merged states) mark the index for a rebuild on
+its next use.
+"""
+
+from bisect import bisect_left, insort
+from itertools import islice
+
+
+class HistogramIndex:
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+        self.rebuild()
+
+    def rebuild(self):
+        histogram = self.histogram
+        temps = [temp for temp in histogram if temp is not None]
+        self.temps = sorted(temps)
+        self.by_count = sorted(temps, key=lambda temp: (histogram[temp]["count"], temp), reverse=True)
+        self.count_pos = {temp: i for i, temp in enumerate(self.by_count)}
+        # Oldest first, so the newest entry can be moved to the end in O(1)
+        self.by_last_date = dict.fromkeys(sorted(temps, key=lambda temp: (histogram[temp]["last_date"], temp)))
+        self.newest = next(reversed(self.by_last_date), None)
+        self.dirty = False
+
+    def add(self, temp, date_changed=True):
+        """
+        Update the orderings after a record for temp was added to the histogram. date_changed:
+        the record set the entry's last date.
+        """
+        if self.dirty or temp is None:
+            return
+        histogram = self.histogram
+        entry = histogram[temp]
+        by_count = self.by_count
+        i = self.count_pos.get(temp)
+        if i is None:
+            insort(self.temps, temp)
+            i = len(by_count)
+            by_count.append(temp)
+            self.count_pos[temp] = i
+
+        # Move ahead of the entries with a lower count
+        count = entry["count"]
+        if i and histogram[by_count[i - 1]]["count"] <= count:
+            count_pos = self.count_pos
+            while i:
+                prev = by_count[i - 1]
+                prev_count = histogram[prev]["count"]
+                if prev_count > count or (prev_count == count and prev > temp):
+                    break
+                by_count[i] = prev
+                count_pos[prev] = i
+                i -= 1
+            by_count[i] = temp
+            count_pos[temp] = i
+
+        if date_changed and temp != self.newest:
+            if self.newest is None or (entry["last_date"], temp) > (histogram[self.newest]["last_date"], self.newest):
+                by_last_date = self.by_last_date
+                by_last_date.pop(temp, None)
+                by_last_date[temp] = None
+                self.newest = temp
+            else:
+                # A record older than the newest one. Its position is somewhere in the middle.
+                self.dirty = True
+
+    def rows(self, sort_field=None, min_temp=None, limit=None):
+        """
+        The histogram rows as (temp, entry), in descending order of sort_field ("count",
+        "last_date", or None for the temperature), for the temperatures >= min_temp, at most limit.
+        """
+        if self.dirty:
+            self.rebuild()
+        histogram = self.histogram
+        start = 0 if min_temp is None else bisect_left(self.temps, min_temp)
+        if sort_field is None:
+            temps = reversed(self.temps[start:])
+        elif min_temp is None:
+            temps = self.by_count if sort_field == "count" else reversed(self.by_last_date)
+        else:
+            # Only the rows in range are sorted
+            temps = sorted(self.temps[start:], key=lambda temp: (histogram[temp][sort_field], temp), reverse=True)
+        return [(temp, histogram[temp]) for temp in islice(temps, limit)]
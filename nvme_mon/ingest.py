@@ -0,0 +1,180 @@
+"""
+Per-device state built from the NVME health log, and parallel ingest of rotated log generations.
+
+A device record holds the temperature histogram and its sort orders (see
+nvme_mon.histogram_index), running temperature stats, hourly and daily rollups and the latest
+health info for one device. Records from a log file are folded in one at a time with
+ingest_record. Partial states built from separate files (in separate processes) are
+combined with merge_devices, oldest first. The rollups and the rotated generations interleave
+in time, depending on when compaction and logrotate ran, so the rollups are split into runs at
+the start of each generation (see generation_starts and nvme_mon.compact.load_rollups), and
+merge_in_time_order sorts each device's runs and generations by their first record.
+"""
+
+import os
+import re
+import bz2
+import glob
+import gzip
+import lzma
+import logging
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from nvme_mon.record_decoder import HEALTH_FIELDS, decode_records, epoch_to_datetime
+from nvme_mon.binlog import BinLogDecoder, is_binlog_file
+from nvme_mon.temp_stats import TempStats
+from nvme_mon.histogram_index import HistogramIndex
+from nvme_mon.rollups import Rollups
+
+log = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1 << 20
+
+# Generations written by logrotate, e.g. nvme_health.json.1, nvme_health.json.2.gz, or with
+# dateext, nvme_health.json-20250101.gz
+ROTATED_SUFFIX_RE = re.compile(r"^(?:\.(?P<num>\d+)|-(?P<date>\d{8,10}))(?:\.(?P<ext>gz|bz2|xz))?$")
+
+OPENERS = {
+    "gz": gzip.open,
+    "bz2": bz2.open,
+    "xz": lzma.open,
+}
+
+
+def histo_record():
+    return {"count": 0, "last_date": datetime(1970, 1, 1)}
+
+def device_record():
+    histogram = defaultdict(histo_record)
+    return {
+        "histogram": histogram,
+        "histogram_index": HistogramIndex(histogram),
+        "stats": TempStats(),
+        "rollups": Rollups(),
+        "temp_info": {},
+        "health_info": {},
+        "trends": {}, # Trend rule trackers, see nvme_mon.trend_rules
+    }
+
+
+def get_health_info(record):
+    return {field: record.get(field) for field in HEALTH_FIELDS}
+
+
+def ingest_record(devices, record):
+    device = devices[record["device"]]
+    ts = record["ts"]
+    histo_entry = device["histogram"][record["mean_temperature"]]
+    histo_entry["count"] += 1
+    record_date = epoch_to_datetime(ts)
+    date_changed = record_date > histo_entry["last_date"]
+    if date_changed:
+        histo_entry["last_date"] = record_date
+    device["histogram_index"].add(record["mean_temperature"], date_changed)
+    device["stats"].add(ts, record["mean_temperature"])
+    device["health_info"] = get_health_info(record)
+    device["rollups"].add(ts, record["mean_temperature"], device["health_info"])
+
+
+def merge_devices(devices, newer):
+    """Merge the device state built from a newer log file into devices, in place."""
+    for name, src in newer.items():
+        dst = devices[name]
+        for temp, entry in src["histogram"].items():
+            histo_entry = dst["histogram"][temp]
+            histo_entry["count"] += entry["count"]
+            histo_entry["last_date"] = max(histo_entry["last_date"], entry["last_date"])
+        dst["histogram_index"].dirty = True
+        dst["stats"].merge(src["stats"])
+        dst["rollups"].merge(src["rollups"])
+        if src["health_info"]:
+            dst["health_info"] = src["health_info"]
+
+
+def merge_in_time_order(devices, partials):
+    """
+    Merge partial device states into devices, each device's states oldest first by their first
+    record. A device's states must not overlap in time.
+    """
+    states = defaultdict(list)
+    for partial in partials:
+        for name, state in partial.items():
+            states[name].append(state)
+    for name, device_states in states.items():
+        device_states.sort(key=lambda state: state["stats"].first_ts if state["stats"].first_ts is not None else float("-inf"))
+        for state in device_states:
+            merge_devices(devices, {name: state})
+
+
+def generation_starts(partials):
+    """The times of the first record of each device in each partial state, as {device: sorted times}"""
+    starts = defaultdict(list)
+    for partial in partials:
+        for name, state in partial.items():
+            if state["stats"].first_ts is not None:
+                starts[name].append(state["stats"].first_ts)
+    return {name: sorted(times) for name, times in starts.items()}
+
+
+def find_rotated_logs(log_file):
+    """Return the rotated generations of log_file, oldest first."""
+    numbered, dated = [], []
+    for path in glob.glob(glob.escape(log_file) + "[.-]*"):
+        match = ROTATED_SUFFIX_RE.match(path[len(log_file):])
+        if match is None:
+            continue
+        if match["num"] is not None:
+            numbered.append((-int(match["num"]), path))
+        else:
+            dated.append((match["date"], path))
+    # Dated generations only exist if dateext was switched on at some point, after any numbered ones
+    return [path for _, path in sorted(numbered)] + [path for _, path in sorted(dated)]
+
+
+def _open_log(path):
+    return OPENERS.get(path.rsplit(".", 1)[-1], open)(path, "rb")
+
+
+def parse_log_generation(path):
+    """Parse one complete log file into a device state. Runs in a worker process."""
+    devices = defaultdict(device_record)
+    pending = b""
+    with _open_log(path) as f:
+        if is_binlog_file(f):
+            for record in BinLogDecoder().decode_all(f.read(), path):
+                ingest_record(devices, record)
+            return devices
+        while chunk := f.read(CHUNK_SIZE):
+            lines = (pending + chunk).split(b"\n")
+            pending = lines.pop()
+            for record in decode_records((line for line in lines if line), path):
+                ingest_record(devices, record)
+    if pending.strip():
+        for record in decode_records([pending], path):
+            ingest_record(devices, record)
+    return devices
+
+
+def parse_log_generations(paths, max_workers=None):
+    """
+    Parse the given log files, one worker process per file. Returns their device states in the
+    order given (oldest first), to be merged with merge_in_time_order. Files that can't be read
+    are skipped.
+    """
+    if not paths:
+        return []
+    partials = []
+    max_workers = min(len(paths), max_workers or os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(parse_log_generation, path) for path in paths]
+        for path, future in zip(paths, futures):
+            try:
+                partial = future.result()
+            except Exception as e:
+                log.warning(f"Skipping rotated log {path}: {e}")
+                continue
+            log.debug(f"Parsed {len(partial)} devices from {path}")
+            partials.append(partial)
+    return partials
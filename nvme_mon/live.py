@@ -0,0 +1,107 @@
+"""
+Subscriber for the live record feed published by the collector (nvme_monitor.py --socket).
+
+The collector broadcasts each record it collects on a Unix stream socket, as a frame made of a
+4-byte big-endian length followed by the record's JSON line, so the app can ingest it right
+away instead of waiting for its next read of the log. The log file stays the source of truth:
+if the socket isn't there (the collector isn't running, or doesn't publish), or the collector
+drops a subscriber that fell behind, the app keeps following the file, and it reconnects
+when the socket comes back. The records published while it wasn't subscribed are only in
+the file, so after each connect the app reads the file up to its end before ingesting any
+live records (see connections).
+"""
+
+import time
+import socket
+import logging
+
+from struct import Struct
+
+from nvme_mon.record_decoder import decode_records
+
+log = logging.getLogger(__name__)
+
+FRAME_HEADER = Struct(">I")
+# No record comes close to this. A bigger length means the stream is out of step.
+MAX_FRAME_SIZE = 1 << 20
+RECONNECT_INTERVAL_SEC = 5
+
+
+class LiveFeed:
+
+    def __init__(self, path):
+        self.path = path
+        self.sock = None
+        self.buffer = b""
+        self.last_attempt = None
+        # Incremented on each successful connect, so callers can tell they may have missed records
+        self.connections = 0
+
+    def connect(self):
+        """Connect if not connected, at most every RECONNECT_INTERVAL_SEC. Returns True if connected."""
+        if self.sock is not None:
+            return True
+        now = time.monotonic()
+        if self.last_attempt is not None and now - self.last_attempt < RECONNECT_INTERVAL_SEC:
+            return False
+        self.last_attempt = now
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.path)
+        except OSError as e:
+            sock.close()
+            log.debug(f"Live feed {self.path} not available: {e}")
+            return False
+        sock.setblocking(False)
+        self.sock = sock
+        self.buffer = b""
+        self.connections += 1
+        log.info(f"Subscribed to live records on {self.path}")
+        return True
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def fileno(self):
+        """For select(). Only valid while connected."""
+        return self.sock.fileno()
+
+    def read_records(self):
+        """Return the records received since the last call, without blocking."""
+        if not self.connect():
+            return []
+        chunks = []
+        while True:
+            try:
+                data = self.sock.recv(1 << 16)
+            except BlockingIOError:
+                break
+            except OSError as e:
+                log.info(f"Live feed {self.path} failed: {e}")
+                data = b""
+            if not data:
+                log.info(f"Live feed {self.path} closed, following the log file")
+                self.close()
+                break
+            chunks.append(data)
+        if not chunks:
+            return []
+
+        data = self.buffer + b"".join(chunks)
+        lines = []
+        pos = 0
+        while len(data) - pos >= FRAME_HEADER.size:
+            (length,) = FRAME_HEADER.unpack_from(data, pos)
+            if length > MAX_FRAME_SIZE:
+                log.warning(f"Bad frame length {length} from {self.path}, reconnecting")
+                self.close()
+                break
+            end = pos + FRAME_HEADER.size + length
+            if end > len(data):
+                break
+            lines.append(data[pos + FRAME_HEADER.size:end])
+            pos = end
+        self.buffer = data[pos:] if self.sock is not None else b""
+        return list(decode_records(lines, self.path))
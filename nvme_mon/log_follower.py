@@ -0,0 +1,119 @@
+"""
+Incremental reader for the NVME health data log.
+
+Remembers the byte offset and inode of the log file between reads, so each
+refresh only reads the lines appended since the previous one. Rotation
+(the path now points to a different inode) and truncation (the file shrank
+below the saved offset) are detected, and reading continues at the start of
+the new file contents.
+"""
+
+import os
+import logging
+
+from nvme_mon.record_decoder import decode_records
+
+log = logging.getLogger(__name__)
+
+# Read the log in large chunks rather than line by line
+CHUNK_SIZE = 1 << 20
+
+
+class LogFollower:
+
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+        self.inode = None
+        # Incremented when the log is found rotated or truncated
+        self.rotations = 0
+        self._file = None
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def rewind(self):
+        """Start over from the beginning of the current log file on the next read."""
+        self.close()
+        self.offset = 0
+        self.inode = None
+
+    def resume(self, inode, offset):
+        """
+        Continue following from a previously saved position. Returns False, leaving the
+        follower at the start of the file, if the path no longer refers to the same inode.
+        """
+        if not self._open() or self.inode != inode:
+            return False
+        self.offset = offset
+        return True
+
+    def _open(self):
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            return False
+        self.close()
+        self._file = f
+        self.inode = os.fstat(f.fileno()).st_ino
+        self.offset = 0
+        return True
+
+    def _read_lines(self):
+        """Yield complete lines (without the newline) from the open file, starting at the saved offset."""
+        self._file.seek(self.offset)
+        pending = b""
+        while True:
+            chunk = self._file.read(CHUNK_SIZE)
+            if not chunk:
+                # Anything left in pending is a line the collector is still writing. Pick it up next time.
+                break
+            data = pending + chunk if pending else chunk
+            end = data.rfind(b"\n") + 1
+            pending = data[end:]
+            if end == 0:
+                continue
+            lines = data[:end].split(b"\n")
+            lines.pop()
+            for line in lines:
+                self.offset += len(line) + 1
+                yield line
+
+    def _read_records(self):
+        return decode_records(self._read_lines(), self.path)
+
+    def read_new_lines(self):
+        """
+        Yield the complete lines appended to the log since the last call.
+        The caller must consume the generator fully for the offset to advance.
+        """
+        return self._follow(self._read_lines)
+
+    def read_new_records(self):
+        """Like read_new_lines, but yields the decoded records (see decode_record), skipping malformed lines."""
+        return self._follow(self._read_records)
+
+    def _follow(self, read):
+        if self._file is None and not self._open():
+            return
+
+        if os.fstat(self._file.fileno()).st_size < self.offset:
+            log.info(f"{self.path} was truncated, reading from the beginning")
+            self.offset = 0
+            self.rotations += 1
+
+        # Drain whatever is left in the file we have open. After a rotation this is the
+        # tail written to the old file before it was renamed.
+        yield from read()
+
+        try:
+            inode = os.stat(self.path).st_ino
+        except FileNotFoundError:
+            return
+        if inode != self.inode:
+            log.info(f"{self.path} was rotated, reading the new file from the beginning")
+            if self._open():
+                self.rotations += 1
+                yield from read()
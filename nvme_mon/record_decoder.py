@@ -0,0 +1,121 @@
+"""
+Fast decoder for NVME health log records.
+
+The collector (nvme_monitor.py) writes one json.dumps() line per sample, always with
+the same keys in the same order. Only a few of those fields are used by the app, so
+instead of decoding the whole object with json.loads, the needed values are pulled
+out with a single anchored regex match, and the fixed-format timestamp is converted to
+epoch seconds with integer arithmetic instead of strptime. Lines that don't look like
+the collector's output fall back to json.loads.
+
+Timestamps are naive local times, so "epoch seconds" here are seconds since
+1970-01-01 00:00:00 in the same naive time scale, not UTC.
+"""
+
+import re
+import json
+import logging
+from datetime import date, datetime, timedelta
+
+log = logging.getLogger(__name__)
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+EPOCH = datetime(1970, 1, 1)
+_EPOCH_ORDINAL = EPOCH.toordinal()
+
+HEALTH_FIELDS = (
+    "power_on_hours",
+    "unsafe_shutdowns",
+    "media_errors",
+    "num_err_log_entries",
+    "percentage_used",
+    "health_score",
+    "mean_temperature",
+)
+
+# One anchored match over a line in the collector's key order (see extract_health in
+# nvme_monitor.py). The unused temperature/sensor fields are skipped. Escaped strings,
+# non-integer values or a different key order don't match and go to the json.loads fallback.
+_VALUE = rb'(-?\d+|null)'
+_RECORD_RE = re.compile(
+    rb'\{"timestamp": "([^"]{19})", "device": "([^"\\]+)", .*?'
+    rb'"power_on_hours": ' + _VALUE +
+    rb', "unsafe_shutdowns": ' + _VALUE +
+    rb', "media_errors": ' + _VALUE +
+    rb', "num_err_log_entries": ' + _VALUE +
+    rb', "percentage_used": ' + _VALUE +
+    rb', "health_score": ' + _VALUE +
+    rb', .*?"mean_temperature": ' + _VALUE + rb'\}\s*$'
+)
+
+# Device names decoded so far. There are only a handful, so each is decoded once.
+_device_names = {}
+
+# Start-of-day epoch seconds, keyed by the date part of the timestamp
+_day_seconds = {}
+
+
+def parse_timestamp(ts):
+    """Convert a DATE_FORMAT timestamp (str or bytes) to naive epoch seconds."""
+    if len(ts) == 19:
+        day = ts[:10]
+        base = _day_seconds.get(day)
+        try:
+            if base is None:
+                base = (date(int(ts[0:4]), int(ts[5:7]), int(ts[8:10])).toordinal() - _EPOCH_ORDINAL) * 86400
+                _day_seconds[day] = base
+            return base + int(ts[11:13]) * 3600 + int(ts[14:16]) * 60 + int(ts[17:19])
+        except ValueError:
+            pass
+    if isinstance(ts, bytes):
+        ts = ts.decode()
+    return datetime_to_epoch(datetime.strptime(ts, DATE_FORMAT))
+
+
+def epoch_to_datetime(ts):
+    return EPOCH + timedelta(seconds=ts)
+
+
+def datetime_to_epoch(dt):
+    return int((dt - EPOCH).total_seconds())
+
+
+def _decode_json(line):
+    record = json.loads(line)
+    decoded = {field: record.get(field) for field in HEALTH_FIELDS}
+    decoded["device"] = record["device"]
+    decoded["timestamp"] = record["timestamp"]
+    decoded["ts"] = parse_timestamp(record["timestamp"])
+    return decoded
+
+
+def decode_record(line):
+    """
+    Decode one log line (bytes) into a dict with the device, the timestamp string, the
+    timestamp as epoch seconds ("ts") and the health fields used by the app.
+    """
+    match = _RECORD_RE.match(line)
+    if match is None:
+        return _decode_json(line)
+
+    timestamp, device, *values = match.groups()
+    name = _device_names.get(device)
+    if name is None:
+        name = _device_names[device] = device.decode()
+    record = {field: None if value == b"null" else int(value) for field, value in zip(HEALTH_FIELDS, values)}
+    record["device"] = name
+    record["timestamp"] = timestamp.decode()
+    record["ts"] = parse_timestamp(timestamp)
+    return record
+
+
+def decode_records(lines, source):
+    """
+    Decode log lines, skipping (with a warning) lines that can't be decoded, such as a
+    line cut short when the collector crashed mid-write.
+    """
+    for line in lines:
+        try:
+            yield decode_record(line)
+        except (ValueError, KeyError) as e:
+            log.warning(f"Skipping malformed line in {source}: {line[:80]!r} ({e})")
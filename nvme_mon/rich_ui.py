@@ -1,8 +1,19 @@
-from rich.console import Console
+"""
+Rich rendering for the interactive views.
+
+Everything is printed through one Console. The *_panel functions build the renderables, and the
+print_* functions print them directly. The interactive views instead show them in a full-screen
+rich.Live (live_screen), through a PanelCache: each panel is rendered to segments once and reused
+until its inputs or the terminal size change, and the screen is redrawn only when some panel did
+change. Nothing scrolls, and an idle view sends nothing to the terminal.
+"""
+
+from rich.console import Console, Group
+from rich.live import Live
 from rich.panel import Panel
+from rich.segment import Segments
 from rich.text import Text
-from rich.color import Color, parse_rgb_hex
-from rich.style import Style
+from rich.table import Table
 import shutil
 from datetime import datetime
 
@@ -16,6 +27,8 @@ TIME_FORMAT = "%H:%M:%S"
 YELLOW_THRESHOLD = 60
 RED_THRESHOLD = 70
 
+console = Console(force_terminal=True, color_system="standard", legacy_windows=False, safe_box=False)
+
 RESULTS_SCOPE_MAP = {
     "top_5": {"text": "Top 5", "style": "bright_blue"},
     "all": {"text": "All", "style": "bright_blue"},
@@ -32,11 +45,11 @@ def bar_color_for_value(temp):
     else:
         return "red"
     
-def render_top_line_text(sort_key, width):
+def render_top_line_text(sort_key, width, updated=None):
     text = [
         "Temp | Count | Last Occurrence  (Sorting by ",
         f"{sort_key})",
-        f"Last updated: {datetime.now().strftime(TIME_FORMAT)}"
+        f"Last updated: {(updated or datetime.now()).strftime(TIME_FORMAT)}"
     ]
     l1 = sum([len(t) for t in text[:2]])
     remainder = width - l1
@@ -57,17 +70,22 @@ def render_results_text(results_scope):
         Text(f"{RESULTS_SCOPE_MAP[results_scope]["text"]}", style=f"{RESULTS_SCOPE_MAP[results_scope]["style"]}") +
         Text(" Results"))
 
-def render_prompt_text(prompt):
+def prompt_text(prompt):
     text = Text(prompt)
-    text.highlight_regex('tab:|[^(key)]s:|r:|t:|e:|q:', "green")
+    text.highlight_regex('tab:|esc:|enter:|up/down:|left/right:|[^(key)]s:|r:|w:|t:|e:|q:', "green")
     text.highlight_regex(':', "white")
-    console = Console(force_terminal=True, color_system="standard", legacy_windows=False, safe_box=False)
-    console.print(text)
+    return text
+
+def render_prompt_text(prompt):
+    console.print(prompt_text(prompt))
 
 def render_styled_text(text, style):
-    console = Console(force_terminal=True, color_system="standard", legacy_windows=False, safe_box=False)
     console.print(Text(text, style=style))
 
+def status_text(lines):
+    """Lines given as (text, style)"""
+    return Group(*(Text(text, style=style) for text, style in lines))
+
 def render_bar(label, value, last_date, dt_display, max_value, width):
     pct = value / max_value if max_value else 0
     val_text = f"{value:3.0f}"
@@ -107,7 +125,7 @@ def render_bar(label, value, last_date, dt_display, max_value, width):
     return line
 
 
-def print_histogram(
+def histogram_panel(
     data,
     *,
     dt_display="date",
@@ -116,10 +134,9 @@ def print_histogram(
     max_width=170,
     box=True,
     spacing=1,
-    title="Histogram"
+    title="Histogram",
+    updated=None
 ):
-    console = Console(force_terminal=True, color_system="standard", legacy_windows=False, safe_box=False)
-
     # Auto terminal width
     term_width = shutil.get_terminal_size((120, 40)).columns
     if dt_display == 'date':
@@ -131,7 +148,7 @@ def print_histogram(
     max_value = max(v["count"] for _, v in data.items()) if len(data.items()) else 0
 
     lines = []
-    lines.append(render_top_line_text(sort_key, width))
+    lines.append(render_top_line_text(sort_key, width, updated))
     lines.append(Text(""))
     lines.append(render_results_text(results_scope))
     lines.append(Text(""))
@@ -143,33 +160,32 @@ def print_histogram(
         for _ in range(spacing):
             lines.append(Text(""))
 
-    # Put inside box or print raw
+    # Put inside box or return raw
     if box:
-        console.print(Panel(Text("\n").join(lines), title=title))
-    else:
-        for l in lines:
-            console.print(l)
-    console.clear_live
+        return Panel(Text("\n").join(lines), title=title)
+    return Group(*lines)
 
-def print_general_info(
+def print_histogram(data, **kwargs):
+    console.print(histogram_panel(data, **kwargs))
+
+def general_info_panel(
     data,
     *,
     max_width=80
 ):
-    console = Console(force_terminal=True, color_system="standard", legacy_windows=False, safe_box=True)
+    line = Text("Device: ") + Text(data["Device"], style="bold blue on white") + Text(f"    Log Info: {data["Log Data"]}")
+    return Panel(line)
 
-    line = Text(f"Device: ") + Text(data["Device"], style="bold blue on white") + Text(f"    Log Info: {data["Log Data"]}")
-    console.print(Panel(line))
+def print_general_info(data, **kwargs):
+    console.print(general_info_panel(data, **kwargs))
 
-def print_disk_info(
+def disk_info_panel(
     data,
     *,
     max_width=200,
     box=True,
     title="Histogram"
 ):
-    console = Console(force_terminal=True, color_system="standard", legacy_windows=False, safe_box=False)
-
     # Auto terminal width
     term_width = shutil.get_terminal_size((80, 20)).columns
     width = min(max_width, term_width - 20)
@@ -209,17 +225,90 @@ def print_disk_info(
 
     new_lines.append(Text(""))
     
-     # Put inside box or print raw
+     # Put inside box or return raw
     if box:
-        console.print(Panel(Text("\n").join(new_lines), title=title))
-    else:
-        for l in new_lines:
-            console.print(l)
+        return Panel(Text("\n").join(new_lines), title=title)
+    return Group(*new_lines)
+
+def print_disk_info(data, **kwargs):
+    console.print(disk_info_panel(data, **kwargs))
+
+def fleet_summary_panel(
+    rows,
+    *,
+    first_rank=1,
+    selected=None,
+    rank_key="Health score",
+    num_hosts=0,
+    num_devices=0,
+    title="Fleet Summary",
+    updated=None
+):
+    """Rows of the fleet summary (see nvme_mon.fleet), the selected one highlighted"""
+    table = Table(expand=True, box=None, header_style="bright_green")
+    for column in ("#", "Host", "Device", "Health", "Temp", "Max temp (24h)", "Errors (+24h)", "Last record"):
+        table.add_column(column, justify="left" if column in ("Host", "Device") else "right")
+    for i, row in enumerate(rows):
+        temp, max_temp = row["temp"], row["max_temp"]
+        table.add_row(
+            str(first_rank + i),
+            row["host"],
+            row["name"],
+            str(row["health_score"]) if row["health_score"] is not None else "-",
+            Text(str(temp), style=bar_color_for_value(temp)) if temp is not None else "-",
+            Text(str(max_temp), style=bar_color_for_value(max_temp)) if max_temp is not None else "-",
+            Text(f"+{row['error_growth']}", style="bright_red") if row["error_growth"] > 0 else "0",
+            datetime.strftime(row["last_seen"], DATETIME_FORMAT) if row["last_seen"] is not None else "-",
+            style="reverse" if first_rank + i == selected else None)
+
+    top_line = Text.assemble(
+        (f"{num_devices} devices on {num_hosts} hosts (ranking by ", "bright_green"),
+        (rank_key, "bright_red"),
+        (")", "bright_green"),
+        (f"    Last updated: {(updated or datetime.now()).strftime(TIME_FORMAT)}", "gray50"))
+    return Panel(table, title=title, subtitle=top_line)
+
+def print_fleet_summary(rows, **kwargs):
+    console.print(fleet_summary_panel(rows, **kwargs))
 
 def print_debug(msg):
-    console = Console(force_terminal=True, color_system="standard", legacy_windows=False, safe_box=False)
     console.print(msg)
 
+def live_screen():
+    """Full-screen live display on the shared console, redrawn only when updated with refresh=True"""
+    return Live(console=console, screen=True, auto_refresh=False)
+
+
+class PanelCache:
+    """
+    Panels rendered to segments, keyed by name. get() renders a panel again only if its inputs
+    differ from the last call or the terminal was resized, and notes that the screen needs a redraw.
+    """
+
+    def __init__(self):
+        self.panels = {} # name -> (inputs, Segments)
+        self.size = None
+        self.changed = True
+        self.shown = []
+
+    def get(self, name, inputs, render, *args, **kwargs):
+        if console.size != self.size:
+            self.size = console.size
+            self.panels.clear()
+        cached = self.panels.get(name)
+        if cached is None or cached[0] != inputs:
+            segments = Segments(list(console.render(render(*args, **kwargs), console.options)))
+            cached = self.panels[name] = (inputs, segments)
+            self.changed = True
+        return cached[1]
+
+    def show(self, screen, panels):
+        """Redraw the screen with the given panels, if they or any of their contents changed"""
+        if self.changed or panels != self.shown:
+            screen.update(Group(*panels), refresh=True)
+            self.changed = False
+            self.shown = panels
+
 # ----------------- Example -----------------
 if __name__ == "__main__":
     histogram_data = dict([
@@ -0,0 +1,183 @@
+"""
+Hourly and daily rollups of a device's records, for histogram and summary queries over a time window.
+
+Each bucket holds the temperature count histogram (with the last time each temperature was
+seen), running temperature stats and the last health info for one hour or one day. A window
+query merges the daily buckets that lie completely inside the window with the hourly buckets
+at its edges, so its cost depends on the length of the window in days, not on the number
+of records.
+
+Times are naive epoch seconds, as produced by nvme_mon.record_decoder.
+"""
+
+import copy
+
+from nvme_mon.temp_stats import TempStats
+
+HOUR = 3600
+DAY = 86400
+# Hourly buckets older than this (relative to the newest record) are dropped. Windows reaching
+# further back use the daily buckets, with day resolution at their start.
+HOURLY_RETENTION = 31 * DAY
+
+
+class Bucket:
+
+    def __init__(self, start):
+        self.start = start
+        self.histogram = {} # temp -> [count, last_ts]
+        self.stats = TempStats()
+        self.health_info = {}
+
+    def add(self, ts, temp, health_info):
+        entry = self.histogram.get(temp)
+        if entry is None:
+            self.histogram[temp] = [1, ts]
+        else:
+            entry[0] += 1
+            if ts > entry[1]:
+                entry[1] = ts
+        self.stats.add(ts, temp)
+        self.health_info = health_info
+
+    def merge(self, newer):
+        for temp, (count, last_ts) in newer.histogram.items():
+            entry = self.histogram.get(temp)
+            if entry is None:
+                self.histogram[temp] = [count, last_ts]
+            else:
+                entry[0] += count
+                entry[1] = max(entry[1], last_ts)
+        self.stats.merge(newer.stats)
+        if newer.health_info:
+            self.health_info = newer.health_info
+
+    def to_dict(self):
+        return {
+            "start": self.start,
+            "histogram": self.histogram,
+            "stats": self.stats.to_dict(),
+            "health_info": self.health_info,
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        bucket = cls(d["start"])
+        # JSON turns the temperature keys into strings
+        bucket.histogram = {(None if temp == "null" else int(temp)): entry for temp, entry in d["histogram"].items()}
+        bucket.stats = TempStats.from_dict(d["stats"])
+        bucket.health_info = d["health_info"]
+        return bucket
+
+
+class Rollups:
+    """
+    Records are added to their hourly bucket only. When records for a new hour arrive, the
+    previous (open) hour is folded into its daily bucket, so each record costs one bucket update.
+    """
+
+    def __init__(self):
+        self.hourly = {}
+        self.daily = {}
+        self._open_hour = None # Not yet folded into self.daily
+
+    def add(self, ts, temp, health_info):
+        hour = self._open_hour
+        if hour is None or not hour.start <= ts < hour.start + HOUR:
+            start = ts - ts % HOUR
+            folded = self.hourly.get(start)
+            if folded is not None:
+                # Out of order record (late, or after one for an earlier hour) for an hour that was
+                # already folded into its day
+                folded.add(ts, temp, health_info)
+                self._bucket(self.daily, start - start % DAY).add(ts, temp, health_info)
+                return
+            self.flush()
+            hour = self._open_hour = self.hourly[start] = Bucket(start)
+        hour.add(ts, temp, health_info)
+
+    def flush(self):
+        """Fold the open hour into its day"""
+        hour = self._open_hour
+        if hour is None:
+            return
+        day_start = hour.start - hour.start % DAY
+        new_day = day_start not in self.daily
+        self._bucket(self.daily, day_start).merge(hour)
+        self._open_hour = None
+        if new_day:
+            self.prune()
+
+    def _bucket(self, buckets, start):
+        bucket = buckets.get(start)
+        if bucket is None:
+            bucket = buckets[start] = Bucket(start)
+        return bucket
+
+    def prune(self):
+        if not self.hourly:
+            return
+        cutoff = max(self.hourly) - HOURLY_RETENTION
+        for start in [start for start in self.hourly if start < cutoff]:
+            del self.hourly[start]
+
+    def add_bucket(self, bucket, period):
+        """Add a bucket read from the rollup file (see nvme_mon.compact). Buckets must be added oldest first."""
+        self.flush()
+        if period == "hour":
+            self.hourly[bucket.start] = bucket
+            day = copy.deepcopy(bucket)
+            day.start = bucket.start - bucket.start % DAY
+        else:
+            day = bucket
+        if day.start in self.daily:
+            self.daily[day.start].merge(day)
+        else:
+            self.daily[day.start] = day
+
+    def merge(self, newer):
+        """Merge the rollups built from a newer log file into these, in place."""
+        self.flush()
+        newer.flush()
+        for mine, theirs in ((self.hourly, newer.hourly), (self.daily, newer.daily)):
+            for start, bucket in sorted(theirs.items()):
+                if start in mine:
+                    mine[start].merge(bucket)
+                else:
+                    mine[start] = bucket
+        self.prune()
+
+    def window_buckets(self, start, end=None):
+        """
+        Return the buckets covering [start, end), oldest first. start is rounded down and end
+        (None = open ended) up to the hour, or to the day beyond the hourly retention.
+        """
+        start -= start % HOUR
+        first_full_day = -(-start // DAY) * DAY
+        oldest_hour = min(self.hourly) if self.hourly else None
+        if oldest_hour is not None and start < oldest_hour:
+            # No hourly data this far back, fall back to the whole day
+            start -= start % DAY
+            first_full_day = start
+        if end is None:
+            end_day = max(self.daily) + DAY if self.daily else first_full_day
+            end_hour = end_day
+        else:
+            end_hour = -(-end // HOUR) * HOUR
+            end_day = max(first_full_day, end_hour - end_hour % DAY)
+            if oldest_hour is not None and end_day < oldest_hour and end_hour > end_day:
+                end_day += DAY
+                end_hour = end_day
+
+        buckets = [self.hourly[h] for h in range(start, min(first_full_day, end_hour), HOUR) if h in self.hourly]
+        buckets += [self.daily[d] for d in range(first_full_day, end_day, DAY) if d in self.daily]
+        buckets += [self.hourly[h] for h in range(max(end_day, start), end_hour, HOUR) if h in self.hourly]
+        return buckets
+
+    def query(self, start, end=None):
+        """Merge the buckets covering [start, end) into a single bucket."""
+        self.flush()
+        merged = Bucket(start)
+        for bucket in self.window_buckets(start, end):
+            merged.merge(bucket)
+        return merged
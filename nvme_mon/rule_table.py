@@ -0,0 +1,63 @@
+"""
+Alert thresholds compiled into a rule table, checked for all devices in one vectorized pass.
+
+RuleTable is built from the alert_thresholds config when it is loaded: the fields that have a
+threshold, the thresholds as an array, and whether each field alerts below its threshold
+rather than above it. HealthMatrix keeps the latest health values of every device as one row of
+a float matrix (NaN where a value is missing), and a row is rewritten only when its device gets
+a new record. breaches() compares the whole matrix with the thresholds at once and returns only
+the breached (device, field) pairs, so the per-field alert logic in Python runs for those alone.
+
+Needs NumPy. Without it, AlertManager checks one device at a time with compare_func.
+"""
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from nvme_mon.record_decoder import HEALTH_FIELDS
+
+INITIAL_ROWS = 64
+
+
+class RuleTable:
+
+    def __init__(self, thresholds, below):
+        """thresholds: {field: threshold}, below: the fields that alert when below their threshold"""
+        self.fields = [field for field in HEALTH_FIELDS if thresholds.get(field) is not None]
+        self.columns = np.array([HEALTH_FIELDS.index(field) for field in self.fields], dtype=np.intp)
+        self.thresholds = np.array([thresholds[field] for field in self.fields], dtype=np.float64)
+        self.below = np.array([field in below for field in self.fields], dtype=bool)
+
+
+class HealthMatrix:
+
+    def __init__(self):
+        self.rows = {} # device name -> row
+        self.names = []
+        self.values = np.full((INITIAL_ROWS, len(HEALTH_FIELDS)), np.nan)
+
+    def __len__(self):
+        return len(self.names)
+
+    def set(self, device_name, health_info):
+        row = self.rows.get(device_name)
+        if row is None:
+            row = self.rows[device_name] = len(self.names)
+            self.names.append(device_name)
+            if row == len(self.values):
+                grown = np.full((2 * len(self.values), len(HEALTH_FIELDS)), np.nan)
+                grown[:row] = self.values
+                self.values = grown
+        self.values[row] = [np.nan if (value := health_info.get(field)) is None else value for field in HEALTH_FIELDS]
+
+    def breaches(self, table):
+        """(device name, field) for each value beyond its threshold, by device then field"""
+        if not self.names or not table.fields:
+            return []
+        values = self.values[:len(self.names), table.columns]
+        # NaN compares false both ways, so missing values never alert
+        breached = np.where(table.below, values < table.thresholds, values > table.thresholds)
+        rows, cols = np.nonzero(breached)
+        return [(self.names[row], table.fields[col]) for row, col in zip(rows.tolist(), cols.tolist())]
@@ -0,0 +1,102 @@
+"""
+Startup snapshot cache for the parsed health log.
+
+The per-device state built from the log is pickled together with the log path,
+inode, size and the byte offset it covers. On the next start the snapshot is
+reused if it still describes a prefix of the current log file, and only the tail
+after the saved offset has to be parsed.
+
+Each log file has a snapshot file of its own, named after a hash of its resolved
+path, so instances following different logs don't replace each other's snapshots.
+"""
+
+import os
+import pickle
+import hashlib
+import logging
+import tempfile
+
+from nvme_mon.paths import app_data_path
+
+log = logging.getLogger(__name__)
+
+SNAPSHOT_FILENAME = ".log_snapshot"
+# Bump when the layout of the pickled state changes, so stale snapshots are ignored
+SNAPSHOT_VERSION = 7
+# Number of bytes before the saved offset used to check that the log still starts the same way
+FINGERPRINT_BYTES = 4096
+
+
+def _fingerprint(log_path, offset):
+    with open(log_path, "rb") as f:
+        start = max(0, offset - FINGERPRINT_BYTES)
+        f.seek(start)
+        return hashlib.sha1(f.read(offset - start)).hexdigest()
+
+
+def snapshot_path(log_path):
+    """The snapshot file for a log file"""
+    digest = hashlib.sha1(os.path.realpath(log_path).encode()).hexdigest()[:16]
+    return app_data_path(f"{SNAPSHOT_FILENAME}-{digest}")
+
+
+def save_snapshot(log_path, inode, offset, state):
+    snapshot = {
+        "version": SNAPSHOT_VERSION,
+        "log_path": os.path.abspath(log_path),
+        "inode": inode,
+        "size": os.stat(log_path).st_size,
+        "offset": offset,
+        "fingerprint": _fingerprint(log_path, offset),
+        "state": state,
+    }
+    path = snapshot_path(log_path)
+    tmp_path = None
+    try:
+        # A temp file of its own, in case another instance is saving a snapshot of the same log
+        with tempfile.NamedTemporaryFile(dir=path.parent, prefix=path.name + ".", suffix=".tmp", delete=False) as f:
+            tmp_path = f.name
+            pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    except (OSError, pickle.PicklingError) as e:
+        log.warning(f"Unable to save log snapshot to {path}: {e}")
+        if tmp_path is not None:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+
+def load_snapshot(log_path):
+    """
+    Return (inode, offset, state) from the saved snapshot, or None if there is no
+    snapshot or it does not match the current log file.
+    """
+    path = snapshot_path(log_path)
+    try:
+        with open(path, "rb") as f:
+            snapshot = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        log.warning(f"Ignoring unreadable log snapshot {path}: {e}")
+        return None
+
+    if not isinstance(snapshot, dict) or snapshot.get("version") != SNAPSHOT_VERSION:
+        log.info("Ignoring log snapshot with a different version")
+        return None
+    if snapshot["log_path"] != os.path.abspath(log_path):
+        # The same file, saved under another path to it (a symlink)
+        return None
+    try:
+        st = os.stat(log_path)
+        if st.st_ino != snapshot["inode"] or st.st_size < snapshot["size"]:
+            log.info("Log file was rotated or truncated since the snapshot was saved")
+            return None
+        if _fingerprint(log_path, snapshot["offset"]) != snapshot["fingerprint"]:
+            log.info("Log file contents changed since the snapshot was saved")
+            return None
+    except OSError:
+        return None
+
+    return snapshot["inode"], snapshot["offset"], snapshot["state"]
@@ -0,0 +1,134 @@
+"""
+Running temperature and sample interval statistics, maintained as records are ingested.
+
+Nothing here grows with the length of the log: min, max, sum and the first/last dates
+are running values, the temperature median comes from the device's count histogram,
+and sample intervals are kept as a count per interval length. Intervals are stored
+modulo one day (the same value timedelta.seconds gives), so there are at most 86400
+distinct keys.
+"""
+
+from collections import Counter, deque
+
+SECONDS_PER_DAY = 86400
+
+
+def counts_median(counts):
+    """
+    Median of a multiset given as {value: count}, with the same result as
+    statistics.median on the expanded values. Returns None if it is empty.
+    """
+    items = sorted((k, v) for k, v in counts.items() if k is not None and v > 0)
+    total = sum(v for _, v in items)
+    if not total:
+        return None
+    lower_idx = (total - 1) // 2
+    upper_idx = total // 2
+    lower = upper = None
+    seen = 0
+    for value, count in items:
+        seen += count
+        if lower is None and seen > lower_idx:
+            lower = value
+        if seen > upper_idx:
+            upper = value
+            break
+    return lower if lower == upper else (lower + upper) / 2
+
+
+def histogram_median(histogram):
+    return counts_median({temp: entry["count"] for temp, entry in histogram.items()})
+
+
+class TempStats:
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+        self.first_ts = None
+        self.max_ts = None # Latest time the max temperature was seen
+        self.last_ts = None # Time of the most recently ingested sample
+        self.interval_counts = Counter()
+        self.recent_intervals = deque(maxlen=2)
+
+    def add(self, ts, temp):
+        if self.last_ts is not None:
+            interval = (ts - self.last_ts) % SECONDS_PER_DAY
+            self.interval_counts[interval] += 1
+            self.recent_intervals.append(interval)
+        self.last_ts = ts
+        if self.first_ts is None or ts < self.first_ts:
+            self.first_ts = ts
+
+        if temp is None:
+            return
+        temp = int(temp)
+        self.count += 1
+        self.total += temp
+        if self.min is None or temp < self.min:
+            self.min = temp
+        if self.max is None or temp > self.max:
+            self.max = temp
+            self.max_ts = ts
+        elif temp == self.max and ts > self.max_ts:
+            self.max_ts = ts
+
+    def merge(self, newer):
+        """Fold in the stats of a later run of samples from the same device."""
+        if self.last_ts is not None and newer.first_ts is not None:
+            interval = (newer.first_ts - self.last_ts) % SECONDS_PER_DAY
+            self.interval_counts[interval] += 1
+            self.recent_intervals.append(interval)
+        self.interval_counts.update(newer.interval_counts)
+        self.recent_intervals.extend(newer.recent_intervals)
+        if newer.last_ts is not None:
+            self.last_ts = newer.last_ts
+        if newer.first_ts is not None and (self.first_ts is None or newer.first_ts < self.first_ts):
+            self.first_ts = newer.first_ts
+
+        self.count += newer.count
+        self.total += newer.total
+        if newer.min is not None and (self.min is None or newer.min < self.min):
+            self.min = newer.min
+        if newer.max is not None:
+            if self.max is None or newer.max > self.max:
+                self.max = newer.max
+                self.max_ts = newer.max_ts
+            elif newer.max == self.max and newer.max_ts > self.max_ts:
+                self.max_ts = newer.max_ts
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "total": self.total,
+            "min": self.min,
+            "max": self.max,
+            "first_ts": self.first_ts,
+            "max_ts": self.max_ts,
+            "last_ts": self.last_ts,
+            "interval_counts": {str(k): v for k, v in self.interval_counts.items()},
+            "recent_intervals": list(self.recent_intervals),
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        stats = cls()
+        for key in ("count", "total", "min", "max", "first_ts", "max_ts", "last_ts"):
+            setattr(stats, key, d[key])
+        stats.interval_counts.update({int(k): v for k, v in d["interval_counts"].items()})
+        stats.recent_intervals.extend(d["recent_intervals"])
+        return stats
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    @property
+    def median_interval(self):
+        return counts_median(self.interval_counts) or 0
+
+    @property
+    def current_interval(self):
+        return sum(self.recent_intervals) / len(self.recent_intervals) if self.recent_intervals else 0
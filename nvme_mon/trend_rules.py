@@ -0,0 +1,227 @@
+"""
+Trend alert rules, evaluated incrementally as records are ingested.
+
+The fixed thresholds in alert_thresholds only look at the latest value. The rules listed under
+alert_thresholds.trends look at how a field behaves over time:
+
+    sustained   the field stays above (or below) a threshold for `samples` consecutive samples,
+                and/or for `duration`
+    rate        the field changes by more than `per_day` per day, measured over `window`
+                (a negative per_day alerts on a field falling faster than that)
+    ewma        the field is more than `deviation` away from its exponentially weighted moving
+                average, which gives each new sample the weight `alpha`
+
+Each device keeps one tracker per rule in device["trends"], keyed by the rule's settings. A
+tracker is updated in O(1) per record (amortized for rate rules, which keep only the points
+where the value changed within the window), so checking a rule never rescans the device's
+history. Trackers are saved with the rest of the device state in the startup snapshot. A rule
+that is added or changed in the config starts from the next record ingested.
+"""
+
+import json
+import logging
+from collections import deque
+from datetime import timedelta
+
+from pytimeparse import parse
+
+log = logging.getLogger(__name__)
+
+DAY = 86400
+
+
+def _seconds(spec, name):
+    seconds = parse(str(spec[name]))
+    if not seconds:
+        raise ValueError(f"{name} {spec[name]!r} is not a duration")
+    return seconds
+
+
+def _beyond(rule, value):
+    return value > rule["above"] if "above" in rule else value < rule["below"]
+
+
+class Tracker:
+    __slots__ = ("last_ts", "last_value")
+
+    def __init__(self):
+        self.last_ts = None
+        self.last_value = None
+
+    def update(self, rule, ts, value):
+        self.last_ts = ts
+        self.last_value = value
+
+
+class SustainedTracker(Tracker):
+    """The current run of consecutive samples beyond the threshold"""
+    __slots__ = ("samples", "start_ts")
+
+    def __init__(self):
+        super().__init__()
+        self.samples = 0
+        self.start_ts = None
+
+    def update(self, rule, ts, value):
+        if _beyond(rule, value):
+            if not self.samples:
+                self.start_ts = ts
+            self.samples += 1
+        else:
+            self.samples = 0
+            self.start_ts = None
+        super().update(rule, ts, value)
+
+    def check(self, rule):
+        if not self.samples:
+            return None
+        duration = self.last_ts - self.start_ts
+        if self.samples < rule.get("samples", 0) or duration < rule.get("duration", 0):
+            return None
+        direction, threshold = ("above", rule["above"]) if "above" in rule else ("below", rule["below"])
+        return (f"{rule['field']} = {self.last_value}, {direction} {threshold} for the last {self.samples} samples "
+                f"({timedelta(seconds=int(duration))})."), self.samples
+
+
+class RateTracker(Tracker):
+    """The points where the value changed within the window, and the last one before it"""
+    __slots__ = ("points",)
+
+    def __init__(self):
+        super().__init__()
+        self.points = deque()
+
+    def update(self, rule, ts, value):
+        points = self.points
+        if not points or value != points[-1][1]:
+            points.append((ts, value))
+        window_start = ts - rule["window"]
+        while len(points) > 1 and points[1][0] <= window_start:
+            points.popleft()
+        super().update(rule, ts, value)
+
+    def check(self, rule):
+        # Not until the samples cover a whole window
+        if not self.points or self.points[0][0] > self.last_ts - rule["window"]:
+            return None
+        change = self.last_value - self.points[0][1]
+        rate = change * DAY / rule["window"]
+        per_day = rule["per_day"]
+        if (per_day >= 0 and rate <= per_day) or (per_day < 0 and rate >= per_day):
+            return None
+        return (f"{rule['field']} = {self.last_value}, changed by {change} in the last {rule['window_text']} "
+                f"({rate:.2f} per day). Configured rate is {per_day} per day."), rate
+
+
+class EwmaTracker(Tracker):
+    """The moving average, and how far the last sample was from it"""
+    __slots__ = ("mean", "samples", "deviation")
+
+    def __init__(self):
+        super().__init__()
+        self.mean = None
+        self.samples = 0
+        self.deviation = 0
+
+    def update(self, rule, ts, value):
+        if self.mean is None:
+            self.mean = value
+        else:
+            self.deviation = value - self.mean
+            self.mean += rule["alpha"] * self.deviation
+        self.samples += 1
+        super().update(rule, ts, value)
+
+    def check(self, rule):
+        # The average doesn't mean much until it has seen about 1 / alpha samples
+        if self.samples * rule["alpha"] < 1 or abs(self.deviation) <= rule["deviation"]:
+            return None
+        average = self.last_value - self.deviation
+        direction = "above" if self.deviation > 0 else "below"
+        return (f"{rule['field']} = {self.last_value}, {abs(self.deviation):.1f} {direction} its moving average "
+                f"{average:.1f}. Configured deviation is {rule['deviation']}."), self.deviation
+
+
+TRACKERS = {
+    "sustained": SustainedTracker,
+    "rate": RateTracker,
+    "ewma": EwmaTracker,
+}
+
+
+def make_rule(spec):
+    """Validate one rule from the config, returning it with its durations in seconds."""
+    rule = dict(spec)
+    if rule["type"] not in TRACKERS:
+        raise ValueError(f"unknown type {rule['type']!r}, expected one of {', '.join(TRACKERS)}")
+    rule["field"] = str(rule["field"])
+    rule.setdefault("name", f"{rule['field']} {rule['type']}")
+    # Trackers are kept while the rule's settings are unchanged
+    rule["key"] = json.dumps(spec, sort_keys=True, default=str)
+    if rule["type"] == "sustained":
+        if ("above" in rule) == ("below" in rule):
+            raise ValueError("needs one of above or below")
+        if "samples" not in rule and "duration" not in rule:
+            raise ValueError("needs samples or duration")
+        if "duration" in rule:
+            rule["duration"] = _seconds(rule, "duration")
+    elif rule["type"] == "rate":
+        rule["window_text"] = str(rule["window"])
+        rule["window"] = _seconds(rule, "window")
+        rule["per_day"] = float(rule["per_day"])
+    else:
+        rule["alpha"] = float(rule["alpha"])
+        rule["deviation"] = float(rule["deviation"])
+        if not 0 < rule["alpha"] <= 1:
+            raise ValueError("alpha must be between 0 and 1")
+    return rule
+
+
+class TrendRules:
+
+    def __init__(self, config=None):
+        self.config = None
+        self.rules = []
+        self.set_config(config)
+
+    def set_config(self, config):
+        """Apply the trends list from alert_thresholds. Returns True if it changed."""
+        if config is self.config:
+            return False
+        self.config = config
+        self.rules = []
+        for i, spec in enumerate(config or []):
+            try:
+                self.rules.append(make_rule(spec))
+            except (KeyError, TypeError, ValueError) as e:
+                log.error(f"Ignoring trend rule {i + 1} ({spec}): {e}")
+        return True
+
+    def prune(self, trackers):
+        """Drop a device's trackers for rules that are no longer configured."""
+        keys = {rule["key"] for rule in self.rules}
+        for key in [key for key in trackers if key not in keys]:
+            del trackers[key]
+
+    def update(self, trackers, record):
+        """Fold a record into a device's trackers."""
+        ts = record["ts"]
+        for rule in self.rules:
+            value = record.get(rule["field"])
+            if value is None:
+                continue
+            tracker = trackers.get(rule["key"])
+            if tracker is None:
+                tracker = trackers[rule["key"]] = TRACKERS[rule["type"]]()
+            elif ts <= tracker.last_ts:
+                continue
+            tracker.update(rule, ts, value)
+
+    def breaches(self, trackers):
+        """(rule name, message, value) for each rule the device currently breaks"""
+        result = []
+        for rule in self.rules:
+            tracker = trackers.get(rule["key"])
+            if tracker is not None and (breach := tracker.check(rule)) is not None:
+                result.append((rule["name"], *breach))
+        return result
@@ -1,27 +1,56 @@
 #!/usr/bin/env python3
+import argparse
+import ctypes
+import fcntl
 import glob
+import heapq
 import json
 import logging
+import mmap
 import os
+import queue
 import re
+import socket
+import struct
 import subprocess
+import threading
 import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime
 from statistics import mean
 
 LOG_JSON = "/var/log/nvme_health.json"
 LOG_HUMAN = "/var/log/nvme_health_readable.log"
+LOG_BINARY = "/var/log/nvme_health.bin"
+# Unix socket new records are published on, for the client (see nvme_mon/live.py)
+SOCKET_PATH = "/run/nvme_monitor.sock"
 DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
 
+# Seconds to wait for a single nvme-cli command
+NVME_TIMEOUT_SEC = 10
+# Number of devices read concurrently. 1 reads them one after another.
+MAX_WORKERS = 8
+
+# Adaptive sampling. A device is sampled every MIN_INTERVAL_SEC while its temperature is rising
+# or within TEMP_MARGIN_C of the threshold, backing off to MAX_INTERVAL_SEC while it is steady.
+# A rise is TEMP_RISE_C or more above the reference temperature, which stays put through smaller
+# swings (sensors report whole degrees and wander by one), and follows falls of TEMP_RISE_C or more.
+MIN_INTERVAL_SEC = 30
+MAX_INTERVAL_SEC = 60 * 5
+# Cap on samples per second, across all devices
+MAX_SAMPLES_PER_SEC = 10
+# Same default as the mean_temperature alert threshold in the client's config.yaml
+TEMP_THRESHOLD_C = 70
+TEMP_MARGIN_C = 5
+TEMP_RISE_C = 2
 
 
 # -----------------------------
 # Logging Setup
 # -----------------------------
 def setup_logging():
-    os.makedirs("/var/log", exist_ok=True)
-
-    # Main namespace logger
+    # Main namespace logger, for the daemon's own messages. Health records are written by the
+    # record writers below, not through logging.
     root_logger = logging.getLogger("nvme_monitor")
     root_logger.setLevel(logging.INFO)
     root_logger.propagate = False
@@ -30,43 +59,18 @@ def setup_logging():
     if root_logger.hasHandlers():
         root_logger.handlers.clear()
 
-    # JSON handler
-    json_handler = logging.FileHandler(LOG_JSON)
-    json_handler.setLevel(logging.INFO)
-    json_handler.setFormatter(logging.Formatter("%(message)s"))
-
-    # Human readable handler
-    human_handler = logging.FileHandler(LOG_HUMAN)
-    human_handler.setLevel(logging.INFO)
-    human_handler.setFormatter(logging.Formatter(
-        "%(asctime)s [%(levelname)s] %(message)s"
-    ))
-
     # Console handler (systemd)
     console_handler = logging.StreamHandler()
     console_handler.setLevel(logging.INFO)
     console_handler.setFormatter(logging.Formatter(
         "%(asctime)s [%(levelname)s] %(message)s"
     ))
-
-    # Attach console to the main logger
     root_logger.addHandler(console_handler)
 
-    # Sub-loggers for JSON and human-readable
-    json_logger = logging.getLogger("nvme_monitor.json")
-    json_logger.setLevel(logging.INFO)
-    json_logger.propagate = False
-    json_logger.addHandler(json_handler)
-
-    human_logger = logging.getLogger("nvme_monitor.human")
-    human_logger.setLevel(logging.INFO)
-    human_logger.propagate = False
-    human_logger.addHandler(human_handler)
+    return root_logger
 
-    return json_logger, human_logger, root_logger
 
-
-json_logger, human_logger, root_logger = setup_logging()
+root_logger = setup_logging()
 
 
 # -----------------------------
@@ -108,10 +112,93 @@ def discover_nvme_devices():
     return sorted(namespaces.values())
 
 
+# inotify(7) constants
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+
+# Rescan for devices at least this often, in case change notifications are missed or unavailable
+RESCAN_INTERVAL_SEC = 60 * 60
+BY_ID_DIR = "/dev/disk/by-id"
+
+
+class DirectoryWatch:
+    """Reports whether entries were added to or removed from a directory, using inotify."""
+
+    def __init__(self, path):
+        self.fd = None
+        try:
+            libc = ctypes.CDLL(None, use_errno=True)
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd < 0:
+                raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+            mask = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO
+            if libc.inotify_add_watch(fd, os.fsencode(path), mask) < 0:
+                os.close(fd)
+                raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {path}")
+            self.fd = fd
+        except (OSError, AttributeError) as e:
+            root_logger.warning(f"Not watching {path} for device changes, rescanning every {RESCAN_INTERVAL_SEC}s: {e}")
+
+    def changed(self):
+        """Return True if anything changed since the last call. Never blocks."""
+        if self.fd is None:
+            return False
+        changed = False
+        while True:
+            try:
+                if not os.read(self.fd, 4096):
+                    break
+                changed = True
+            except BlockingIOError:
+                break
+        return changed
+
+
+class DeviceRegistry:
+    """
+    The set of NVMe devices and their identify-controller data, kept between cycles.
+    Devices are rediscovered only when the watched directory changes, or every
+    RESCAN_INTERVAL_SEC. Identify data is read once per device.
+    """
+
+    def __init__(self, discover=discover_nvme_devices, watch_dir=BY_ID_DIR):
+        self.discover = discover
+        self.watch = DirectoryWatch(watch_dir)
+        self.devices = []
+        self.identity = {}
+        self.last_scan = None
+
+    def refresh(self):
+        now = time.monotonic()
+        if self.last_scan is not None and not self.watch.changed() and now - self.last_scan < RESCAN_INTERVAL_SEC:
+            return self.devices
+        self.last_scan = now
+        devices = self.discover()
+        if devices != self.devices:
+            root_logger.info(f"Discovered devices: {devices}")
+        for dev in set(self.identity) - set(devices):
+            del self.identity[dev]
+        self.devices = devices
+        return devices
+
+    def get_identity(self, backend, dev, timeout=NVME_TIMEOUT_SEC):
+        """Identify-controller data for dev, read from the device the first time only."""
+        identity = self.identity.get(dev)
+        if identity is None:
+            id_ctrl = backend.read_id_ctrl(dev, timeout)
+            if id_ctrl:
+                identity = self.identity[dev] = {k: id_ctrl.get(k) for k in ("mn", "sn", "fr")}
+        return identity
+
+
 # -----------------------------
 # NVMe SMART/Log parsing
 # -----------------------------
-def run_nvme_json(args):
+def run_nvme_json(args, timeout=NVME_TIMEOUT_SEC):
     """
     Run an nvme CLI command and parse json output.
     args: list like ["id-ctrl", "/dev/..."]
@@ -123,6 +210,7 @@ def run_nvme_json(args):
             capture_output=True,
             text=True,
             check=True,
+            timeout=timeout,
         )
         return json.loads(result.stdout)
     except Exception as e:
@@ -130,14 +218,207 @@ def run_nvme_json(args):
         return None
 
 
-def read_smart(device_path):
+def read_smart(device_path, timeout=NVME_TIMEOUT_SEC):
     """Read SMART log for a device."""
-    return run_nvme_json(["smart-log", device_path])
+    return run_nvme_json(["smart-log", device_path], timeout)
 
 
-def read_id_ctrl(device_path):
+def read_id_ctrl(device_path, timeout=NVME_TIMEOUT_SEC):
     """Read NVMe Identify Controller log."""
-    return run_nvme_json(["id-ctrl", device_path])
+    return run_nvme_json(["id-ctrl", device_path], timeout)
+
+
+# -----------------------------
+# SMART Backends
+# -----------------------------
+class NvmeCliBackend:
+    """Reads SMART data by running nvme-cli and parsing its JSON output."""
+    name = "nvme-cli"
+
+    def read_smart(self, device_path, timeout=NVME_TIMEOUT_SEC):
+        return read_smart(device_path, timeout)
+
+    def read_id_ctrl(self, device_path, timeout=NVME_TIMEOUT_SEC):
+        return read_id_ctrl(device_path, timeout)
+
+
+# From <linux/nvme_ioctl.h>: NVME_IOCTL_ADMIN_CMD = _IOWR('N', 0x41, struct nvme_admin_cmd)
+NVME_IOCTL_ADMIN_CMD = 0xC0484E41
+# struct nvme_passthru_cmd: opcode, flags, rsvd1, nsid, cdw2, cdw3, metadata, addr,
+# metadata_len, data_len, cdw10-cdw15, timeout_ms, result
+NVME_PASSTHRU_CMD = struct.Struct("<BBHIIIQQII6III")
+NVME_ADMIN_GET_LOG_PAGE = 0x02
+NVME_ADMIN_IDENTIFY = 0x06
+NVME_LOG_SMART = 0x02
+NVME_IDENTIFY_CNS_CTRL = 0x01
+NVME_NSID_ALL = 0xFFFFFFFF
+SMART_LOG_LEN = 512
+ID_CTRL_LEN = 4096
+
+# SMART / Health Information log page (NVMe base spec, log identifier 02h): name, offset, size in bytes.
+# Names match the keys in nvme-cli's smart-log JSON output.
+SMART_LOG_FIELDS = [
+    ("critical_warning", 0, 1),
+    ("temperature", 1, 2),
+    ("avail_spare", 3, 1),
+    ("spare_thresh", 4, 1),
+    ("percent_used", 5, 1),
+    ("endurance_grp_critical_warning_summary", 6, 1),
+    ("data_units_read", 32, 16),
+    ("data_units_written", 48, 16),
+    ("host_read_commands", 64, 16),
+    ("host_write_commands", 80, 16),
+    ("controller_busy_time", 96, 16),
+    ("power_cycles", 112, 16),
+    ("power_on_hours", 128, 16),
+    ("unsafe_shutdowns", 144, 16),
+    ("media_errors", 160, 16),
+    ("num_err_log_entries", 176, 16),
+    ("warning_temp_time", 192, 4),
+    ("critical_comp_time", 196, 4),
+    ("thm_temp1_trans_count", 216, 4),
+    ("thm_temp2_trans_count", 220, 4),
+    ("thm_temp1_total_time", 224, 4),
+    ("thm_temp2_total_time", 228, 4),
+]
+SMART_TEMP_SENSORS_OFFSET = 200
+NUM_TEMP_SENSORS = 8
+
+# Identify Controller data structure: name, offset, size. Names match nvme-cli's id-ctrl JSON.
+ID_CTRL_FIELDS = [
+    ("vid", 0, 2),
+    ("ssvid", 2, 2),
+    ("sn", 4, 20),
+    ("mn", 24, 40),
+    ("fr", 64, 8),
+]
+ID_CTRL_STRING_FIELDS = {"sn", "mn", "fr"}
+
+
+def decode_smart_log(data):
+    """Decode a 512-byte SMART / Health log page into the dict shape nvme-cli's smart-log JSON has."""
+    smart = {name: int.from_bytes(data[offset:offset + size], "little") for name, offset, size in SMART_LOG_FIELDS}
+    # Like nvme-cli, only report the sensors the device implements (non-zero readings)
+    for i in range(NUM_TEMP_SENSORS):
+        offset = SMART_TEMP_SENSORS_OFFSET + 2 * i
+        temp = int.from_bytes(data[offset:offset + 2], "little")
+        if temp:
+            smart[f"temperature_sensor_{i + 1}"] = temp
+    return smart
+
+
+def encode_smart_log(smart):
+    """Inverse of decode_smart_log, used to build fake devices."""
+    data = bytearray(SMART_LOG_LEN)
+    for name, offset, size in SMART_LOG_FIELDS:
+        data[offset:offset + size] = int(smart.get(name) or 0).to_bytes(size, "little")
+    for i in range(NUM_TEMP_SENSORS):
+        offset = SMART_TEMP_SENSORS_OFFSET + 2 * i
+        data[offset:offset + 2] = int(smart.get(f"temperature_sensor_{i + 1}") or 0).to_bytes(2, "little")
+    return bytes(data)
+
+
+def decode_id_ctrl(data):
+    id_ctrl = {}
+    for name, offset, size in ID_CTRL_FIELDS:
+        value = data[offset:offset + size]
+        if name in ID_CTRL_STRING_FIELDS:
+            id_ctrl[name] = value.decode("ascii", errors="replace").strip(" \0")
+        else:
+            id_ctrl[name] = int.from_bytes(value, "little")
+    return id_ctrl
+
+
+def encode_id_ctrl(id_ctrl):
+    data = bytearray(ID_CTRL_LEN)
+    for name, offset, size in ID_CTRL_FIELDS:
+        if name in ID_CTRL_STRING_FIELDS:
+            data[offset:offset + size] = str(id_ctrl.get(name, "")).encode("ascii").ljust(size)[:size]
+        else:
+            data[offset:offset + size] = int(id_ctrl.get(name, 0)).to_bytes(size, "little")
+    return bytes(data)
+
+
+class IoctlBackend:
+    """
+    Reads SMART data by sending NVMe admin commands straight to the device with ioctl,
+    without forking nvme-cli. Needs CAP_SYS_ADMIN, like nvme-cli.
+    """
+    name = "ioctl"
+
+    def admin_cmd(self, device_path, opcode, nsid, cdw10, length, timeout):
+        buf = ctypes.create_string_buffer(length)
+        cmd = bytearray(NVME_PASSTHRU_CMD.pack(
+            opcode, 0, 0, nsid, 0, 0,
+            0, ctypes.addressof(buf), 0, length,
+            cdw10, 0, 0, 0, 0, 0,
+            timeout * 1000, 0))
+        fd = os.open(device_path, os.O_RDONLY)
+        try:
+            status = fcntl.ioctl(fd, NVME_IOCTL_ADMIN_CMD, cmd, True)
+        finally:
+            os.close(fd)
+        if status != 0:
+            raise OSError(f"NVMe admin command {opcode:#04x} failed with status {status:#x}")
+        return buf.raw
+
+    def read_smart(self, device_path, timeout=NVME_TIMEOUT_SEC):
+        # Get Log Page: log id in bits 0-7 of cdw10, number of dwords - 1 in bits 16-31
+        cdw10 = NVME_LOG_SMART | ((SMART_LOG_LEN // 4 - 1) << 16)
+        try:
+            data = self.admin_cmd(device_path, NVME_ADMIN_GET_LOG_PAGE, NVME_NSID_ALL, cdw10, SMART_LOG_LEN, timeout)
+        except OSError as e:
+            root_logger.error(f"Failed to read SMART log from {device_path}: {e}")
+            return None
+        return decode_smart_log(data)
+
+    def read_id_ctrl(self, device_path, timeout=NVME_TIMEOUT_SEC):
+        try:
+            data = self.admin_cmd(device_path, NVME_ADMIN_IDENTIFY, 0, NVME_IDENTIFY_CNS_CTRL, ID_CTRL_LEN, timeout)
+        except OSError as e:
+            root_logger.error(f"Failed to read id-ctrl from {device_path}: {e}")
+            return None
+        return decode_id_ctrl(data)
+
+
+class FakeDeviceBackend(IoctlBackend):
+    """
+    IoctlBackend that serves admin commands from files instead of hardware, for testing.
+    Device <dir>/<name> is backed by <dir>/<name>.smart (the raw 512-byte log page) and
+    <dir>/<name>.id-ctrl (the raw 4096-byte identify data). See write_fake_device.
+    """
+    name = "fake"
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def devices(self):
+        return sorted(path[:-len(".smart")] for path in glob.glob(os.path.join(self.directory, "*.smart")))
+
+    def admin_cmd(self, device_path, opcode, nsid, cdw10, length, timeout):
+        suffix = ".smart" if opcode == NVME_ADMIN_GET_LOG_PAGE else ".id-ctrl"
+        with open(device_path + suffix, "rb") as f:
+            data = f.read(length)
+        if len(data) != length:
+            raise OSError(f"Short read from {device_path + suffix}")
+        return data
+
+
+def write_fake_device(directory, name, smart, id_ctrl=None):
+    """Create or update a fake device for FakeDeviceBackend from nvme-cli style dicts."""
+    path = os.path.join(directory, name)
+    with open(path + ".smart", "wb") as f:
+        f.write(encode_smart_log(smart))
+    with open(path + ".id-ctrl", "wb") as f:
+        f.write(encode_id_ctrl(id_ctrl or {}))
+    return path
+
+
+BACKENDS = {
+    NvmeCliBackend.name: NvmeCliBackend,
+    IoctlBackend.name: IoctlBackend,
+}
+
 
 def health_score(smart) -> int:
         """
@@ -172,16 +453,20 @@ def health_score(smart) -> int:
 # -----------------------------
 # Health Data Extraction
 # -----------------------------
-def extract_health(device, id_ctrl, smart):
+def extract_health(device, id_ctrl, smart, timestamp=None):
     """
     Combine id-ctrl and smart-log JSON into a unified health record.
+    timestamp defaults to the current time.
     """
     if not smart:
         return None
 
     entry = {
-        "timestamp": datetime.strftime(datetime.now(), DATE_FORMAT),
+        "timestamp": datetime.strftime(timestamp or datetime.now(), DATE_FORMAT),
         "device": device,
+        "model": (id_ctrl.get("mn") or "").strip() if id_ctrl else None,
+        "serial": (id_ctrl.get("sn") or "").strip() if id_ctrl else None,
+        "firmware": (id_ctrl.get("fr") or "").strip() if id_ctrl else None,
         "temperature_k": smart.get("temperature"),
         "temperature_c": int(smart.get("temperature") - 273.15) if smart.get("temperature") else None,
         "sensor_1_c": smart.get("temp_sensor_1"),
@@ -215,40 +500,540 @@ def extract_health(device, id_ctrl, smart):
 # -----------------------------
 # Monitoring Loop
 # -----------------------------
-def monitor(interval=60*5):
-    root_logger.info("NVMe monitoring daemon starting...")
+def collect_device(backend, registry, dev, timestamp, timeout=NVME_TIMEOUT_SEC):
+    idc = registry.get_identity(backend, dev, timeout)
+    smart = backend.read_smart(dev, timeout)
+    return extract_health(dev, idc, smart, timestamp)
+
+
+def collect_cycle(backend, registry, devices, executor, in_flight, timeout=NVME_TIMEOUT_SEC, workers=MAX_WORKERS):
+    """
+    Read all devices concurrently, on executor's workers threads. All samples in a cycle share
+    one timestamp. Returns {device: health record} for the devices that were read successfully.
+    A read times out counting from when it starts, so reads queued behind a hung one aren't
+    failed for the time they spent waiting for a worker. If every worker is held by a read
+    that timed out, the reads still queued are cancelled, to be tried in the next cycle.
+    in_flight holds the reads that timed out and haven't finished yet (e.g. a hung
+    controller); a device with a read still in flight is skipped.
+    """
+    timestamp = datetime.now()
+    # Each device runs up to two nvme commands (identify on the first read), each with its own timeout
+    limit = 2 * timeout + 1
+    started = {} # device -> time.monotonic() when its read started
+
+    def read(dev):
+        started[dev] = time.monotonic()
+        return collect_device(backend, registry, dev, timestamp, timeout)
+
+    futures = {}
+    for dev in devices:
+        if dev in in_flight:
+            root_logger.error(f"Skipping {dev}, the previous read has not finished")
+            continue
+        futures[dev] = executor.submit(read, dev)
+
+    pending = {dev for dev in futures}
+    timed_out = []
+    while pending:
+        now = time.monotonic()
+        for dev in [dev for dev in pending if dev in started and now - started[dev] >= limit]:
+            pending.discard(dev)
+            timed_out.append(dev)
+        running = [started[dev] for dev in pending if dev in started]
+        # Reads that timed out hold their worker only until they finish
+        hung = sum(not future.done() for future in list(in_flight.values())) \
+            + sum(not futures[dev].done() for dev in timed_out)
+        if pending and not running and hung >= workers:
+            # Queued behind hung reads, with no worker left to run them
+            for dev in list(pending):
+                if futures[dev].cancel():
+                    root_logger.error(f"Skipping {dev}, all workers are held by reads that have not finished")
+                    pending.discard(dev)
+            continue
+        if not pending:
+            break
+        # Woken up at least every second, to start the timeout of the reads that have started since
+        deadline = min(running) + limit - now if running else 1
+        done, _ = wait([futures[dev] for dev in pending], timeout=min(deadline, 1), return_when=FIRST_COMPLETED)
+        pending -= {dev for dev in pending if futures[dev] in done}
+
+    results = {}
+    for dev, future in futures.items():
+        if dev in timed_out:
+            root_logger.error(f"Timed out reading {dev}")
+            in_flight[dev] = future
+            future.add_done_callback(lambda _, dev=dev: in_flight.pop(dev, None))
+            continue
+        if future.cancelled():
+            continue
+        try:
+            results[dev] = future.result()
+        except Exception as e:
+            root_logger.error(f"Failed to read {dev}: {e}")
+    return results
+
+
+# -----------------------------
+# Record Writers
+# -----------------------------
+class RecordWriter:
+    """
+    Appends a batch of health records to a file with a single O_APPEND write, so a batch is
+    never interleaved with other writes. Like WatchedFileHandler, the file is reopened if it
+    has been rotated or replaced (by logrotate or "nvme_mon compact"), or if it has been
+    truncated in place (by logrotate's copytruncate). Each write holds a
+    shared flock on the file, which "nvme_mon compact" takes exclusively while it copies the
+    last records and replaces the log, so no write goes to the old file after that copy.
+    fsync_interval: None never fsyncs, 0 fsyncs after every batch, N at most every N seconds.
+    Subclasses implement encode(record) -> bytes.
+    """
+
+    def __init__(self, path, fsync_interval=None):
+        self.path = path
+        self.fsync_interval = fsync_interval
+        self.fd = None
+        self.inode = None
+        self.size = 0 # of the file after our last write
+        self.last_fsync = time.monotonic()
+
+    def _open(self):
+        if self.fd is not None:
+            os.close(self.fd)
+        self.fd = os.open(self.path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+        st = os.fstat(self.fd)
+        self.inode = st.st_ino
+        self.size = 0
+        return st
+
+    def write(self, records):
+        if not records:
+            return
+        if self.fd is None:
+            self._open()
+        while True:
+            fcntl.flock(self.fd, fcntl.LOCK_SH)
+            # Checked holding the lock, as the file may be replaced while waiting for it
+            try:
+                inode = os.stat(self.path).st_ino
+            except FileNotFoundError:
+                inode = None
+            # A copytruncate rotation keeps the inode, but the file shrinks
+            if inode == self.inode and os.fstat(self.fd).st_size >= self.size:
+                break
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+            self._open()
+        try:
+            # Encoded only now, as (re)opening the file resets the binary log's device ids
+            data = memoryview(b"".join(self.encode(record) for record in records))
+            while data:
+                data = data[os.write(self.fd, data):]
+            self.size = os.fstat(self.fd).st_size
+        except BaseException:
+            self.inode = None # Reopen, rereading what the file holds, before the next write
+            raise
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+        if self.fsync_interval is not None and time.monotonic() - self.last_fsync >= self.fsync_interval:
+            os.fsync(self.fd)
+            self.last_fsync = time.monotonic()
+
+
+class JsonLogWriter(RecordWriter):
+    """One json.dumps() line per record, the format read by the client."""
+
+    def _open(self):
+        st = super()._open()
+        if st.st_size and os.pread(self.fd, 1, st.st_size - 1) != b"\n":
+            # The last write was cut short (e.g. a crash). End the partial line, which the
+            # client skips, so the next record starts on a line of its own.
+            root_logger.warning(f"Terminating a partially written line at the end of {self.path}")
+            os.write(self.fd, b"\n")
+        return st
+
+    def encode(self, health):
+        return (json.dumps(health) + "\n").encode()
+
+
+class HumanLogWriter(RecordWriter):
+    """Text records with a subset of the fields"""
+
+    def encode(self, health):
+        temp = health["temperature_c"]
+        return (
+            f"{health['timestamp']} [INFO] {health['device']}: "
+            f"{f'{temp:.1f}°C' if temp is not None else 'unknown temperature'}, "
+            f"{health['percentage_used']}% used, "
+            f"{health['media_errors']} media errors "
+            f"health score: {health['health_score']}\n"
+        ).encode()
+
+
+class BackgroundWriter:
+    """Runs a RecordWriter in a thread, so formatting and writing its records stays out of the collection loop."""
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.queue = queue.SimpleQueue()
+        threading.Thread(target=self._run, name=f"writer-{os.path.basename(writer.path)}", daemon=True).start()
+
+    @property
+    def path(self):
+        return self.writer.path
+
+    def write(self, records):
+        self.queue.put(records)
+
+    def _run(self):
+        while True:
+            records = self.queue.get()
+            try:
+                self.writer.write(records)
+            except Exception as e:
+                root_logger.error(f"Failed to write {self.writer.path}: {e}")
+
+
+class SocketBroadcaster:
+    """
+    Publishes each batch of records to the clients connected to a Unix stream socket, as frames
+    of a 4-byte big-endian length followed by the record's JSON. Sends never block: a client
+    that can't take a whole batch is disconnected (it reconnects and catches up from the log file)
+    rather than holding up collection.
+    """
+    FRAME_HEADER = struct.Struct(">I")
+
+    def __init__(self, path=SOCKET_PATH):
+        self.path = path
+        self.clients = []
+        try:
+            os.unlink(path) # Left behind by a previous run
+        except FileNotFoundError:
+            pass
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(path)
+        # Clients run as an unprivileged user. The records are the same ones in the world-readable log.
+        os.chmod(path, 0o666)
+        self.sock.listen()
+        self.sock.setblocking(False)
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except BlockingIOError:
+                return
+            conn.setblocking(False)
+            self.clients.append(conn)
+
+    def write(self, records):
+        self._accept()
+        if not self.clients or not records:
+            return
+        frames = []
+        for health in records:
+            payload = json.dumps(health).encode()
+            frames.append(self.FRAME_HEADER.pack(len(payload)) + payload)
+        data = b"".join(frames)
+        for conn in list(self.clients):
+            try:
+                if conn.send(data) < len(data):
+                    raise BlockingIOError("client is not keeping up")
+            except OSError as e:
+                root_logger.info(f"Disconnecting a live client of {self.path}: {e}")
+                conn.close()
+                self.clients.remove(conn)
+
+
+# -----------------------------
+# Binary Log
+# -----------------------------
+# Fixed-width record format read by the client. See nvme_mon/binlog.py, and keep the two in sync.
+BIN_MAGIC = b"NVMEHLTH"
+BIN_FORMAT_VERSION = 1
+BIN_RECORD_SIZE = 32
+BIN_HEADER = struct.Struct("<8sHH20x")
+BIN_SAMPLE = struct.Struct("<BxHIIIIIHBxh2x")
+BIN_DEVICE = struct.Struct("<BBH28s")
+BIN_DEVICE_NAME_INLINE = 28
+BIN_REC_SAMPLE = 0
+BIN_REC_DEVICE = 1
+BIN_NULL_U32 = 0xFFFFFFFF
+EPOCH = datetime(1970, 1, 1)
+
+
+def _bin_u32(value):
+    return BIN_NULL_U32 if value is None else min(int(value), BIN_NULL_U32 - 1)
+
+
+class BinaryLogWriter(RecordWriter):
+    """Writes the binary log. The device ids already defined in the file are read back when it is opened."""
+
+    def __init__(self, path=LOG_BINARY, fsync_interval=None):
+        super().__init__(path, fsync_interval)
+        self.devices = {} # name -> id
+
+    def _open(self):
+        st = super()._open()
+        self.devices = {}
+        if st.st_size == 0:
+            os.write(self.fd, BIN_HEADER.pack(BIN_MAGIC, BIN_FORMAT_VERSION, BIN_RECORD_SIZE))
+            return st
+        partial = (st.st_size - BIN_HEADER.size) % BIN_RECORD_SIZE
+        if partial:
+            root_logger.warning(f"Dropping a partially written record at the end of {self.path}")
+            os.ftruncate(self.fd, st.st_size - partial)
+        with mmap.mmap(self.fd, st.st_size - partial, access=mmap.ACCESS_READ) as buf:
+            if buf[:len(BIN_MAGIC)] != BIN_MAGIC:
+                raise ValueError(f"{self.path} is not a binary health log")
+            types = buf[BIN_HEADER.size::BIN_RECORD_SIZE]
+            i = types.find(BIN_REC_DEVICE)
+            while i >= 0:
+                offset = BIN_HEADER.size + i * BIN_RECORD_SIZE
+                _, length, device_id, inline = BIN_DEVICE.unpack_from(buf, offset)
+                rest = max(0, length - BIN_DEVICE_NAME_INLINE)
+                name = inline + buf[offset + BIN_RECORD_SIZE:offset + BIN_RECORD_SIZE + rest]
+                self.devices[name[:length].decode()] = device_id
+                i = types.find(BIN_REC_DEVICE, i + 1 + -(-rest // BIN_RECORD_SIZE))
+        return st
+
+    def encode(self, health):
+        data = b""
+        device_id = self.devices.get(health["device"])
+        if device_id is None:
+            device_id = self.devices[health["device"]] = len(self.devices)
+            name = health["device"].encode()
+            rest = name[BIN_DEVICE_NAME_INLINE:]
+            data = BIN_DEVICE.pack(BIN_REC_DEVICE, len(name), device_id, name[:BIN_DEVICE_NAME_INLINE]) \
+                + rest + bytes(-len(rest) % BIN_RECORD_SIZE)
+        ts = int((datetime.strptime(health["timestamp"], DATE_FORMAT) - EPOCH).total_seconds())
+        pct, score, temp = health["percentage_used"], health["health_score"], health["mean_temperature"]
+        return data + BIN_SAMPLE.pack(
+            BIN_REC_SAMPLE, device_id, ts,
+            _bin_u32(health["power_on_hours"]), _bin_u32(health["unsafe_shutdowns"]),
+            _bin_u32(health["media_errors"]), _bin_u32(health["num_err_log_entries"]),
+            0xFFFF if pct is None else min(pct, 0xFFFE),
+            0xFF if score is None else score,
+            -0x8000 if temp is None else temp,
+        )
+
+
+# -----------------------------
+# Sampling Schedule
+# -----------------------------
+class SampleScheduler:
+    """
+    Per-device sampling deadlines, kept in a heap. After each sample the device's interval drops
+    to min_interval if its temperature rose by rise or more or is within margin of the threshold,
+    and otherwise doubles, up to max_interval. Rises are measured from a reference temperature
+    that only moves on a rise or a fall of at least rise, so sensor noise doesn't count. Samples across all devices are limited to max_rate per second
+    (a token bucket), so a burst of due devices is spread out rather than read all at once.
+    Times are time.monotonic() values.
+    """
+
+    def __init__(self, min_interval=MIN_INTERVAL_SEC, max_interval=MAX_INTERVAL_SEC, max_rate=MAX_SAMPLES_PER_SEC,
+                 threshold=TEMP_THRESHOLD_C, margin=TEMP_MARGIN_C, rise=TEMP_RISE_C):
+        self.min_interval = min(min_interval, max_interval)
+        self.max_interval = max_interval
+        self.max_rate = max_rate
+        self.threshold = threshold
+        self.margin = margin
+        self.rise = rise
+        self.heap = [] # (deadline, device)
+        self.deadlines = {} # device -> deadline, None while a sample is being read. Heap entries that don't match are stale.
+        self.intervals = {}
+        self.ref_temps = {}
+        self.burst = max(1, max_rate)
+        self.tokens = self.burst
+        self.token_time = None
+
+    def _schedule(self, dev, deadline):
+        self.deadlines[dev] = deadline
+        heapq.heappush(self.heap, (deadline, dev))
+
+    def sync(self, devices, now):
+        """Start sampling new devices right away, and stop sampling devices that are gone."""
+        for dev in devices:
+            if dev not in self.deadlines:
+                self.intervals[dev] = self.max_interval
+                self._schedule(dev, now)
+        for dev in set(self.deadlines) - set(devices):
+            del self.deadlines[dev]
+            self.intervals.pop(dev, None)
+            self.ref_temps.pop(dev, None)
+
+    def due(self, now):
+        """Return the devices whose deadline has passed, as many as the rate limit allows."""
+        if self.token_time is not None:
+            self.tokens = min(self.burst, self.tokens + (now - self.token_time) * self.max_rate)
+        self.token_time = now
+        due = []
+        while self.heap and self.heap[0][0] <= now and self.tokens >= 1:
+            deadline, dev = heapq.heappop(self.heap)
+            if self.deadlines.get(dev) != deadline:
+                continue
+            self.deadlines[dev] = None
+            self.tokens -= 1
+            due.append(dev)
+        return due
+
+    def record(self, dev, temp, now):
+        """Schedule the next sample of dev, read at now. temp is None if the read failed."""
+        if dev not in self.deadlines:
+            return # Removed while it was being read
+        interval = self.intervals[dev]
+        if temp is not None:
+            ref_temp = self.ref_temps.get(dev)
+            rising = ref_temp is not None and temp - ref_temp >= self.rise
+            if ref_temp is None or rising or ref_temp - temp >= self.rise:
+                self.ref_temps[dev] = temp
+            if rising or temp >= self.threshold - self.margin:
+                interval = self.min_interval
+            else:
+                interval = min(2 * interval, self.max_interval)
+        self.intervals[dev] = interval
+        self._schedule(dev, now + interval)
+
+    def next_wakeup(self, now):
+        """Seconds until the next device is due and the rate limit allows it, or None if there are no devices."""
+        while self.heap and self.deadlines.get(self.heap[0][1]) != self.heap[0][0]:
+            heapq.heappop(self.heap)
+        if not self.heap:
+            return None
+        wait = self.heap[0][0] - now
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.max_rate)
+        return max(0, wait)
+
+
+def make_writers(log_format="json", binary_log=LOG_BINARY, human_log=LOG_HUMAN, fsync_interval=None,
+                 socket_path=SOCKET_PATH):
+    """
+    log_format is "json" (LOG_JSON), "binary" (binary_log) or "both". The human readable log
+    is written in the background, or not at all if human_log is None. Records are also
+    published on socket_path, unless it is None.
+    """
+    writers = []
+    if log_format in ("json", "both"):
+        writers.append(JsonLogWriter(LOG_JSON, fsync_interval))
+    if log_format in ("binary", "both"):
+        writers.append(BinaryLogWriter(binary_log, fsync_interval))
+    if human_log is not None:
+        writers.append(BackgroundWriter(HumanLogWriter(human_log)))
+    if socket_path is not None:
+        try:
+            writers.append(SocketBroadcaster(socket_path))
+        except OSError as e:
+            root_logger.warning(f"Not publishing records on {socket_path}: {e}")
+    return writers
+
+
+def write_batch(writers, records):
+    for writer in writers:
+        try:
+            writer.write(records)
+        except Exception as e:
+            root_logger.error(f"Failed to write {writer.path}: {e}")
+
+
+def monitor(interval=MAX_INTERVAL_SEC, workers=MAX_WORKERS, timeout=NVME_TIMEOUT_SEC, backend=None,
+            min_interval=MIN_INTERVAL_SEC, max_rate=MAX_SAMPLES_PER_SEC, threshold=TEMP_THRESHOLD_C, writers=None):
+    """writers: the RecordWriters each batch of samples is written to (default: see make_writers)"""
+    writers = make_writers() if writers is None else writers
+    backend = backend or NvmeCliBackend()
+    root_logger.info(f"NVMe monitoring daemon starting, using the {backend.name} backend, sampling every "
+                     f"{min(min_interval, interval)}-{interval}s (threshold {threshold}°C)...")
+    if isinstance(backend, FakeDeviceBackend):
+        registry = DeviceRegistry(backend.devices, backend.directory)
+    else:
+        registry = DeviceRegistry()
+    scheduler = SampleScheduler(min_interval, interval, max_rate, threshold)
+
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="nvme") if workers > 1 else None
+    in_flight = {}
 
     while True:
-        devices = discover_nvme_devices()
+        start = time.monotonic()
+        devices = registry.refresh()
+        scheduler.sync(devices, start)
 
         if not devices:
             root_logger.warning("No NVMe devices found.")
-        else:
-            root_logger.info(f"Discovered devices: {devices}")
 
-        for dev in devices:
-            idc = read_id_ctrl(dev)
-            smart = read_smart(dev)
+        due = scheduler.due(start)
+        if due:
+            if executor is not None:
+                results = collect_cycle(backend, registry, due, executor, in_flight, timeout, workers)
+            else:
+                timestamp = datetime.now()
+                results = {dev: collect_device(backend, registry, dev, timestamp, timeout) for dev in due}
 
-            health = extract_health(dev, idc, smart)
-            if not health:
-                root_logger.error(f"Failed to extract health for {dev}")
-                continue
+            batch = []
+            for dev in due:
+                health = results.get(dev)
+                if not health:
+                    root_logger.error(f"Failed to extract health for {dev}")
+                    scheduler.record(dev, None, start)
+                    continue
+                batch.append(health)
+                scheduler.record(dev, health["mean_temperature"], start)
+            write_batch(writers, batch)
+
+            duration = time.monotonic() - start
+            root_logger.info(f"Collected {sum(1 for h in results.values() if h)}/{len(due)} devices in {duration:.2f}s")
 
-            # Write JSON
-            json_logger.info(json.dumps(health))
+        wait = scheduler.next_wakeup(time.monotonic())
+        time.sleep(interval if wait is None else wait)
 
-            # Write human log
-            human_logger.info(
-                f"{dev}: {health['temperature_c']:.1f}°C, "
-                f"{health['percentage_used']}% used, "
-                f"{health['media_errors']} media errors "
-                f"health score: {health['health_score']}"
-            )
 
-        time.sleep(interval)
+def read_temp_threshold(config_file):
+    """The mean_temperature alert threshold from the client's config.yaml, or None."""
+    try:
+        import yaml
+    except ImportError:
+        root_logger.warning(f"PyYAML is not installed, ignoring {config_file}")
+        return None
+    with open(config_file, "r") as f:
+        config = yaml.safe_load(f) or {}
+    return (config.get("alert_thresholds") or {}).get("mean_temperature")
 
 
-if __name__ == "__main__":
-    monitor()
+def parse_args():
+    parser = argparse.ArgumentParser(description="Collect NVMe SMART data and append it to " + LOG_JSON)
+    parser.add_argument("--interval", type=int, default=MAX_INTERVAL_SEC,
+                        help="seconds between samples of a device whose temperature is steady")
+    parser.add_argument("--min-interval", type=int, default=MIN_INTERVAL_SEC,
+                        help="seconds between samples of a device whose temperature is rising or near the threshold "
+                             "(set it to --interval to sample at a fixed rate)")
+    parser.add_argument("--max-rate", type=float, default=MAX_SAMPLES_PER_SEC,
+                        help="maximum samples per second, across all devices")
+    parser.add_argument("--temp-threshold", type=int,
+                        help=f"mean temperature alert threshold in Celsius (default: from --config, or {TEMP_THRESHOLD_C})")
+    parser.add_argument("--config", help="read the temperature threshold from the client's config.yaml (needs PyYAML)")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS,
+                        help="number of devices read concurrently (1 = sequential)")
+    parser.add_argument("--timeout", type=int, default=NVME_TIMEOUT_SEC, help="timeout for each nvme command, in seconds")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default=NvmeCliBackend.name,
+                        help="read SMART data with nvme-cli, or directly with NVMe admin ioctls")
+    parser.add_argument("--format", choices=["json", "binary", "both"], default="json",
+                        help=f"write {LOG_JSON}, the compact binary log, or both")
+    parser.add_argument("--binary-log", default=LOG_BINARY, help="path of the binary log")
+    parser.add_argument("--human-log", default=LOG_HUMAN, help="path of the human readable log")
+    parser.add_argument("--no-human-log", action="store_true", help="don't write the human readable log")
+    parser.add_argument("--fsync-interval", type=float,
+                        help="fsync the logs at most every this many seconds (0 = after every batch, default: never)")
+    parser.add_argument("--socket", default=SOCKET_PATH, help="Unix socket new records are published on")
+    parser.add_argument("--no-socket", action="store_true", help="don't publish records on a socket")
+    parser.add_argument("--fake-dir", help="read fake devices from this directory instead of hardware (for testing)")
+    return parser.parse_args()
 
+
+if __name__ == "__main__":
+    args = parse_args()
+    backend = FakeDeviceBackend(args.fake_dir) if args.fake_dir else BACKENDS[args.backend]()
+    threshold = args.temp_threshold
+    if threshold is None and args.config:
+        threshold = read_temp_threshold(args.config)
+    monitor(interval=args.interval, workers=args.workers, timeout=args.timeout, backend=backend,
+            min_interval=args.min_interval, max_rate=args.max_rate,
+            threshold=TEMP_THRESHOLD_C if threshold is None else threshold,
+            writers=make_writers(args.format, args.binary_log, None if args.no_human_log else args.human_log,
+                                 args.fsync_interval, None if args.no_socket else args.socket))
@@ -0,0 +1,58 @@
+import json
+from datetime import datetime
+
+from nvme_monitor import BinaryLogWriter, extract_health
+from nvme_mon import binlog
+from nvme_mon.binlog import BinLogDecoder, BinLogEncoder, BinLogFollower
+from nvme_mon.record_decoder import decode_record
+
+LONG_NAME = "/dev/disk/by-id/nvme-Samsung_SSD_990_PRO_2TB_S7DNNJ0X123456"
+
+
+def records():
+    id_ctrl = {"mn": "Fake SSD", "sn": "S0000001", "fr": "1.0"}
+    smart = {"temperature": 318, "percent_used": 3, "power_on_hours": 1000, "media_errors": 2,
+             "num_err_log_entries": 7, "unsafe_shutdowns": 1}
+    yield extract_health("short", id_ctrl, smart, datetime(2025, 1, 1, 12, 0))
+    yield extract_health(LONG_NAME, id_ctrl, smart, datetime(2025, 1, 1, 12, 5))
+    # No temperature or wear readings: stored as null values
+    yield extract_health(LONG_NAME, None, {"power_on_hours": 1001}, datetime(2025, 1, 1, 12, 10))
+    yield extract_health("short", id_ctrl, dict(smart, temperature=340), datetime(2025, 1, 1, 12, 15))
+
+
+def decoded(health):
+    """The record as the client decodes it from the JSON log"""
+    return decode_record(json.dumps(health).encode())
+
+
+def expected(health):
+    """The record as decoded from the binary log, which doesn't keep the timestamp string"""
+    return {k: v for k, v in decoded(health).items() if k != "timestamp"}
+
+
+def test_collector_records_round_trip(tmp_path):
+    path = str(tmp_path / "log.bin")
+    BinaryLogWriter(path).write(list(records()))
+    with open(path, "rb") as f:
+        assert list(BinLogDecoder().decode_all(f.read(), path)) == [expected(h) for h in records()]
+
+
+def test_collector_and_client_encoders_agree(tmp_path):
+    path = str(tmp_path / "log.bin")
+    BinaryLogWriter(path).write(list(records()))
+    encoder = BinLogEncoder()
+    data = binlog.encode_header() + b"".join(encoder.encode(decoded(h)) for h in records())
+    with open(path, "rb") as f:
+        assert f.read() == data
+
+
+def test_follower_reads_appended_records(tmp_path):
+    path = str(tmp_path / "log.bin")
+    writer = BinaryLogWriter(path)
+    all_records = list(records())
+    writer.write(all_records[:2])
+    follower = BinLogFollower(path)
+    assert [r["device"] for r in follower.read_new_records()] == ["short", LONG_NAME]
+    writer.write(all_records[2:])
+    assert [r["mean_temperature"] for r in follower.read_new_records()] == [None, 66]
+    assert list(follower.read_new_records()) == []
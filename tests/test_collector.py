@@ -0,0 +1,107 @@
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import pytest
+
+from nvme_monitor import DeviceRegistry, FakeDeviceBackend, collect_cycle, encode_smart_log, write_fake_device
+
+SMART = {"temperature": 318, "percent_used": 3, "power_on_hours": 1000}
+ID_CTRL = {"mn": "Fake SSD", "sn": "S0000001", "fr": "1.0"}
+
+
+@pytest.fixture
+def backend(tmp_path):
+    for name in ("nvme-a", "nvme-b"):
+        write_fake_device(str(tmp_path), name, SMART, ID_CTRL)
+    return FakeDeviceBackend(str(tmp_path))
+
+
+def registry_for(backend):
+    return DeviceRegistry(backend.devices, backend.directory)
+
+
+def test_finished_reads_from_earlier_cycles_free_their_worker(backend):
+    finished = Future()
+    finished.set_result(None)
+    # A read that timed out in an earlier cycle, and has finished since
+    in_flight = {"old": finished}
+    devices = backend.devices()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        # Keep the reads queued for a moment, so the cycle starts with none running
+        busy = threading.Event()
+        executor.submit(busy.wait)
+        threading.Timer(0.2, busy.set).start()
+        results = collect_cycle(backend, registry_for(backend), devices, executor, in_flight, timeout=1, workers=1)
+    assert sorted(results) == devices
+    assert results[devices[0]]["temperature_c"] == 44
+
+
+@pytest.fixture
+def hung_device(backend):
+    """A fake device whose SMART log page is a FIFO, so reading it blocks until release() is called"""
+    path = write_fake_device(backend.directory, "nvme-hung", SMART, ID_CTRL)
+    os.remove(path + ".smart")
+    os.mkfifo(path + ".smart")
+    released = False
+
+    def release():
+        nonlocal released
+        if not released:
+            released = True
+            with open(path + ".smart", "wb") as f:
+                f.write(encode_smart_log(SMART))
+            # From now on a working device
+            os.remove(path + ".smart")
+            write_fake_device(backend.directory, "nvme-hung", SMART, ID_CTRL)
+
+    yield path, release
+    if not released:
+        # Unblock the reader (the open blocks until there is a writer), so the worker thread ends
+        threading.Thread(target=release, daemon=True).start()
+
+
+def test_hung_device_times_out_without_failing_the_others(backend, hung_device):
+    hung, release = hung_device
+    devices = backend.devices()
+    registry = registry_for(backend)
+    in_flight = {}
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        results = collect_cycle(backend, registry, devices, executor, in_flight, timeout=0.1, workers=2)
+        assert sorted(results) == sorted(dev for dev in devices if dev != hung)
+        assert list(in_flight) == [hung]
+
+        # Skipped while its read is still in flight
+        results = collect_cycle(backend, registry, devices, executor, in_flight, timeout=0.1, workers=2)
+        assert hung not in results and len(results) == 2
+
+        future = in_flight[hung]
+        release()
+        future.result(timeout=5)
+        # Dropped from in_flight by a done callback, which runs just after the result is set
+        deadline = time.monotonic() + 5
+        while in_flight and time.monotonic() < deadline:
+            time.sleep(0.01)
+        results = collect_cycle(backend, registry, devices, executor, in_flight, timeout=1, workers=2)
+        assert sorted(results) == devices
+
+
+def test_reads_queued_behind_hung_workers_are_cancelled(backend, hung_device):
+    hung, release = hung_device
+    devices = backend.devices()
+    in_flight = {}
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        results = collect_cycle(backend, registry_for(backend), [hung] + [dev for dev in devices if dev != hung],
+                                executor, in_flight, timeout=0.1, workers=1)
+        assert results == {}
+        assert list(in_flight) == [hung]
+        release()
+
+
+def test_fake_device_round_trip(backend):
+    dev = backend.devices()[0]
+    smart = backend.read_smart(dev)
+    assert smart["temperature"] == SMART["temperature"]
+    assert smart["percent_used"] == SMART["percent_used"]
+    assert backend.read_id_ctrl(dev)["sn"] == ID_CTRL["sn"]
@@ -0,0 +1,115 @@
+import socketserver
+import threading
+
+import pytest
+
+from nvme_mon.email_sender import EmailSender
+
+
+class SinkHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP to accept messages. The server's flags make it misbehave."""
+
+    def reply(self, line):
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        server = self.server
+        server.connections += 1
+        self.reply("220 sink ready")
+        while line := self.rfile.readline():
+            command = line.decode().strip().split(" ")[0].upper()
+            if command in ("EHLO", "HELO"):
+                self.reply("250 sink")
+            elif command == "NOOP":
+                if server.fail_noop:
+                    server.fail_noop = False
+                    self.reply("421 idle for too long, closing")
+                    return
+                self.reply("250 OK")
+            elif command == "MAIL":
+                if server.drop_on_mail:
+                    # Gone between the NOOP and the send
+                    server.drop_on_mail = False
+                    return
+                self.reply("250 OK")
+            elif command in ("RCPT", "RSET"):
+                self.reply("250 OK")
+            elif command == "DATA":
+                self.reply("354 go ahead")
+                message = []
+                while (data := self.rfile.readline()) not in (b".\r\n", b""):
+                    message.append(data.decode())
+                server.messages.append("".join(message))
+                self.reply("250 queued")
+            elif command == "QUIT":
+                self.reply("221 bye")
+                return
+            else:
+                self.reply("502 not implemented")
+
+
+class SmtpSink(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), SinkHandler)
+        self.connections = 0
+        self.messages = []
+        self.fail_noop = False
+        self.drop_on_mail = False
+
+
+@pytest.fixture
+def sink(monkeypatch):
+    server = SmtpSink()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setenv("SMTP_SERVER", "127.0.0.1")
+    monkeypatch.setenv("SMTP_PORT", str(server.server_address[1]))
+    monkeypatch.setenv("EMAIL_ADDRESS", "nvme_mon@example.com")
+    monkeypatch.setenv("RECIPIENT", "admin@example.com")
+    monkeypatch.setenv("SMTP_STARTTLS", "false")
+    monkeypatch.setenv("SMTP_LOGIN", "false")
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def sender():
+    sender = EmailSender(rate_limit=1000)
+    yield sender
+    sender.close()
+
+
+def test_connection_is_kept_between_emails(sink, sender):
+    for i in range(3):
+        sender.send_email(subject=f"Alert {i}", body="body", timeout=5)
+    assert len(sink.messages) == 3
+    assert "Subject: Alert 2" in sink.messages[2]
+    assert sink.connections == 1
+
+
+def test_reconnects_after_a_failed_noop(sink, sender):
+    sender.send_email(subject="First", body="body", timeout=5)
+    sink.fail_noop = True
+    sender.send_email(subject="Second", body="body", timeout=5)
+    assert len(sink.messages) == 2
+    assert sink.connections == 2
+
+
+def test_retries_once_when_dropped_after_the_noop(sink, sender):
+    sender.send_email(subject="First", body="body", timeout=5)
+    sink.drop_on_mail = True
+    sender.send_email(subject="Second", body="body", timeout=5)
+    assert len(sink.messages) == 2
+    assert "Subject: Second" in sink.messages[1]
+    assert sink.connections == 2
+
+
+def test_reconnects_when_the_settings_change(sink, sender, monkeypatch):
+    sender.send_email(subject="First", body="body", timeout=5)
+    monkeypatch.setenv("EMAIL_ADDRESS", "alerts@example.com")
+    sender.send_email(subject="Second", body="body", timeout=5)
+    assert len(sink.messages) == 2
+    assert sink.connections == 2
@@ -0,0 +1,97 @@
+import os
+import json
+from datetime import datetime
+
+import pytest
+
+from nvme_monitor import BinaryLogWriter, JsonLogWriter, extract_health
+from nvme_mon.binlog import BinLogDecoder
+
+ID_CTRL = {"mn": "Fake SSD", "sn": "S0000001", "fr": "1.0"}
+
+
+def health(device, temp_c, minute=0):
+    # extract_health truncates kelvin - 273.15
+    smart = {"temperature": temp_c + 274, "percent_used": 3, "power_on_hours": 1000, "media_errors": 0,
+             "num_err_log_entries": 0, "unsafe_shutdowns": 1}
+    return extract_health(device, ID_CTRL, smart, datetime(2025, 1, 1, 12, minute))
+
+
+def read_json(path):
+    with open(path) as f:
+        return [json.loads(line)["mean_temperature"] for line in f]
+
+
+def read_binary(path):
+    with open(path, "rb") as f:
+        return [(r["device"], r["mean_temperature"]) for r in BinLogDecoder().decode_all(f.read(), path)]
+
+
+def test_json_writer_follows_a_renamed_log(tmp_path):
+    path = str(tmp_path / "log.json")
+    writer = JsonLogWriter(path)
+    writer.write([health("a", 40)])
+    os.rename(path, path + ".1")
+    writer.write([health("a", 41, 5)])
+    assert read_json(path + ".1") == [40]
+    assert read_json(path) == [41]
+
+
+def test_json_writer_after_copytruncate(tmp_path):
+    path = str(tmp_path / "log.json")
+    writer = JsonLogWriter(path)
+    writer.write([health("a", 40), health("b", 50)])
+    os.truncate(path, 0)
+    writer.write([health("a", 41, 5)])
+    assert read_json(path) == [41]
+
+
+def test_json_writer_ends_a_torn_line(tmp_path):
+    path = tmp_path / "log.json"
+    path.write_text('{"timestamp": "2025-01-01 12:00:00", "dev')
+    JsonLogWriter(str(path)).write([health("a", 40)])
+    lines = path.read_text().splitlines()
+    assert len(lines) == 2 and json.loads(lines[1])["mean_temperature"] == 40
+
+
+def test_binary_writer_defines_devices_in_a_rotated_log(tmp_path):
+    path = str(tmp_path / "log.bin")
+    writer = BinaryLogWriter(path)
+    writer.write([health("a", 40)])
+    os.rename(path, path + ".1")
+    writer.write([health("b", 52, 5), health("a", 41, 5)])
+    assert read_binary(path + ".1") == [("a", 40)]
+    assert read_binary(path) == [("b", 52), ("a", 41)]
+
+
+def test_binary_writer_after_copytruncate(tmp_path):
+    path = str(tmp_path / "log.bin")
+    writer = BinaryLogWriter(path)
+    writer.write([health("a", 40), health("b", 50)])
+    os.truncate(path, 0)
+    writer.write([health("b", 51, 5)])
+    assert read_binary(path) == [("b", 51)]
+
+
+def test_binary_writer_reuses_the_device_ids_in_the_file(tmp_path):
+    path = str(tmp_path / "log.bin")
+    BinaryLogWriter(path).write([health("a", 40)])
+    # A restarted collector, seeing the devices in another order
+    BinaryLogWriter(path).write([health("b", 52, 5), health("a", 41, 5)])
+    assert read_binary(path) == [("a", 40), ("b", 52), ("a", 41)]
+
+
+def test_binary_writer_drops_a_torn_record(tmp_path):
+    path = str(tmp_path / "log.bin")
+    BinaryLogWriter(path).write([health("a", 40)])
+    with open(path, "ab") as f:
+        f.write(b"\0" * 7)
+    BinaryLogWriter(path).write([health("a", 41, 5)])
+    assert read_binary(path) == [("a", 40), ("a", 41)]
+
+
+def test_binary_writer_refuses_another_file(tmp_path):
+    path = tmp_path / "log.bin"
+    path.write_bytes(b"not a binary health log, 32 byte")
+    with pytest.raises(ValueError):
+        BinaryLogWriter(str(path)).write([health("a", 40)])
@@ -0,0 +1,35 @@
+from nvme_mon.rollups import DAY, HOUR, Rollups
+
+
+def counts(buckets):
+    return {start: bucket.stats.count for start, bucket in buckets.items()}
+
+
+def test_out_of_order_records_keep_their_hourly_buckets():
+    rollups = Rollups()
+    for ts in (10 * HOUR, 12 * HOUR, 12 * HOUR + 60, 11 * HOUR + 1800, 12 * HOUR + 300):
+        rollups.add(ts, 40, {"health_score": 100})
+    rollups.flush()
+    assert counts(rollups.hourly) == {10 * HOUR: 1, 11 * HOUR: 1, 12 * HOUR: 3}
+    assert counts(rollups.daily) == {0: 5}
+    assert rollups.query(12 * HOUR, 13 * HOUR).stats.count == 3
+
+
+def test_late_record_for_a_folded_hour():
+    rollups = Rollups()
+    for ts in (HOUR, 2 * HOUR, HOUR + 60, 2 * HOUR + 60):
+        rollups.add(ts, 50, {})
+    rollups.flush()
+    assert counts(rollups.hourly) == {HOUR: 2, 2 * HOUR: 2}
+    assert counts(rollups.daily) == {0: 4}
+
+
+def test_query_merges_days_and_edge_hours():
+    rollups = Rollups()
+    for ts in range(0, 3 * DAY, HOUR):
+        rollups.add(ts, 40 + ts // DAY, {})
+    bucket = rollups.query(DAY - 2 * HOUR, 2 * DAY + 2 * HOUR)
+    assert bucket.stats.count == 28
+    assert bucket.histogram[40][0] == 2
+    assert bucket.histogram[41][0] == 24
+    assert bucket.histogram[42][0] == 2
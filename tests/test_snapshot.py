@@ -0,0 +1,37 @@
+import pytest
+
+from nvme_mon import snapshot
+
+
+@pytest.fixture
+def state_dir(tmp_path, monkeypatch):
+    state = tmp_path / "state"
+    state.mkdir()
+    monkeypatch.setattr(snapshot, "app_data_path", lambda name: state / name)
+    return state
+
+
+def write_log(path, text):
+    path.write_text(text)
+    return path.stat().st_ino, path.stat().st_size
+
+
+def test_snapshots_are_kept_per_log(tmp_path, state_dir):
+    log_a, log_b = tmp_path / "a.json", tmp_path / "b.json"
+    inode_a, size_a = write_log(log_a, '{"a": 1}\n')
+    inode_b, size_b = write_log(log_b, '{"b": 2}\n{"b": 3}\n')
+    snapshot.save_snapshot(str(log_a), inode_a, size_a, {"log": "a"})
+    snapshot.save_snapshot(str(log_b), inode_b, size_b, {"log": "b"})
+
+    assert snapshot.load_snapshot(str(log_a)) == (inode_a, size_a, {"log": "a"})
+    assert snapshot.load_snapshot(str(log_b)) == (inode_b, size_b, {"log": "b"})
+    # No temp files left behind
+    assert len(list(state_dir.iterdir())) == 2
+
+
+def test_snapshot_of_a_rewritten_log_is_ignored(tmp_path, state_dir):
+    log = tmp_path / "log.json"
+    inode, size = write_log(log, '{"a": 1}\n')
+    snapshot.save_snapshot(str(log), inode, size, {})
+    log.write_text('{"b": 2}\n')
+    assert snapshot.load_snapshot(str(log)) is None